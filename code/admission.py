@@ -0,0 +1,218 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+# Seconds between the checks a queued query makes for a slot freed by another worker process
+SHARED_POLL_INTERVAL = 0.005
+
+class Overloaded(Exception):
+    """
+    Raised when a backend is over capacity and a query is shed instead of queued.
+    """
+
+    def __init__(self, ip, reason, retry_after):
+        super().__init__(f"Backend {ip} is overloaded ({reason})")
+        self.ip = ip
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class BackendLimiter:
+    """
+    Concurrency limit of one backend with a bounded FIFO wait queue. A released slot is
+    handed directly to the oldest waiter, so queued queries cannot be overtaken by new ones.
+
+    With shared load (shared_state.BackendLoad), the max_concurrent slots are shared by
+    every worker process: a query takes one from the shared counts, and the oldest waiter
+    polls them every SHARED_POLL_INTERVAL for a slot another process freed.
+    """
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout, alpha=0.2, ip=None, shared=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.alpha = alpha
+        self.ip = ip
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._waiters = deque()
+        self.active = 0
+        # Smoothed time a query holds its slot, in seconds
+        self.hold_ewma = None
+
+        # Stats
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = {"queue_full": 0, "predicted_timeout": 0, "queue_timeout": 0}
+        self.queue_time_total = 0.0
+
+    def _expected_wait(self, position):
+        # Slots free up at max_concurrent / hold time per second
+        if self.hold_ewma is None:
+            return 0.0
+        return position * self.hold_ewma / self.max_concurrent
+
+    def _take_slot(self):
+        # Must be called with the lock held
+        if self.shared is not None:
+            return self.shared.try_admit(self.ip, self.max_concurrent)
+        return self.active < self.max_concurrent
+
+    def _reject(self, ip, reason, position):
+        self.rejected[reason] += 1
+        retry_after = max(1, math.ceil(self._expected_wait(position)))
+        return Overloaded(ip, reason, retry_after)
+
+    def acquire(self, ip, timeout=None):
+        """
+        Takes a slot, waiting in the queue up to queue_timeout (or timeout if shorter) for one.
+
+        Raises:
+            Overloaded: The queue is full, the expected wait exceeds the allowed wait,
+                        or no slot freed up in time.
+        """
+        max_wait = self.queue_timeout if timeout is None else max(0.0, min(self.queue_timeout, timeout))
+        with self._lock:
+            if not self._waiters and self._take_slot():
+                self.active += 1
+                self.admitted += 1
+                return
+            position = len(self._waiters) + 1
+            if len(self._waiters) >= self.max_queue:
+                raise self._reject(ip, "queue_full", position)
+            if self._expected_wait(position) > max_wait:
+                # Shed now rather than after queue_timeout of waiting
+                raise self._reject(ip, "predicted_timeout", position)
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+            self.queued += 1
+
+        start = time.monotonic()
+        if self.shared is None:
+            waiter.event.wait(max_wait)
+        else:
+            self._poll(waiter, start + max_wait)
+        with self._lock:
+            self.queue_time_total += time.monotonic() - start
+            if waiter.granted:
+                self.admitted += 1
+                return
+            self._waiters.remove(waiter)
+            raise self._reject(ip, "queue_timeout", len(self._waiters) + 1)
+
+    def _poll(self, waiter, deadline):
+        """
+        Waits until the waiter is granted a slot, by this process or, once it is the oldest
+        waiter, from the shared counts.
+        """
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or waiter.event.wait(min(remaining, SHARED_POLL_INTERVAL)):
+                return
+            with self._lock:
+                if waiter.granted:
+                    return
+                if self._waiters[0] is waiter and self._take_slot():
+                    self._waiters.popleft()
+                    waiter.granted = True
+                    self.active += 1
+                    return
+
+    def release(self, hold_time):
+        """
+        Frees a slot, handing it to the oldest waiter if there is one.
+        """
+        with self._lock:
+            if self.hold_ewma is None:
+                self.hold_ewma = hold_time
+            else:
+                self.hold_ewma = self.alpha * hold_time + (1 - self.alpha) * self.hold_ewma
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self.active -= 1
+                if self.shared is not None:
+                    self.shared.release_admission(self.ip)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                # Slots held by every worker process, with shared load
+                "active_all_workers": self.shared.admitted(self.ip) if self.shared is not None else self.active,
+                "queue_depth": len(self._waiters),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": dict(self.rejected),
+                "queue_time_total_s": round(self.queue_time_total, 3),
+                "hold_ewma_ms": round(self.hold_ewma * 1000, 3) if self.hold_ewma is not None else None,
+            }
+
+
+class AdmissionController:
+    """
+    Per-backend admission control: at most max_concurrent queries run on a backend, up to
+    max_queue more wait at most queue_timeout seconds, and the rest are rejected at once.
+    With shared load (shared_state.BackendLoad), max_concurrent holds across every worker
+    process; the queues stay per process.
+    """
+
+    def __init__(self, max_concurrent=16, max_queue=64, queue_timeout=1.0, limits=None, shared=None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # Per-backend max_concurrent overrides
+        self.limits = dict(limits or {})
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._limiters = {}
+
+    def limiter(self, ip):
+        limiter = self._limiters.get(ip)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(ip)
+                if limiter is None:
+                    limiter = self._limiters[ip] = BackendLimiter(
+                        self.limits.get(ip, self.max_concurrent), self.max_queue, self.queue_timeout,
+                        ip=ip, shared=self.shared)
+        return limiter
+
+    def acquire(self, ip, timeout=None):
+        """
+        Admits a query on a backend, waiting at most timeout seconds (None for queue_timeout).
+
+        Returns:
+            float: The admission time, to hand back to release().
+
+        Raises:
+            Overloaded: If the query is shed.
+        """
+        self.limiter(ip).acquire(ip, timeout)
+        return time.monotonic()
+
+    def release(self, ip, admitted_at):
+        self.limiter(ip).release(time.monotonic() - admitted_at)
+
+    def stats(self):
+        """
+        Returns the counters of every backend.
+        """
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {ip: limiter.stats() for ip, limiter in limiters.items()}
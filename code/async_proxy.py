@@ -0,0 +1,377 @@
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+import aiomysql
+from aiohttp import web
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from latency_prober import LatencyProber
+from result_cache import ResultCache
+from result_format import RowSet, negotiate_format, render
+from routing import cache_bypassed, cache_key, least_busy, parse_params, power_of_two
+from sql_classifier import classify, READ_KINDS
+from weighted_balancer import WeightedBalancer
+
+# Asyncio alternative to proxy.py: every query is awaited on a non-blocking MySQL
+# connection, so one process keeps thousands of queries in flight instead of one per
+# server thread. It serves the single-statement routes of proxy.py with the same
+# parameters (?params=, ?cache=) and response formats, for the strategies in STRATEGIES;
+# the features that need proxy.py's background monitors or blocking pools (lag_aware,
+# /batch, streaming, consistency tokens, write batching, hedging, sharding) are not served.
+
+# Read routing strategies served, one route each
+STRATEGIES = ["direct", "random", "customized", "least_outstanding", "power_of_two", "weighted"]
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Load configuration from JSON file
+with open("config.json", "r") as config_file:
+    config = json.load(config_file)
+
+manager_ip = config["manager_ip"]
+worker_ips = config["worker_ips"]
+
+# MySQL credentials
+db_user = "replica_user"
+db_password = "1234"
+db_name = "sakila"
+
+# Track active requests per worker (includes manager for writes and direct reads).
+# Everything runs on the event loop thread, so no lock is needed.
+worker_request_count = defaultdict(int)
+for ip in worker_ips:
+    worker_request_count[ip] = 0
+worker_request_count[manager_ip] = 0  # Include manager_ip explicitly
+
+# Smoothed query latency (ms) of every backend, for power-of-two routing
+routing_config = config.get("routing", {})
+LATENCY_EWMA_ALPHA = routing_config.get("latency_ewma_alpha", 0.2)
+backend_latency = {}
+
+# Connection pool settings (optional "pool" section in config.json)
+pool_config = config.get("pool", {})
+POOL_MIN_SIZE = pool_config.get("min_size", 2)
+POOL_MAX_SIZE = pool_config.get("async_max_size", 100)
+POOL_IDLE_TIMEOUT = pool_config.get("idle_timeout", 300)  # seconds
+
+# One aiomysql pool per backend (manager and every worker), created on startup
+pools = {}
+
+# Latency of the workers, probed with TCP connects from a background thread
+prober_config = config.get("prober", {})
+prober = LatencyProber(
+    backends=worker_ips,
+    interval=prober_config.get("interval", 1.0),
+    mode="tcp",
+    alpha=prober_config.get("alpha", 0.3),
+    window=prober_config.get("window", 50),
+    stale_after=prober_config.get("stale_after", 5.0),
+    max_failures=prober_config.get("max_failures", 3)
+)
+
+# Weighted routing of reads (optional "weighted" section in config.json)
+weighted_config = config.get("weighted", {})
+weighted_balancer = WeightedBalancer(
+    backends=worker_ips,
+    weights=weighted_config.get("weights", {}),  # worker IP -> static weight, e.g. proportional to its vCPUs
+    default_weight=weighted_config.get("default_weight", 1),
+    adaptive=weighted_config.get("adaptive", False),  # adjust the weights from observed latency and throughput
+    adapt_interval=weighted_config.get("adapt_interval", 5.0),  # seconds between adjustments
+    min_factor=weighted_config.get("min_factor", 0.25),  # bounds of the adjustment, relative to the static weight
+    max_factor=weighted_config.get("max_factor", 4.0)
+)
+
+# Read result cache (optional "cache" section in config.json)
+cache_config = config.get("cache", {})
+CACHE_ENABLED = cache_config.get("enabled", True)
+result_cache = ResultCache(
+    max_bytes=cache_config.get("max_bytes", 64 * 1024 * 1024),
+    ttl=cache_config.get("ttl", 30.0),
+    max_entry_bytes=cache_config.get("max_entry_bytes", 1024 * 1024)
+)
+
+
+async def init_pools(app):
+    """
+    Opens an aiomysql pool for the manager and each worker when the server starts.
+    """
+    for ip in [manager_ip] + worker_ips:
+        try:
+            pools[ip] = await aiomysql.create_pool(
+                host=ip,
+                user=db_user,
+                password=db_password,
+                db=db_name,
+                port=3306,
+                minsize=POOL_MIN_SIZE,
+                maxsize=POOL_MAX_SIZE,
+                pool_recycle=POOL_IDLE_TIMEOUT
+            )
+        except Exception as e:
+            logging.error(f"Failed to open connection pool to {ip}: {str(e)}")
+    prober.start()
+
+
+async def close_pools(app):
+    """
+    Closes every pool when the server shuts down.
+    """
+    prober.stop()
+    for pool in pools.values():
+        pool.close()
+        await pool.wait_closed()
+
+
+async def execute_query(target_ip, query, params=None):
+    """
+    Executes a MySQL query on the specified target IP without blocking the event loop.
+    A query with params is a template with one %s placeholder per parameter.
+    """
+    try:
+        pool = pools.get(target_ip)
+        if pool is None:
+            raise ConnectionError(f"No connection pool to {target_ip}")
+        start = time.perf_counter()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, tuple(params) if params is not None else None)
+                classification = classify(query)
+                if classification.kind in READ_KINDS:
+                    result = RowSet([column[0] for column in cursor.description or ()], list(await cursor.fetchall()))
+                else:
+                    result = {"status": "success"}
+                if not classification.is_read:
+                    await connection.commit()
+                else:
+                    # Keep the next checkout from reading an old snapshot
+                    await connection.rollback()
+        record_query_latency(target_ip, (time.perf_counter() - start) * 1000)
+        return result
+    except Exception as e:
+        logging.error(f"Error executing query on {target_ip}: {str(e)}")
+        return {"error": str(e)}
+
+
+def record_query_latency(ip, latency_ms):
+    """
+    Folds a measured query latency into the backend's EWMA.
+    """
+    previous = backend_latency.get(ip)
+    backend_latency[ip] = latency_ms if previous is None else (
+        LATENCY_EWMA_ALPHA * latency_ms + (1 - LATENCY_EWMA_ALPHA) * previous)
+    weighted_balancer.record(ip, latency_ms)
+
+
+def select_read_target(strategy):
+    """
+    Picks the backend that serves a read under the given routing strategy, as proxy.py does.
+    """
+    if strategy == "random":
+        return random.choice(worker_ips)
+    if strategy == "customized":
+        # Fastest worker from the last probe round, random worker if every measurement is stale
+        return prober.fastest() or random.choice(worker_ips)
+    if strategy == "least_outstanding":
+        return least_busy(worker_ips, worker_request_count.__getitem__)
+    if strategy == "power_of_two":
+        return power_of_two(worker_ips, worker_request_count.__getitem__, backend_latency.get)
+    if strategy == "weighted":
+        # None if every worker has weight 0
+        return weighted_balancer.pick(worker_ips) or random.choice(worker_ips)
+    # Direct: reads go to the manager too
+    return manager_ip
+
+
+def choose_target(strategy, query):
+    """
+    Routes a query: reads follow the strategy, writes always go to the manager.
+    """
+    if classify(query).is_read:
+        return select_read_target(strategy)
+    return manager_ip
+
+
+def result_response(request, result):
+    """
+    Serializes a query result with result_format, in the format the client asked for in its
+    Accept header, like proxy.py.
+    """
+    accept = parse_accept_header(request.headers.get("Accept"), MIMEAccept)
+    body, content_type = render(result, negotiate_format(accept))
+    return web.Response(body=body, content_type=content_type)
+
+
+async def forward_query(request, target_ip, query):
+    """
+    Runs the query on the chosen backend while tracking it as in flight, and builds the response.
+    Reads are served from the result cache when possible; writes invalidate the tables they touch.
+    A parameterized query sends its parameters as a JSON list in ?params=.
+    """
+    try:
+        params = parse_params(request.query.get("params"))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    classification = classify(query)
+    is_read = classification.is_read
+    tables = classification.tables
+    use_cache = (CACHE_ENABLED and is_read and not cache_bypassed(request.query, request.headers)
+                 and ResultCache.is_cacheable(query))
+
+    if use_cache:
+        key = cache_key(query, params)
+        cached = result_cache.get(key)
+        if cached is not None:
+            logging.info(f"Serving query from cache: {query}")
+            return result_response(request, cached)
+        versions = result_cache.versions(tables)
+
+    logging.info(f"Routing query to {target_ip}: {query}")
+
+    worker_request_count[target_ip] += 1
+    try:
+        result = await execute_query(target_ip, query, params)
+    finally:
+        worker_request_count[target_ip] -= 1
+
+    if not is_read:
+        if tables:
+            result_cache.invalidate_tables(tables)
+        else:
+            result_cache.clear()
+    elif use_cache and not (isinstance(result, dict) and "error" in result):
+        # Replication lag is not tracked here: a replica read is only cached once no write
+        # to its tables happened within the cache TTL before it
+        write_window = result_cache.ttl if target_ip in worker_ips else None
+        result_cache.put(key, tables, result, versions, write_window)
+    return result_response(request, result)
+
+
+async def direct_hit(request):
+    """
+    Direct routing: All queries, including reads (SELECT) and writes, go to the manager.
+    """
+    query = request.query.get("query")
+    if not query:
+        return web.json_response({"error": "Query parameter is missing"}, status=400)
+    return await forward_query(request, choose_target("direct", query), query)
+
+
+async def random_hit(request):
+    """
+    Random routing: Reads go to a random worker, writes go to manager.
+    """
+    query = request.query.get("query")
+    if not query:
+        return web.json_response({"error": "Query parameter is missing"}, status=400)
+    return await forward_query(request, choose_target("random", query), query)
+
+
+async def customized_hit(request):
+    """
+    Customized routing: Reads go to the worker with the lowest smoothed latency.
+    Writes always go to the manager.
+    """
+    query = request.query.get("query")
+    if not query:
+        return web.json_response({"error": "Query parameter is missing"}, status=400)
+    return await forward_query(request, choose_target("customized", query), query)
+
+
+async def least_outstanding_hit(request):
+    """
+    Least-outstanding-requests routing: Reads go to the worker with the fewest
+    in-flight queries. Writes always go to the manager.
+    """
+    query = request.query.get("query")
+    if not query:
+        return web.json_response({"error": "Query parameter is missing"}, status=400)
+    return await forward_query(request, choose_target("least_outstanding", query), query)
+
+
+async def power_of_two_hit(request):
+    """
+    Power-of-two-choices routing: Reads go to the better of two random workers,
+    weighted by in-flight queries and EWMA query latency. Writes always go to the manager.
+    """
+    query = request.query.get("query")
+    if not query:
+        return web.json_response({"error": "Query parameter is missing"}, status=400)
+    return await forward_query(request, choose_target("power_of_two", query), query)
+
+
+async def weighted_hit(request):
+    """
+    Weighted routing: Reads are spread over the workers by smooth weighted round-robin.
+    Writes always go to the manager.
+    """
+    query = request.query.get("query")
+    if not query:
+        return web.json_response({"error": "Query parameter is missing"}, status=400)
+    return await forward_query(request, choose_target("weighted", query), query)
+
+
+async def request_counts(request):
+    """
+    Returns the number of in-flight queries per backend.
+    """
+    return web.json_response(dict(worker_request_count))
+
+
+async def pool_stats(request):
+    """
+    Returns the usage of every aiomysql pool.
+    """
+    return web.json_response({
+        ip: {"size": pool.size, "free": pool.freesize, "in_use": pool.size - pool.freesize,
+             "min_size": pool.minsize, "max_size": pool.maxsize}
+        for ip, pool in pools.items()
+    })
+
+
+async def cache_stats(request):
+    """
+    Returns the result cache counters.
+    """
+    return web.json_response(result_cache.stats())
+
+
+async def weight_stats(request):
+    """
+    Returns the static and effective weight of every worker.
+    """
+    return web.json_response(weighted_balancer.snapshot())
+
+
+async def latency_stats(request):
+    """
+    Returns the latency table maintained by the background prober.
+    """
+    return web.json_response(prober.snapshot())
+
+
+def create_app():
+    app = web.Application()
+    handlers = {"direct": direct_hit, "random": random_hit, "customized": customized_hit,
+                "least_outstanding": least_outstanding_hit, "power_of_two": power_of_two_hit,
+                "weighted": weighted_hit}
+    for strategy in STRATEGIES:
+        for method in ("POST", "GET", "PUT", "DELETE"):
+            app.router.add_route(method, f"/{strategy}", handlers[strategy])
+    app.router.add_get("/request_counts", request_counts)
+    app.router.add_get("/pool_stats", pool_stats)
+    app.router.add_get("/cache_stats", cache_stats)
+    app.router.add_get("/weights", weight_stats)
+    app.router.add_get("/latency", latency_stats)
+    app.on_startup.append(init_pools)
+    app.on_cleanup.append(close_pools)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host="0.0.0.0", port=8000, backlog=4096)
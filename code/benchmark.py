@@ -52,6 +52,56 @@ def benchmark_requests(gatekeeper_url, payload, num_requests):
 
 
 
+def timed_request(gatekeeper_url, payload):
+    """
+    Sends a request to the Gatekeeper and measures its latency.
+
+    Returns:
+        tuple: (JSON response or error message, latency in milliseconds)
+    """
+    start_time = time.perf_counter()
+    result = send_request(gatekeeper_url, payload)
+    return result, (time.perf_counter() - start_time) * 1000
+
+
+def benchmark_latencies(gatekeeper_url, payload, num_requests):
+    """
+    Sends concurrent requests to the Gatekeeper and reports latency percentiles,
+    to compare the tail latency of the routing strategies.
+
+    Args:
+        gatekeeper_url (str): The Gatekeeper's URL.
+        payload (dict): The request payload containing query type, query, and strategy.
+        num_requests (int): The number of requests to send.
+
+    Returns:
+        dict: p50, p95, p99 and max latency in milliseconds, plus the error count.
+    """
+    latencies = []
+    errors = 0
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = [executor.submit(timed_request, gatekeeper_url, payload) for _ in range(num_requests)]
+        for future in concurrent.futures.as_completed(futures):
+            result, latency = future.result()
+            latencies.append(latency)
+            if isinstance(result, dict) and "error" in result:
+                errors += 1
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    return {
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": latencies[-1],
+        "errors": errors,
+    }
+
+
+
 # def warm_up(gatekeeper_url, read_query, write_query):
 #     """
 #     Sends warm-up requests to the Gatekeeper for both read and write operations.
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pymysql
+
+from connection_pool import PoolTimeout
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_backend_failure(error):
+    """
+    Returns True if an error means the backend itself is unreachable or unhealthy,
+    as opposed to a problem with the query (syntax error, duplicate key, ...) or the proxy
+    running out of pooled connections.
+    """
+    if isinstance(error, PoolTimeout):
+        return False
+    if isinstance(error, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+        # 2xxx are client errors (lost connection, can't connect, ...); 1xxx and 3xxx are
+        # server-side errors about the statement (lock wait timeout, MAX_EXECUTION_TIME, NOWAIT, ...)
+        code = error.args[0] if error.args and isinstance(error.args[0], int) else 0
+        return code == 0 or 2000 <= code < 3000
+    return isinstance(error, (TimeoutError, ConnectionError, OSError))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one backend.
+
+    Closed: traffic flows; consecutive failures are counted.
+    Open: after failure_threshold consecutive failures, the backend gets no traffic
+          for open_timeout seconds.
+    Half-open: once open_timeout elapsed, a single health probe is let through;
+               success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=3, open_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+
+class BreakerRegistry:
+    """
+    Thread-safe circuit breakers of every backend.
+    """
+
+    def __init__(self, backends, failure_threshold=3, open_timeout=5.0):
+        self.failure_threshold = failure_threshold
+        self.open_timeout = open_timeout
+        self._lock = threading.Lock()
+        self._breakers = {ip: CircuitBreaker(failure_threshold, open_timeout) for ip in backends}
+
+    def _breaker(self, ip):
+        breaker = self._breakers.get(ip)
+        if breaker is None:
+            breaker = self._breakers[ip] = CircuitBreaker(self.failure_threshold, self.open_timeout)
+        return breaker
+
+    def _refresh(self, breaker, now):
+        if breaker.state == OPEN and now - breaker.opened_at >= breaker.open_timeout:
+            breaker.state = HALF_OPEN
+            breaker.trial_in_flight = False
+
+    def available(self, candidates):
+        """
+        Returns the candidates whose breaker is closed. Half-open backends are left to
+        the health probes, so regular traffic never waits on a backend that may still be down.
+        """
+        now = time.monotonic()
+        with self._lock:
+            result = []
+            for ip in candidates:
+                breaker = self._breaker(ip)
+                self._refresh(breaker, now)
+                if breaker.state == CLOSED:
+                    result.append(ip)
+            return result
+
+    def record_success(self, ip):
+        with self._lock:
+            breaker = self._breaker(ip)
+            breaker.state = CLOSED
+            breaker.consecutive_failures = 0
+            breaker.trial_in_flight = False
+
+    def record_failure(self, ip):
+        with self._lock:
+            breaker = self._breaker(ip)
+            breaker.consecutive_failures += 1
+            breaker.trial_in_flight = False
+            if breaker.state == HALF_OPEN or breaker.consecutive_failures >= breaker.failure_threshold:
+                if breaker.state != OPEN:
+                    breaker.times_opened += 1
+                breaker.state = OPEN
+                breaker.opened_at = time.monotonic()
+
+    def due_for_probe(self):
+        """
+        Returns the half-open backends and marks their trial probe as in flight.
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = []
+            for ip, breaker in self._breakers.items():
+                self._refresh(breaker, now)
+                if breaker.state == HALF_OPEN and not breaker.trial_in_flight:
+                    breaker.trial_in_flight = True
+                    due.append(ip)
+            return due
+
+    def state(self, ip):
+        with self._lock:
+            breaker = self._breaker(ip)
+            self._refresh(breaker, time.monotonic())
+            return breaker.state
+
+    def set_backends(self, backends):
+        """
+        Keeps breakers for the given backends only.
+        """
+        with self._lock:
+            for ip in list(self._breakers):
+                if ip not in backends:
+                    del self._breakers[ip]
+            for ip in backends:
+                self._breaker(ip)
+
+    def snapshot(self):
+        """
+        Returns the state of every breaker.
+        """
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for ip, breaker in self._breakers.items():
+                self._refresh(breaker, now)
+                result[ip] = {
+                    "state": breaker.state,
+                    "consecutive_failures": breaker.consecutive_failures,
+                    "times_opened": breaker.times_opened,
+                    "open_for_s": round(now - breaker.opened_at, 3) if breaker.state != CLOSED else None,
+                }
+            return result
@@ -0,0 +1,257 @@
+import pymysql
+import threading
+import time
+import logging
+from collections import deque
+
+
+class PoolTimeout(TimeoutError):
+    """
+    Raised when no pooled connection frees up within the checkout timeout: the proxy is
+    saturated, the backend itself may be fine.
+    """
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of MySQL connections to a single backend.
+
+    Connections are opened ahead of time up to min_size, grown on demand up to
+    max_size, pinged on checkout and closed once they sit idle for longer than
+    idle_timeout seconds (never going below min_size).
+    """
+
+    def __init__(self, host, user, password, database, port=3306,
+                 min_size=2, max_size=10, idle_timeout=300, checkout_timeout=5,
+                 connect_timeout=5):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.port = port
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.connect_timeout = connect_timeout
+
+        # Idle connections as (connection, time it was returned)
+        self._idle = deque()
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Stats
+        self._waits = 0
+        self._wait_time = 0.0
+        self._created = 0
+        self._evicted = 0
+
+    def _connect(self):
+        """
+        Opens a new connection to the backend.
+        """
+        connection = pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            port=self.port,
+            connect_timeout=self.connect_timeout
+        )
+        with self._cond:
+            self._created += 1
+        return connection
+
+    def _size(self):
+        return self._in_use + len(self._idle)
+
+    def warm_up(self):
+        """
+        Opens connections until the pool holds min_size of them.
+        Errors are logged so an unreachable backend does not stop the proxy from starting.
+        """
+        while True:
+            with self._cond:
+                if self._closed or self._size() >= self.min_size:
+                    return
+            try:
+                connection = self._connect()
+            except Exception as e:
+                logging.error(f"Failed to pre-open connection to {self.host}: {str(e)}")
+                return
+            with self._cond:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+
+    def _evict_idle(self):
+        """
+        Closes connections idle for longer than idle_timeout. Must be called with the lock held.
+        Returns the list of connections to close outside of the lock.
+        """
+        expired = []
+        now = time.monotonic()
+        # Oldest idle connections sit on the left
+        while self._idle and self._size() > self.min_size:
+            connection, returned_at = self._idle[0]
+            if now - returned_at < self.idle_timeout:
+                break
+            self._idle.popleft()
+            expired.append(connection)
+        self._evicted += len(expired)
+        return expired
+
+    def reap(self):
+        """
+        Closes idle connections past idle_timeout. Meant to be called periodically
+        so quiet pools shrink back to min_size even without checkouts.
+        """
+        with self._cond:
+            expired = self._evict_idle()
+        for connection in expired:
+            self._close_quietly(connection)
+
+    def acquire(self):
+        """
+        Checks a live connection out of the pool, opening a new one if the pool is not full.
+
+        Returns:
+            pymysql.connections.Connection: A connection that answered a ping.
+
+        Raises:
+            PoolTimeout: If no connection frees up within checkout_timeout.
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        wait_start = None
+        while True:
+            with self._cond:
+                expired = self._evict_idle()
+                connection = None
+                open_new = False
+                while connection is None and not open_new:
+                    if self._closed:
+                        raise RuntimeError(f"Connection pool for {self.host} is closed")
+                    if self._idle:
+                        # Most recently used connection is the most likely to be alive
+                        connection, _ = self._idle.pop()
+                    elif self._size() < self.max_size:
+                        open_new = True
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise PoolTimeout(f"Timed out waiting for a connection to {self.host}")
+                        if not waited:
+                            waited = True
+                            wait_start = time.monotonic()
+                            self._waits += 1
+                        self._cond.wait(remaining)
+                self._in_use += 1
+                if waited:
+                    self._wait_time += time.monotonic() - wait_start
+                    waited = False
+
+            for stale in expired:
+                self._close_quietly(stale)
+
+            if open_new:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+
+            # Liveness check on checkout, reconnecting transparently if the server dropped us
+            try:
+                connection.ping(reconnect=True)
+                return connection
+            except Exception as e:
+                logging.warning(f"Discarding dead connection to {self.host}: {str(e)}")
+                self._close_quietly(connection)
+                self._release_slot()
+
+    def release(self, connection, discard=False):
+        """
+        Returns a connection to the pool.
+
+        Args:
+            connection: The connection obtained from acquire().
+            discard (bool): Close the connection instead of reusing it (e.g. after an error).
+        """
+        if not discard:
+            try:
+                # Never hand out a connection with an open transaction
+                connection.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._cond.notify()
+            else:
+                self._idle.append((connection, time.monotonic()))
+                self._cond.notify()
+                return
+        self._close_quietly(connection)
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Closes every idle connection and refuses further checkouts.
+        Connections still in use are closed when they are released.
+        """
+        with self._cond:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for connection in idle:
+            self._close_quietly(connection)
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool usage counters.
+        """
+        with self._cond:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+                "min_size": self.min_size,
+                "created": self._created,
+                "evicted": self._evicted,
+                "waits": self._waits,
+                "wait_time_ms": round(self._wait_time * 1000, 3),
+            }
+
+
+class PooledConnection:
+    """
+    Context manager that checks a connection out of a pool and returns it on exit.
+    The connection is discarded instead of reused if the block raised a connection-level error.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+
+    def __enter__(self):
+        self.connection = self.pool.acquire()
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        broken = exc_type is not None and issubclass(
+            exc_type, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
+        self.pool.release(self.connection, discard=broken)
+        return False
@@ -0,0 +1,134 @@
+import logging
+import re
+
+import pymysql
+
+from connection_pool import PooledConnection
+
+
+# Consistency tokens handed to clients after a write:
+#   "gtid:<executed GTID set>"       when the manager runs with gtid_mode=ON
+#   "binlog:<file>:<position>"       otherwise (file/position replication, as set up by run_code)
+GTID_PREFIX = "gtid:"
+BINLOG_PREFIX = "binlog:"
+
+BINLOG_TOKEN_PATTERN = re.compile(r"^binlog:([\w.\-]+):(\d+)$")
+
+
+def parse_binlog_token(token):
+    """
+    Returns (file, position) of a binlog token, or None if it is not one.
+    """
+    match = BINLOG_TOKEN_PATTERN.match(token)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+def is_valid_token(token):
+    if token.startswith(GTID_PREFIX):
+        return len(token) > len(GTID_PREFIX)
+    return parse_binlog_token(token) is not None
+
+
+def binlog_reached(file, position, token_file, token_position):
+    """
+    Returns True if the binlog coordinates (file, position) are at or past the token's.
+    Binlog file names end in an increasing sequence number (mysql-bin.000042).
+    """
+    if file == token_file:
+        return position >= token_position
+    return file > token_file
+
+
+class ConsistencyTracker:
+    """
+    Issues consistency tokens after writes on the manager and checks that a replica
+    applied a token before it serves a read carrying it.
+    """
+
+    def __init__(self, manager_pool, mode="auto", wait_timeout=0.05):
+        self.manager_pool = manager_pool
+        self.mode = mode
+        self.wait_timeout = wait_timeout
+        self._gtid = None if mode == "auto" else mode == "gtid"
+
+    def _uses_gtid(self, cursor):
+        if self._gtid is None:
+            cursor.execute("SELECT @@GLOBAL.gtid_mode")
+            row = cursor.fetchone()
+            self._gtid = bool(row) and str(row[0]).upper() == "ON"
+        return self._gtid
+
+    def read_token(self, cursor):
+        """
+        Reads the position of the backend a cursor is connected to. Taken on the connection
+        of a write right after it committed, it covers that write.
+
+        Returns:
+            str: The consistency token, or None if it could not be read.
+        """
+        try:
+            if self._uses_gtid(cursor):
+                cursor.execute("SELECT @@GLOBAL.gtid_executed")
+                return GTID_PREFIX + cursor.fetchone()[0].replace("\n", "")
+            # File, Position, Binlog_Do_DB, ...
+            cursor.execute("SHOW MASTER STATUS")
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return f"{BINLOG_PREFIX}{row[0]}:{row[1]}"
+        except pymysql.err.MySQLError as e:
+            logging.error(f"Failed to read consistency token: {str(e)}")
+            return None
+
+    def current_token(self, pool=None):
+        """
+        Reads the current position of a manager (the tracker's manager by default) on a
+        connection of its pool, for writes that did not run on a connection of their own.
+
+        Returns:
+            str: The consistency token, or None if it could not be read.
+        """
+        try:
+            with PooledConnection(pool or self.manager_pool) as connection:
+                with connection.cursor() as cursor:
+                    return self.read_token(cursor)
+        except Exception as e:
+            logging.error(f"Failed to read consistency token from manager: {str(e)}")
+            return None
+
+    @staticmethod
+    def known_caught_up(replica_status, token):
+        """
+        Checks a replica's last polled status (see ReplicationMonitor.snapshot) against a binlog
+        token without a round trip. Positions only move forward, so a replica that was caught
+        up when polled still is.
+        """
+        coordinates = parse_binlog_token(token)
+        if coordinates is None or not replica_status:
+            return False
+        file = replica_status.get("master_log_file")
+        position = replica_status.get("exec_position")
+        if file is None or position is None:
+            return False
+        return binlog_reached(file, position, *coordinates)
+
+    def wait_for(self, cursor, token):
+        """
+        Waits up to wait_timeout on a replica connection for the token to be applied.
+
+        Returns:
+            bool: True if the replica caught up, so reads on this connection see the write.
+        """
+        if token.startswith(GTID_PREFIX):
+            # 0 once the set is applied, 1 on timeout
+            cursor.execute("SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s)",
+                           (token[len(GTID_PREFIX):], self.wait_timeout))
+            row = cursor.fetchone()
+            return row is not None and row[0] == 0
+        file, position = parse_binlog_token(token)
+        # Events waited for (>= 0) once applied, -1 on timeout, NULL if not replicating
+        cursor.execute("SELECT MASTER_POS_WAIT(%s, %s, %s)", (file, position, self.wait_timeout))
+        row = cursor.fetchone()
+        return row is not None and row[0] is not None and row[0] >= 0
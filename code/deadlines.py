@@ -0,0 +1,201 @@
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+
+from connection_pool import ConnectionPool, PooledConnection
+
+
+# Header carrying what is left of a request's time budget, in milliseconds
+BUDGET_HEADER = "X-Request-Budget-Ms"
+
+# Connections per backend kept for KILL QUERY, apart from the pool the runaway queries may exhaust
+KILL_POOL_SIZE = 2
+KILL_CHECKOUT_TIMEOUT = 1.0  # seconds
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a query runs out of its time budget.
+    """
+
+
+def parse_budget(value):
+    """
+    Returns the budget of a BUDGET_HEADER value in seconds, or None if it is missing or invalid.
+    """
+    try:
+        budget = int(value)
+    except (TypeError, ValueError):
+        return None
+    return budget / 1000 if budget >= 0 else None
+
+
+def set_max_execution_time(connection, cursor, remaining):
+    """
+    Caps the SELECTs of a pooled connection at the remaining budget (0 lifts the cap).
+    The value is rounded up to whole seconds and remembered on the connection with the
+    MySQL thread id of its session, so the SET is only sent when it changes or when a
+    reconnect (ping(reconnect=True)) started a new session; the watchdog enforces the
+    exact deadline.
+    """
+    limit_ms = int(math.ceil(remaining)) * 1000 if remaining else 0
+    thread_id, current_ms = getattr(connection, "_max_execution_time", (None, 0))
+    if thread_id != connection.thread_id():
+        # A new session starts without a limit
+        current_ms = 0
+    if current_ms != limit_ms:
+        cursor.execute("SET SESSION MAX_EXECUTION_TIME = %s", (limit_ms,))
+        connection._max_execution_time = (connection.thread_id(), limit_ms)
+
+
+class _Watch:
+    __slots__ = ("ip", "thread_id", "deadline", "state", "killed")
+
+    def __init__(self, ip, thread_id, deadline):
+        self.ip = ip
+        self.thread_id = thread_id
+        self.deadline = deadline
+        self.state = "running"  # "running", "killing" or "done"
+        self.killed = threading.Event()
+
+
+class QueryWatchdog:
+    """
+    One background thread that sends KILL QUERY for statements still running past their
+    deadline, so an abandoned query stops using the backend. Kills go through a small pool
+    of their own per backend, so they still get a connection when the queries they target
+    hold every connection of the backend's pool.
+    """
+
+    def __init__(self, pools):
+        self.pools = pools
+        self._kill_pools = {}
+        self._kill_pools_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap = []
+        self._order = itertools.count()
+        self.kills = 0
+        self.cancels = 0
+        self.kill_failures = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def watch(self, ip, thread_id, deadline):
+        """
+        Starts watching a statement about to run on the connection with the given MySQL thread id.
+        Without a deadline, the statement is only registered so cancel() can kill it.
+
+        Returns:
+            The handle to pass to unwatch() once the statement returned.
+        """
+        watch = _Watch(ip, thread_id, deadline)
+        if deadline is None:
+            return watch
+        with self._lock:
+            heapq.heappush(self._heap, (deadline, next(self._order), watch))
+            if self._heap[0][2] is watch:
+                self._wakeup.notify()
+        return watch
+
+    def cancel(self, watch):
+        """
+        Kills a watched statement now, from the calling thread.
+
+        Returns:
+            bool: False if the statement already returned or is being killed.
+        """
+        with self._lock:
+            if watch.state != "running":
+                return False
+            watch.state = "killing"
+        self._kill(watch, cancelled=True)
+        return True
+
+    def unwatch(self, watch):
+        """
+        Stops watching a statement. If a KILL QUERY for it is on its way, waits for it so it
+        cannot hit the next statement run on the same connection.
+
+        Returns:
+            bool: True if the statement was killed.
+        """
+        with self._lock:
+            state = watch.state
+            watch.state = "done"
+        if state == "killing":
+            watch.killed.wait()
+            return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    # Finished (or already cancelled) statements are dropped lazily
+                    while self._heap and self._heap[0][2].state != "running":
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0][0] <= time.monotonic():
+                        _, _, watch = heapq.heappop(self._heap)
+                        watch.state = "killing"
+                        break
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._wakeup.wait(timeout)
+            self._kill(watch)
+
+    def _kill_pool(self, ip):
+        """
+        Returns the pool of the KILL QUERY connections to a backend, with the settings of its query pool.
+        """
+        with self._kill_pools_lock:
+            pool = self._kill_pools.get(ip)
+            if pool is None:
+                source = self.pools[ip]
+                pool = self._kill_pools[ip] = ConnectionPool(
+                    host=source.host,
+                    user=source.user,
+                    password=source.password,
+                    database=source.database,
+                    port=source.port,
+                    min_size=0,
+                    max_size=KILL_POOL_SIZE,
+                    idle_timeout=source.idle_timeout,
+                    checkout_timeout=KILL_CHECKOUT_TIMEOUT,
+                    connect_timeout=source.connect_timeout
+                )
+        return pool
+
+    def forget(self, ip):
+        """
+        Closes the KILL QUERY connections to a backend removed from the topology.
+        """
+        with self._kill_pools_lock:
+            pool = self._kill_pools.pop(ip, None)
+        if pool is not None:
+            pool.close()
+
+    def _kill(self, watch, cancelled=False):
+        try:
+            with PooledConnection(self._kill_pool(watch.ip)) as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"KILL QUERY {int(watch.thread_id)}")
+            if cancelled:
+                self.cancels += 1
+                logging.info(f"Cancelled query on {watch.ip} (thread {watch.thread_id})")
+            else:
+                self.kills += 1
+                logging.warning(f"Killed query past its deadline on {watch.ip} (thread {watch.thread_id})")
+        except Exception as e:
+            # The statement may have finished in the meantime
+            self.kill_failures += 1
+            logging.error(f"Failed to kill query on {watch.ip} (thread {watch.thread_id}): {str(e)}")
+        finally:
+            watch.killed.set()
+
+    def stats(self):
+        with self._lock:
+            return {"watched": sum(1 for _, _, watch in self._heap if watch.state == "running"),
+                    "kills": self.kills, "cancels": self.cancels, "kill_failures": self.kill_failures}
@@ -0,0 +1,107 @@
+import time
+
+from flask import request, Response
+
+
+# Request validation and deadline helpers shared by gatekeeper.py and trusted.py, the two hops
+# that check a request and forward it towards the proxy.
+
+# Routing strategies served by the proxy
+STRATEGIES = ["direct", "random", "customized", "lag_aware", "least_outstanding", "power_of_two", "weighted"]
+
+# End-to-end time budget of a request; each hop passes what is left of it in BUDGET_HEADER (ms)
+BUDGET_HEADER = "X-Request-Budget-Ms"
+HOP_MARGIN = 0.05  # seconds kept back so the next hop gives up first and answers with a clean error
+
+
+def validate_statement(data):
+    """
+    Checks the type, query and strategy of one statement.
+
+    Returns:
+        str: The validation error, or None if the statement is valid.
+    """
+    if data.get("type") not in ["read", "write"]:
+        return "Invalid query type"
+
+    if not data.get("query"):
+        return "No query provided"
+
+    if data.get("strategy", "direct") not in STRATEGIES:  # Default strategy is direct
+        return "Invalid strategy"
+
+    params = data.get("params")
+    if params is not None and not (isinstance(params, list) and all(
+            value is None or isinstance(value, (str, int, float, bool)) for value in params)):
+        return "Invalid params"
+
+    if not valid_timeout(data.get("timeout")):
+        return "Invalid timeout"
+
+    return None
+
+
+def valid_timeout(timeout):
+    return timeout is None or (isinstance(timeout, (int, float)) and not isinstance(timeout, bool) and timeout > 0)
+
+
+def validate_batch(data):
+    """
+    Checks a batch request: a non-empty list of valid statements.
+
+    Returns:
+        str: The validation error, or None if the batch is valid.
+    """
+    statements = data.get("statements")
+    if not statements or not isinstance(statements, list):
+        return "No statements provided"
+
+    if not valid_timeout(data.get("timeout")):
+        return "Invalid timeout"
+
+    for position, statement in enumerate(statements):
+        if not isinstance(statement, dict):
+            return f"Statement {position}: invalid format"
+        error = validate_statement(statement)
+        if error:
+            return f"Statement {position}: {error}"
+
+    return None
+
+
+def time_left(deadline):
+    # requests rejects a zero or negative timeout
+    return max(0.001, deadline - time.monotonic())
+
+
+def budget_headers(deadline):
+    """
+    Returns the header passing what is left of the budget, minus HOP_MARGIN, to the next hop.
+    """
+    remaining = deadline - time.monotonic() - HOP_MARGIN
+    return {BUDGET_HEADER: str(max(0, int(remaining * 1000)))}
+
+
+def relayed_error(response):
+    """
+    Relays an error the next hop answered itself as is: a 4xx (the request was rejected, with
+    the reason in the body), a 503 (shed by admission control, with its Retry-After hint) or a
+    504 (out of time). Returns None for any other status.
+    """
+    if not (400 <= response.status_code < 500 or response.status_code in (503, 504)):
+        return None
+    headers = {"Retry-After": response.headers["Retry-After"]} if "Retry-After" in response.headers else {}
+    return Response(response.content, status=response.status_code,
+                    content_type=response.headers.get("Content-Type"), headers=headers)
+
+
+def request_strategy():
+    """
+    Returns the routing strategy of the current request for the metrics labels, or "".
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and data.get("query"):
+        strategy = data.get("strategy", "direct")
+        if strategy in STRATEGIES:
+            return strategy
+    return ""
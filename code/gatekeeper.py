@@ -1,7 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import requests
 import json
 import logging
+import time
+from metrics import MetricsRegistry, instrument_app
+from http_client import PooledHTTPClient
+from forwarding import validate_statement, validate_batch, time_left, budget_headers, relayed_error, request_strategy
 
 app = Flask(__name__)
 
@@ -13,7 +17,41 @@ with open("config_trust.json", "r") as config_file:
     config = json.load(config_file)
 
 trusted_host_ip = config["trust_ip"]
-TRUSTED_HOST_URL = f"http://{trusted_host_ip}:8000/process"
+TRUSTED_HOST_URL = f"http://{trusted_host_ip}:8000"
+
+# Pooled keep-alive connections to the Trusted Host (optional "http_client" section in config_trust.json)
+http_client_config = config.get("http_client", {})
+trusted_client = PooledHTTPClient(
+    TRUSTED_HOST_URL,
+    pool_size=http_client_config.get("pool_size", 16),  # one per gunicorn thread (see gunicorn.conf.py)
+    pool_block=http_client_config.get("pool_block", False),  # wait for a pooled connection rather than open one more
+    connect_timeout=http_client_config.get("connect_timeout", 2.0),  # seconds
+    connect_retries=http_client_config.get("connect_retries", 1)
+)
+
+# End-to-end time budget of a request (see forwarding.py)
+REQUEST_TIMEOUT = config.get("request_timeout", 30.0)  # seconds, for requests without a "timeout"
+MAX_REQUEST_TIMEOUT = config.get("max_request_timeout", 300.0)  # seconds
+
+
+def request_deadline(data):
+    """
+    Returns the deadline of a request (a time.monotonic() value) from its "timeout", else REQUEST_TIMEOUT.
+    """
+    return time.monotonic() + min(data.get("timeout") or REQUEST_TIMEOUT, MAX_REQUEST_TIMEOUT)
+
+
+# Prometheus metrics served on GET /metrics
+metrics_registry = MetricsRegistry()
+instrument_app(app, metrics_registry, "gatekeeper", request_strategy)
+metrics_registry.callback("gatekeeper_upstream_requests_total", "Requests sent to the Trusted Host.",
+                          lambda: trusted_client.stats()["requests"], kind="counter")
+metrics_registry.callback("gatekeeper_upstream_connections_opened_total", "Connections opened to the Trusted Host.",
+                          lambda: trusted_client.stats()["connections_opened"], kind="counter")
+metrics_registry.callback("gatekeeper_upstream_connection_reuse_ratio",
+                          "Share of the requests to the Trusted Host sent on a kept-alive connection.",
+                          lambda: trusted_client.stats()["reuse_rate"], multiprocess_mode="mean")
+
 
 @app.route("/validate", methods=["POST"])
 def validate_request():
@@ -23,8 +61,15 @@ def validate_request():
     Request format:
     {
         "type": "read" or "write",
-        "query": "SQL query string",
-        "strategy": "direct", "random", or "customized"
+        "query": "SQL query string" (a template with %s placeholders if params are given),
+        "params": list of values (optional, bound to the placeholders by the proxy),
+        "strategy": one of STRATEGIES (default "direct"),
+        "cache": true or false (optional, false bypasses the proxy result cache),
+        "stream": "ndjson" or "json" (optional, streams large read results in chunks),
+        "chunk_rows", "max_rows", "max_bytes": integers (optional, streaming limits),
+        "coalesce": true or false (optional, group-commit single-row INSERTs),
+        "read_your_writes": true or false (optional, a write returns a consistency token),
+        "consistency_token": token returned by an earlier write (optional, read-your-writes)
     }
 
     Returns:
@@ -37,25 +82,85 @@ def validate_request():
     if not data:
         return jsonify({"error": "No data provided"}), 400
 
-    query_type = data.get("type")
-    query = data.get("query")
-    strategy = data.get("strategy", "direct")  # Default strategy is direct
+    error = validate_statement(data)
+    if error:
+        return jsonify({"error": error}), 400
 
-    if query_type not in ["read", "write"]:
-        return jsonify({"error": "Invalid query type"}), 400
-
-    if not query:
-        return jsonify({"error": "No query provided"}), 400
-
-    if strategy not in ["direct", "random", "customized"]:
-        return jsonify({"error": "Invalid strategy"}), 400
+    deadline = request_deadline(data)
 
     # Forward the validated request to the Trusted Host
     try:
         logging.info(f"Forwarding validated request to Trusted Host: {data}")
-        response = requests.post(TRUSTED_HOST_URL, json=data)
+        stream = bool(data.get("stream"))
+        response = trusted_client.post("/process", time_left(deadline), json=data, stream=stream,
+                                       headers={"Accept": request.headers.get("Accept", "application/json"),
+                                                **budget_headers(deadline)})
+        error_response = relayed_error(response)
+        if error_response is not None:
+            return error_response
+        if not response.ok:
+            # A streamed body that is not relayed would hold on to its pooled connection
+            response.close()
+        response.raise_for_status()
+        if stream:
+            # Relay the chunks as they arrive instead of decoding the whole result
+            relayed = Response(response.iter_content(chunk_size=None), status=response.status_code,
+                               content_type=response.headers.get("Content-Type"))
+            # Frees the pooled connection even if the client goes away mid-stream
+            relayed.call_on_close(response.close)
+            return relayed
+        # Relay the body as is: the client may have negotiated a format other than plain JSON
+        return Response(response.content, status=response.status_code,
+                        content_type=response.headers.get("Content-Type"))
+    except requests.exceptions.Timeout:
+        logging.error("Trusted Host did not answer before the deadline")
+        return jsonify({"error": "Deadline exceeded"}), 504
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to reach Trusted Host: {str(e)}")
+        return jsonify({"error": f"Failed to reach Trusted Host: {str(e)}"}), 500
+
+
+@app.route("/validate_batch", methods=["POST"])
+def validate_batch_request():
+    """
+    Validates a batch of statements and forwards it to the Trusted Host in one request.
+
+    Request format:
+    {
+        "statements": [{"type": "read" or "write", "query": "SQL query string", "params": [...], "strategy": ...}, ...],
+        "transaction": true or false (optional, run each backend's statements in one transaction),
+        "read_your_writes": true or false (optional, return a consistency token covering the writes)
+    }
+
+    Returns:
+        - {"results": [...]} from the Trusted Host, in statement order.
+        - Error response if validation or forwarding fails.
+    """
+    data = request.json
+
+    # Validate input
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+
+    error = validate_batch(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    deadline = request_deadline(data)
+
+    # Forward the validated batch to the Trusted Host
+    try:
+        logging.info(f"Forwarding validated batch of {len(data['statements'])} statements to Trusted Host")
+        response = trusted_client.post("/process_batch", time_left(deadline), json=data,
+                                       headers=budget_headers(deadline))
+        error_response = relayed_error(response)
+        if error_response is not None:
+            return error_response
         response.raise_for_status()
         return jsonify(response.json()), response.status_code
+    except requests.exceptions.Timeout:
+        logging.error("Trusted Host did not answer before the deadline")
+        return jsonify({"error": "Deadline exceeded"}), 504
     except requests.exceptions.RequestException as e:
         logging.error(f"Failed to reach Trusted Host: {str(e)}")
         return jsonify({"error": f"Failed to reach Trusted Host: {str(e)}"}), 500
@@ -0,0 +1,81 @@
+import multiprocessing
+import os
+import glob
+import tempfile
+
+# Production serving of the gatekeeper, trusted host and proxy:
+#   gunicorn -c gunicorn.conf.py proxy:app
+# Pre-forked worker processes, each serving requests on a pool of threads.
+# `kill -HUP <master pid>` reloads the code and configuration gracefully: new workers
+# start before the old ones finish their requests and exit.
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# One process per core by default; the threads overlap the time spent waiting on
+# the next hop or on MySQL
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", 16))
+
+# Keep-alive connections from the previous hop stay open between requests
+keepalive = int(os.environ.get("KEEPALIVE", 30))  # seconds
+# Requests still running after timeout get their worker restarted
+timeout = int(os.environ.get("TIMEOUT", 60))  # seconds
+# Time in-flight requests get to finish on a restart or shutdown
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))  # seconds
+
+# Workers are recycled after this many requests (0 never) to bound any slow leak,
+# spread by the jitter so they do not all restart at once
+max_requests = int(os.environ.get("MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", 0))
+
+# Heartbeat files on tmpfs: a container's overlay filesystem can stall them
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info")
+
+# The app is imported by each worker after the fork, not by the master: the proxy
+# starts background threads (probers, health checks) that would not survive a fork
+preload_app = False
+
+
+def _serves_proxy(server):
+    return server.cfg.proc_name.split(":")[0] == "proxy"
+
+
+def _clear_metrics_snapshots():
+    for path in glob.glob(os.path.join(os.environ["METRICS_MULTIPROC_DIR"], "*.json")):
+        os.remove(path)
+
+
+def on_starting(server):
+    # Each worker leaves snapshots of its metrics in this directory, merged on every scrape
+    # (see metrics.MetricsRegistry); the workers inherit the variable
+    metrics_dir = os.environ.setdefault(
+        "METRICS_MULTIPROC_DIR", os.path.join(worker_tmp_dir or tempfile.gettempdir(), f"metrics-{os.getpid()}"))
+    os.makedirs(metrics_dir, exist_ok=True)
+    _clear_metrics_snapshots()
+    # The proxy's in-flight counts and latencies live in memory shared by every worker
+    if _serves_proxy(server):
+        import shared_state
+        shared_state.create_shared(max_workers=max(128, workers * 2))
+
+
+def child_exit(server, worker):
+    # The counters of an exited worker keep counting, its gauges go
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+    # A worker that dies mid-query must not leave its queries counted as in flight
+    if _serves_proxy(server):
+        import shared_state
+        shared_state.release_worker(worker.pid)
+
+
+def on_exit(server):
+    _clear_metrics_snapshots()
+    try:
+        os.rmdir(os.environ["METRICS_MULTIPROC_DIR"])
+    except OSError:
+        pass
@@ -0,0 +1,155 @@
+import threading
+from collections import deque
+
+
+class QueryCancelled(Exception):
+    """
+    Raised in a hedged read that lost the race and was cancelled.
+    """
+
+
+class HedgeAttempt:
+    """
+    One of the two executions of a hedged read. The statement registers itself when it
+    starts so the other side can cancel it with KILL QUERY; cancelling an attempt that has
+    not started yet makes it give up before running.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.watch = None
+        self.cancelled = False
+
+    def start(self, watch):
+        """
+        Registers the watchdog handle of the running statement.
+
+        Returns:
+            bool: False if the attempt was already cancelled and must not run.
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.watch = watch
+            return True
+
+    def cancel(self, watchdog):
+        """
+        Cancels the attempt, killing its statement if it is running.
+        """
+        with self._lock:
+            self.cancelled = True
+            watch = self.watch
+        if watch is not None:
+            watchdog.cancel(watch)
+
+
+class _Window:
+    __slots__ = ("samples", "delay", "since_refresh")
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.delay = None
+        self.since_refresh = 0
+
+
+class HedgingPolicy:
+    """
+    Decides when a read is hedged: after the percentile-th latency of its backend (within
+    [min_delay, max_delay]), and only while the budget allows. Every read adds budget_percent
+    of a hedge to a token bucket holding at most budget_burst hedges, so hedges stay within
+    that share of the reads.
+    """
+
+    def __init__(self, percentile=95, min_delay=0.002, max_delay=1.0, window=200, min_samples=20,
+                 budget_percent=10, budget_burst=10):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.budget_percent = budget_percent
+        self.budget_burst = budget_burst
+
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._tokens = float(budget_burst)
+        # The percentile is recomputed every this many samples, not on every read
+        self._refresh_every = max(1, min(16, window // 10))
+
+        # Stats
+        self.reads = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    def record(self, ip, latency_ms):
+        """
+        Adds a query latency of a backend to its window.
+        """
+        with self._lock:
+            window = self._windows.get(ip)
+            if window is None:
+                window = self._windows[ip] = _Window(self.window)
+            window.samples.append(latency_ms)
+            window.since_refresh += 1
+            if window.since_refresh >= self._refresh_every and len(window.samples) >= self.min_samples:
+                window.since_refresh = 0
+                ordered = sorted(window.samples)
+                index = min(len(ordered) - 1, int(self.percentile / 100 * len(ordered)))
+                window.delay = min(self.max_delay, max(self.min_delay, ordered[index] / 1000))
+
+    def delay(self, ip):
+        """
+        Returns how long to wait for a read on a backend before hedging it, in seconds,
+        or None while the backend has too few samples.
+        """
+        window = self._windows.get(ip)
+        return window.delay if window is not None else None
+
+    def note_read(self):
+        """
+        Counts a hedgeable read, adding its share of the budget.
+        """
+        with self._lock:
+            self.reads += 1
+            self._tokens = min(float(self.budget_burst), self._tokens + self.budget_percent / 100)
+
+    def try_hedge(self):
+        """
+        Takes one hedge from the budget.
+
+        Returns:
+            bool: False if the budget is exhausted.
+        """
+        with self._lock:
+            if self._tokens < 1:
+                self.budget_exhausted += 1
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def refund(self):
+        """
+        Gives back a hedge that was not sent after all.
+        """
+        with self._lock:
+            self._tokens = min(float(self.budget_burst), self._tokens + 1)
+            self.hedges -= 1
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "reads": self.reads,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "budget_exhausted": self.budget_exhausted,
+                "hedge_rate": round(self.hedges / self.reads, 4) if self.reads else 0.0,
+                "delays_ms": {ip: round(window.delay * 1000, 3) if window.delay is not None else None
+                              for ip, window in self._windows.items()},
+            }
@@ -0,0 +1,76 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PooledHTTPClient:
+    """
+    Keep-alive HTTP client to the next hop, shared by the threads of a worker process.
+    requests.Session is not thread-safe, so each thread gets its own session; they are all
+    mounted on one adapter and share its pool of persistent connections.
+    """
+
+    def __init__(self, base_url, pool_size=16, pool_block=False, connect_timeout=2.0, connect_retries=1):
+        """
+        Args:
+            base_url (str): URL of the next hop, e.g. "http://10.0.0.5:8000".
+            pool_size (int): Connections kept open to the next hop.
+            pool_block (bool): Wait for a free connection instead of opening one more, closed
+                               after its request, when pool_size are in use.
+            connect_timeout (float): Seconds to establish a connection, within the request's timeout.
+            connect_retries (int): Times a failed connection attempt is retried. Nothing was sent
+                                   yet, so a write cannot run twice; other failures are not retried.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=pool_block,
+            max_retries=Retry(total=connect_retries, connect=connect_retries, read=0, redirect=0, status=0)
+        )
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+        return session
+
+    def post(self, path, timeout, **kwargs):
+        """
+        Sends a POST to a path of the next hop on a pooled connection.
+
+        Args:
+            path (str): Path of the endpoint, e.g. "/process".
+            timeout (float): Seconds left for the whole request.
+            **kwargs: Passed to requests (json, params, headers, stream).
+
+        Returns:
+            requests.Response: The response; a streamed one holds its connection until it is
+                               read to the end or closed.
+        """
+        return self.session().post(self.base_url + path, timeout=(min(self.connect_timeout, timeout), timeout),
+                                   **kwargs)
+
+    def stats(self):
+        """
+        Returns the requests sent and the connections opened for them; every other request
+        reused a kept-alive connection.
+        """
+        sent = opened = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                sent += pool.num_requests
+                opened += pool.num_connections
+        return {
+            "requests": sent,
+            "connections_opened": opened,
+            "reuse_rate": round(max(0.0, 1 - opened / sent), 4) if sent else 0.0,
+        }
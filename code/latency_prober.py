@@ -0,0 +1,203 @@
+import socket
+import threading
+import time
+import logging
+from collections import deque
+
+
+class BackendLatency:
+    """
+    Smoothed latency of one backend: an EWMA plus a window of recent samples for percentiles.
+    """
+
+    def __init__(self, alpha, window):
+        self.alpha = alpha
+        self.ewma = None
+        self.samples = deque(maxlen=window)
+        self.last_update = 0.0
+        self.failures = 0
+
+    def record(self, latency_ms):
+        if self.ewma is None:
+            self.ewma = latency_ms
+        else:
+            self.ewma = self.alpha * latency_ms + (1 - self.alpha) * self.ewma
+        self.samples.append(latency_ms)
+        self.last_update = time.monotonic()
+        self.failures = 0
+
+    def record_failure(self):
+        # last_update only tracks successful samples so a failing backend also goes stale
+        self.failures += 1
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class LatencyProber:
+    """
+    Measures every backend on a schedule from a background thread and keeps the
+    results in memory, so routing never has to probe on the request path.
+
+    Probe modes:
+        "tcp": time a TCP connect to the MySQL port.
+        "query": time a SELECT 1 round trip over the backend's connection pool.
+        "both": run both and keep the query latency (TCP failures still count).
+    """
+
+    def __init__(self, backends, pools=None, interval=1.0, mode="query", alpha=0.3,
+                 window=50, stale_after=5.0, max_failures=3, probe_timeout=1.0, port=3306):
+        self.backends = list(backends)
+        self.pools = pools if pools is not None else {}
+        self.interval = interval
+        self.mode = mode
+        self.alpha = alpha
+        self.window = window
+        self.stale_after = stale_after
+        self.max_failures = max_failures
+        self.probe_timeout = probe_timeout
+        self.port = port
+
+        self._lock = threading.Lock()
+        self._latency = {ip: BackendLatency(alpha, window) for ip in self.backends}
+        # Fastest fresh backend, recomputed after every probe round
+        self._best = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _probe_tcp(self, ip):
+        start = time.perf_counter()
+        with socket.create_connection((ip, self.port), timeout=self.probe_timeout):
+            pass
+        return (time.perf_counter() - start) * 1000
+
+    def _probe_query(self, ip):
+        pool = self.pools[ip]
+        start = time.perf_counter()
+        connection = pool.acquire()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+        except Exception:
+            # A connection that failed its probe is not reused
+            pool.release(connection, discard=True)
+            raise
+        pool.release(connection)
+        return (time.perf_counter() - start) * 1000
+
+    def probe(self, ip):
+        """
+        Probes one backend and records the result.
+
+        Returns:
+            float: The measured latency in milliseconds, or None if the probe failed.
+        """
+        try:
+            if self.mode == "tcp" or ip not in self.pools:
+                latency_ms = self._probe_tcp(ip)
+            elif self.mode == "both":
+                self._probe_tcp(ip)
+                latency_ms = self._probe_query(ip)
+            else:
+                latency_ms = self._probe_query(ip)
+        except Exception as e:
+            logging.warning(f"Latency probe to {ip} failed: {str(e)}")
+            with self._lock:
+                self._latency.setdefault(ip, BackendLatency(self.alpha, self.window)).record_failure()
+            return None
+        with self._lock:
+            self._latency.setdefault(ip, BackendLatency(self.alpha, self.window)).record(latency_ms)
+        return latency_ms
+
+    def _is_usable(self, entry, now):
+        return (entry.ewma is not None
+                and entry.failures < self.max_failures
+                and now - entry.last_update <= self.stale_after)
+
+    def _refresh_best(self):
+        now = time.monotonic()
+        with self._lock:
+            usable = {ip: entry.ewma for ip, entry in self._latency.items()
+                      if ip in self.backends and self._is_usable(entry, now)}
+            self._best = (min(usable, key=usable.get), now) if usable else None
+
+    def probe_all(self):
+        """
+        Probes every backend once and recomputes the fastest one.
+        """
+        for ip in list(self.backends):
+            self.probe(ip)
+        self._refresh_best()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.probe_all()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """
+        Starts the background probing thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def set_backends(self, backends):
+        """
+        Replaces the set of probed backends.
+        """
+        with self._lock:
+            self.backends = list(backends)
+            for ip in self.backends:
+                self._latency.setdefault(ip, BackendLatency(self.alpha, self.window))
+
+    def fastest(self):
+        """
+        Returns the backend with the lowest smoothed latency, or None if every
+        measurement is stale or failing. O(1): reads the result of the last probe round.
+        """
+        best = self._best
+        if best is None:
+            return None
+        ip, computed_at = best
+        if time.monotonic() - computed_at > self.stale_after:
+            return None
+        return ip
+
+    def latency(self, ip):
+        """
+        Returns the smoothed latency of a backend in milliseconds, or None if unknown or stale.
+        """
+        with self._lock:
+            entry = self._latency.get(ip)
+            if entry is None or not self._is_usable(entry, time.monotonic()):
+                return None
+            return entry.ewma
+
+    def snapshot(self):
+        """
+        Returns the latency table of every backend.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                ip: {
+                    "ewma_ms": None if entry.ewma is None else round(entry.ewma, 3),
+                    "p50_ms": entry.percentile(50),
+                    "p95_ms": entry.percentile(95),
+                    "p99_ms": entry.percentile(99),
+                    "failures": entry.failures,
+                    "age_s": round(now - entry.last_update, 3) if entry.last_update else None,
+                    "fresh": self._is_usable(entry, now),
+                }
+                for ip, entry in self._latency.items()
+            }
@@ -10,10 +10,10 @@ from netwrok_connection import update_security_group_rules
 #keypair and create isntaces
 from create_instances import create_key_pair,create_instances
 #configure servers
-from run_code import install_mysql,configure_manager,configure_worker,get_private_ip,build_images,configure_server
+from run_code import install_mysql,configure_manager,configure_worker,get_private_ip,build_images,configure_server,prune_shard
 from run_code import configure_iptables_workers,configure_iptables_manager,configure_iptables_proxy,configure_iptables_trusted,configure_iptables_gatekeeper
 #benchmarking
-from benchmark import benchmark_requests,warm_up
+from benchmark import benchmark_requests,benchmark_latencies,warm_up
 #terminate ressources
 from terminate_resources import terminate_all_instances,delete_all_security_groups
 
@@ -56,8 +56,16 @@ ami_id = 'ami-0e86e20dae9224db8'
 
 #CPU type
 instance_type_micro='t2.micro'
+#read weight of a worker per instance type (vCPUs), used by the weighted strategy
+instance_weights={'t2.micro':1,'t2.small':1,'t2.medium':2,'t2.large':2,'t2.xlarge':4,'t2.2xlarge':8}
 #number of instances
 nb_instances_micro=3
+#number of shard groups, each of nb_instances_micro instances (1 manager + workers); 1 disables sharding
+nb_shard_groups=1
+#shard key of each sharded table; the other tables are kept whole in every group
+shard_keys={'payment':'customer_id','rental':'customer_id','customer':'customer_id'}
+#let MySQL clients on the trusted host connect to the proxy itself on port 3306 (opt-in)
+mysql_frontend_enabled=False
 
 
 ###############################Worker Part###############################################
@@ -98,12 +106,52 @@ for i, (worker_id, worker_ip) in enumerate(worker_instances_data):
                      file=manager_data['File'], position=manager_data['Position'],server_id=server_id )
 
 
+############################################Shard groups################################################
+# The group above is shard group 0; every other group is a manager with its own workers
+shard_groups=[]
+shard_instances_data=[]
+for group in range(1, nb_shard_groups):
+    group_instances_data =create_instances(ec2=ec2,ami_id=ami_id,key_name=key_name,
+                                    subnet_id=subnet_id_1,security_group_id=securiy_group_id_sql,
+                                    instance_type=instance_type_micro,
+                                    num_instances=nb_instances_micro,
+                                    availability_zone=availability_zone,instance_name=f'mysql_shard_{group}')
+    for public_ip in group_instances_data:
+        install_mysql(ip_address=public_ip[1],username='ubuntu',private_key_path=key_file)
+
+    group_manager_data=configure_manager(ip_address=group_instances_data[0][1],username='ubuntu',private_key_path=key_file)
+    group_private_manager_ip=get_private_ip(ec2=ec2,instance_id=group_instances_data[0][0])
+    group_private_worker_ips=[]
+    for i, (worker_id, worker_ip) in enumerate(group_instances_data[1:]):
+        print(f"Configuring Worker {i + 1} of shard group {group}: {worker_ip}")
+        group_private_worker_ips.append(get_private_ip(ec2=ec2,instance_id=worker_id))
+        configure_worker(ip_address=worker_ip,username='ubuntu',private_key_path=key_file, manager_ip=group_private_manager_ip,
+                         file=group_manager_data['File'], position=group_manager_data['Position'],server_id=i + 2 )
+    shard_instances_data.append(group_instances_data)
+    shard_groups.append({"manager_ip": group_private_manager_ip, "worker_ips": group_private_worker_ips})
+
+# Every group starts with the full sakila data: keep only the rows it owns
+if nb_shard_groups > 1:
+    prune_shard(ip_address=manager_ip, username='ubuntu', private_key_path=key_file,
+                shard_keys=shard_keys, group=0, nb_groups=nb_shard_groups)
+    for group, group_instances_data in enumerate(shard_instances_data, start=1):
+        prune_shard(ip_address=group_instances_data[0][1], username='ubuntu', private_key_path=key_file,
+                    shard_keys=shard_keys, group=group, nb_groups=nb_shard_groups)
+
+all_private_worker_ips=private_worker_ips+[ip for group in shard_groups for ip in group["worker_ips"]]
+all_private_manager_ips=[private_manger_ip]+[group["manager_ip"] for group in shard_groups]
+
 ############################################Saved private ips of workers and manager####################
 # Save to a JSON file
 config_data = {
     "manager_ip": private_manger_ip,
-    "worker_ips": private_worker_ips
+    "worker_ips": private_worker_ips,
+    "weighted": {"weights": {ip: instance_weights.get(instance_type_micro, 1) for ip in all_private_worker_ips}}
 }
+if shard_groups:
+    config_data["sharding"] = {"groups": shard_groups, "keys": shard_keys}
+if mysql_frontend_enabled:
+    config_data["mysql_frontend"] = {"enabled": True, "port": 3306}
 
 #save ip addresses
 write_json(path="config.json")
@@ -114,7 +162,7 @@ print("Configuration saved to config.json")
 ############################################End of sql part####################################################
 
 #Create a security group for  proxy
-ports = [22,8000]
+ports = [22,8000,3306] if mysql_frontend_enabled else [22,8000]
 sg_proxy_id=create_security_group(ec2=ec2,group_name='security_proxy',vpc_id=vpc_id,ports=ports)
 #CPU type
 instance_type_large='t2.large'
@@ -143,7 +191,8 @@ dockerfiles = {
 build_images(dockerfiles)
 
 #configure instance of proxy
-configure_server(ip_address=proxy_public_ip, username='ubuntu', private_key_path=key_file, docker_image_name='proxy')
+configure_server(ip_address=proxy_public_ip, username='ubuntu', private_key_path=key_file, docker_image_name='proxy',
+                 ports=(8000, 3306) if mysql_frontend_enabled else (8000,))
 #Create a security group for proxy
 ports = [22, 8000,80,443]
 sg_gatekeeper_id=create_security_group(ec2=ec2,group_name='security_groups_gatekeeper',vpc_id=vpc_id,ports=ports)
@@ -218,10 +267,21 @@ configure_iptables_manager(ip_address=manager_ip, username='ubuntu',
                            private_key_path=key_file, proxy_private_ip=proxy_private_ip
                            , private_worker_ips=private_worker_ips)
 
+#configure iptable for the other shard groups
+for group_instances_data, group in zip(shard_instances_data, shard_groups):
+    for public_id in group_instances_data[1:]:
+        configure_iptables_workers(ip_address=public_id[1], username='ubuntu',
+                                    private_key_path=key_file, proxy_private_ip=proxy_private_ip,
+                                    manager_private_ip=group["manager_ip"])
+    configure_iptables_manager(ip_address=group_instances_data[0][1], username='ubuntu',
+                               private_key_path=key_file, proxy_private_ip=proxy_private_ip,
+                               private_worker_ips=group["worker_ips"])
+
 
 #configure iptable for proxy
 configure_iptables_proxy(ip_address=proxy_public_ip, username='ubuntu', private_key_path=key_file,
-                          private_worker_ips=private_worker_ips, manager_private_ip=private_manger_ip)
+                          private_worker_ips=all_private_worker_ips+all_private_manager_ips[1:], manager_private_ip=private_manger_ip,
+                          mysql_client_ips=[trusted_private_ip] if mysql_frontend_enabled else None)
 
 
 
@@ -344,7 +404,7 @@ write_payload_template = {"type": "write", "query": write_query, "strategy": ""}
 
 # # # # # Benchmark each strategy
 
-strategies = ["random", "customized","direct"]
+strategies = ["random", "customized","direct","lag_aware","least_outstanding","power_of_two","weighted"]
 for strategy in strategies:
     print(f"--- Benchmarking Read Strategy: {strategy} ---")
     read_payload = {**read_payload_template, "strategy": strategy}
@@ -353,6 +413,11 @@ for strategy in strategies:
     print(f"Success: {sum(1 for r in read_results if 'error' not in r)}")
     print(f"Errors: {sum(1 for r in read_results if 'error' in r)}\n")
 
+    # Bypass the proxy result cache so the latency reflects the routing strategy
+    read_latencies = benchmark_latencies(gatekeeper_url, {**read_payload, "cache": False}, num_requests)
+    print(f"Read latency p50={read_latencies['p50']:.1f}ms p95={read_latencies['p95']:.1f}ms "
+          f"p99={read_latencies['p99']:.1f}ms max={read_latencies['max']:.1f}ms\n")
+
     print(f"--- Benchmarking Write Strategy: {strategy} ---")
     write_payload = {**write_payload_template, "strategy": strategy}
     write_results, write_time = benchmark_requests(gatekeeper_url, write_payload, num_requests)
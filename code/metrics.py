@@ -0,0 +1,380 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Response, g, request
+
+
+# Latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Independent lock stripes per metric: concurrent requests mostly take different locks
+STRIPES = 16
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Directory where the worker processes of a service (see gunicorn.conf.py) leave snapshots of
+# their metrics, merged on every scrape so /metrics covers all of them whichever worker answers
+MULTIPROC_DIR_ENV = "METRICS_MULTIPROC_DIR"
+# Seconds between the snapshots a worker writes even when it is not scraped
+SNAPSHOT_INTERVAL = 1.0
+# How the gauges of the processes are combined: "sum" for per-process state, "max" for state
+# every process sees alike (shared memory, the same backend), "mean" for ratios
+MULTIPROCESS_MODES = ("sum", "max", "mean")
+# Snapshot holding the counters and histograms of the workers that exited
+DEAD_SNAPSHOT = "dead.json"
+
+
+def _stripe_index():
+    # Thread ids are aligned addresses; mix the bits before taking the stripe
+    return (threading.get_ident() * 2654435761 >> 16) % STRIPES
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with labels. Each thread increments one of STRIPES shards, so
+    recording never waits on a global lock; the shards are summed when scraped.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._stripes = [(threading.Lock(), {}) for _ in range(STRIPES)]
+
+    def inc(self, *labelvalues, amount=1):
+        stripe_lock, values = self._stripes[_stripe_index()]
+        with stripe_lock:
+            values[labelvalues] = values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for stripe_lock, values in self._stripes:
+            with stripe_lock:
+                for labelvalues, value in values.items():
+                    totals[labelvalues] = totals.get(labelvalues, 0) + value
+        return [(self.name, _format_labels(self.labelnames, labelvalues), value)
+                for labelvalues, value in sorted(totals.items())]
+
+
+class Histogram:
+    """
+    Histogram with labels, sharded like Counter.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts (last one is +Inf), sum]
+        self._stripes = [(threading.Lock(), {}) for _ in range(STRIPES)]
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        stripe_lock, series = self._stripes[_stripe_index()]
+        with stripe_lock:
+            entry = series.get(labelvalues)
+            if entry is None:
+                entry = series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def collect(self):
+        totals = {}
+        for stripe_lock, series in self._stripes:
+            with stripe_lock:
+                for labelvalues, (counts, total) in series.items():
+                    merged = totals.get(labelvalues)
+                    if merged is None:
+                        totals[labelvalues] = [list(counts), total]
+                    else:
+                        merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                        merged[1] += total
+
+        samples = []
+        for labelvalues, (counts, total) in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                samples.append((self.name + "_bucket", _format_labels(self.labelnames, labelvalues, le), cumulative))
+            labels = _format_labels(self.labelnames, labelvalues)
+            samples.append((self.name + "_sum", labels, round(total, 6)))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+
+class CallbackMetric:
+    """
+    Gauge (or counter) read from existing state when scraped, so it costs nothing on the hot path.
+    The callback returns a number, or a dict of label value -> number for a labelled metric.
+    multiprocess_mode tells how a gauge is combined across worker processes (MULTIPROCESS_MODES).
+    """
+
+    def __init__(self, name, documentation, callback, labelname=None, kind="gauge", multiprocess_mode="sum"):
+        if multiprocess_mode not in MULTIPROCESS_MODES:
+            raise ValueError(f"Unknown multiprocess mode: {multiprocess_mode}")
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelname = labelname
+        self.kind = kind
+        self.multiprocess_mode = multiprocess_mode
+
+    def collect(self):
+        value = self.callback()
+        if value is None:
+            return []
+        if self.labelname is None:
+            return [(self.name, "", value)]
+        return [(self.name, _format_labels((self.labelname,), (label,)), sample)
+                for label, sample in sorted(value.items()) if sample is not None]
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def mark_process_dead(pid, directory=None):
+    """
+    Called by the gunicorn master when a worker exits: the counters and histograms of its last
+    snapshot are added to those of the workers that exited before it, its gauges are dropped.
+    """
+    directory = directory or os.environ.get(MULTIPROC_DIR_ENV)
+    if not directory:
+        return
+    path = os.path.join(directory, f"{pid}.json")
+    dead_path = os.path.join(directory, DEAD_SNAPSHOT)
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    try:
+        with open(dead_path) as f:
+            dead = json.load(f)
+    except (OSError, ValueError):
+        dead = {}
+    for name, metric in snapshot.items():
+        if metric["kind"] == "gauge":
+            continue
+        totals = {(sample, labels): value for sample, labels, value in dead.get(name, {}).get("samples", ())}
+        for sample, labels, value in metric["samples"]:
+            totals[(sample, labels)] = totals.get((sample, labels), 0) + value
+        dead[name] = {"kind": metric["kind"],
+                      "samples": [[sample, labels, value] for (sample, labels), value in totals.items()]}
+    _write_json(dead_path, dead)
+    os.remove(path)
+
+
+def _merge_gauge(values, mode):
+    if mode == "max":
+        return max(values)
+    if mode == "mean":
+        return sum(values) / len(values)
+    return sum(values)
+
+
+class MetricsRegistry:
+    """
+    The metrics of one service, rendered in the Prometheus text format.
+
+    Under gunicorn every worker process has its own registry. With a multiprocess directory
+    (METRICS_MULTIPROC_DIR, set by gunicorn.conf.py), each worker writes a snapshot of its
+    samples there every SNAPSHOT_INTERVAL seconds and when scraped, and a scrape renders the
+    merge of all the snapshots: counters and histograms are summed over every worker that
+    ever ran (see mark_process_dead), gauges are combined over the live ones by their
+    multiprocess mode.
+    """
+
+    def __init__(self, multiprocess_dir=None):
+        self._metrics = []
+        self.multiprocess_dir = multiprocess_dir or os.environ.get(MULTIPROC_DIR_ENV)
+        if self.multiprocess_dir:
+            threading.Thread(target=self._snapshot_loop, daemon=True).start()
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, callback, labelname=None, kind="gauge", multiprocess_mode="sum"):
+        return self.register(CallbackMetric(name, documentation, callback, labelname, kind, multiprocess_mode))
+
+    def _collect(self):
+        """
+        Returns metric name -> its samples, or the error its collection raised.
+        """
+        collected = {}
+        for metric in self._metrics:
+            try:
+                collected[metric.name] = metric.collect()
+            except Exception as e:
+                # One failing callback must not take the whole scrape down
+                collected[metric.name] = e
+        return collected
+
+    def write_snapshot(self, collected=None):
+        """
+        Writes the samples of this process to the multiprocess directory.
+        """
+        collected = collected if collected is not None else self._collect()
+        kinds = {metric.name: metric.kind for metric in self._metrics}
+        _write_json(os.path.join(self.multiprocess_dir, f"{os.getpid()}.json"),
+                    {name: {"kind": kinds[name], "samples": samples}
+                     for name, samples in collected.items() if not isinstance(samples, Exception)})
+
+    def _snapshot_loop(self):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logging.error(f"Failed to write metrics snapshot: {str(e)}")
+
+    def _merge(self, collected):
+        """
+        Merges the samples of this process with the snapshots of the other worker processes.
+
+        Returns:
+            dict: Metric name -> merged samples (or the error collecting it here raised, if no
+                  process has samples of it).
+        """
+        try:
+            self.write_snapshot(collected)
+        except OSError as e:
+            logging.error(f"Failed to write metrics snapshot: {str(e)}")
+        own = os.path.join(self.multiprocess_dir, f"{os.getpid()}.json")
+        snapshots = []
+        for path in glob.glob(os.path.join(self.multiprocess_dir, "*.json")):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append((os.path.basename(path) == DEAD_SNAPSHOT, json.load(f)))
+            except (OSError, ValueError):
+                # Removed by the master since the listing
+                continue
+
+        merged = {}
+        for metric in self._metrics:
+            cumulative = metric.kind != "gauge"
+            local = collected[metric.name]
+            # This process first, so the samples keep its order
+            values = {}
+            for name, labels, value in local if not isinstance(local, Exception) else ():
+                values[(name, labels)] = [value]
+            for dead, snapshot in snapshots:
+                if dead and not cumulative:
+                    continue
+                for name, labels, value in snapshot.get(metric.name, {}).get("samples", ()):
+                    values.setdefault((name, labels), []).append(value)
+            if not values and isinstance(local, Exception):
+                merged[metric.name] = local
+                continue
+            mode = getattr(metric, "multiprocess_mode", "sum")
+            merged[metric.name] = [(name, labels, sum(sample) if cumulative else _merge_gauge(sample, mode))
+                                   for (name, labels), sample in values.items()]
+        return merged
+
+    def render(self):
+        collected = self._collect()
+        if self.multiprocess_dir:
+            collected = self._merge(collected)
+        lines = []
+        for metric in self._metrics:
+            samples = collected[metric.name]
+            if isinstance(samples, Exception):
+                lines.append(f"# {metric.name} unavailable: {_escape(samples)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def mark_request_failed():
+    """
+    Counts the current request as an error even though it answers 200 (e.g. a query error
+    reported in the JSON body).
+    """
+    g.metrics_failed = True
+
+
+def instrument_app(app, registry, service, strategy_of):
+    """
+    Records the count, errors and latency of every request of a Flask app per route and
+    strategy, and serves the registry on GET /metrics.
+
+    Args:
+        app (Flask): The service.
+        registry (MetricsRegistry): Registry to add the request metrics to.
+        service (str): Prefix of the metric names ("gatekeeper", "trusted", "proxy").
+        strategy_of (callable): Returns the routing strategy of the current request, or "".
+    """
+    requests_total = registry.counter(
+        f"{service}_requests_total", "Requests handled.", ("route", "strategy", "status"))
+    errors_total = registry.counter(
+        f"{service}_request_errors_total", "Requests that failed.", ("route", "strategy"))
+    latency = registry.histogram(
+        f"{service}_request_duration_seconds", "Time to build the response.", ("route", "strategy"))
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None or request.endpoint == "metrics":
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        strategy = strategy_of() or ""
+        latency.observe(time.perf_counter() - start, route, strategy)
+        requests_total.inc(route, strategy, str(response.status_code))
+        if response.status_code >= 400 or g.pop("metrics_failed", False):
+            errors_total.inc(route, strategy)
+        return response
+
+    @app.route("/metrics", methods=["GET"], endpoint="metrics")
+    def metrics():
+        """
+        Returns the service metrics in the Prometheus text format.
+        """
+        return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,1586 @@
+import datetime
+import decimal
+import hashlib
+import hmac
+import itertools
+import logging
+import os
+import re
+import socket
+import socketserver
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+
+from pymysql.charset import charset_by_id
+from pymysql.constants import CLIENT, COMMAND, FIELD_TYPE, FLAG, SERVER_STATUS
+from pymysql.converters import escape_item
+from pymysql.err import OperationalError, raise_mysql_exception
+
+from admission import Overloaded
+from connection_pool import ConnectionPool, PooledConnection
+from sql_classifier import classify, tokenize, Token, WORD, VARIABLE
+
+
+# Capabilities offered to clients: the ones the pooled pymysql connections negotiate with the
+# backends, so the packets relayed from a backend are in the format the client expects
+# (EOF packets, no session tracking, no query attributes, one statement per COM_QUERY)
+SERVER_CAPABILITIES = CLIENT.CAPABILITIES | CLIENT.CONNECT_WITH_DB
+
+AUTH_PLUGIN = b"mysql_native_password"
+UTF8MB4_GENERAL_CI = 45
+# Character set of the backend connections
+BACKEND_CHARSET = "utf8mb4"
+INTEGER_TYPES = {FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.LONGLONG, FIELD_TYPE.INT24,
+                 FIELD_TYPE.YEAR}
+# struct formats of the fixed-size values of the binary protocol (signed; upper-cased when unsigned)
+BINARY_FORMATS = {FIELD_TYPE.TINY: "b", FIELD_TYPE.SHORT: "h", FIELD_TYPE.YEAR: "h", FIELD_TYPE.LONG: "i",
+                  FIELD_TYPE.INT24: "i", FIELD_TYPE.LONGLONG: "q", FIELD_TYPE.FLOAT: "f", FIELD_TYPE.DOUBLE: "d"}
+DATE_TYPES = {FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE, FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+DECIMAL_TYPES = {FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL}
+BINARY_CHARSET = 63
+DEFAULT_SERVER_VERSION = "8.0.0"
+
+MAX_PAYLOAD = 0xFFFFFF
+# Relayed packets are sent to the client in writes of about this size
+FLUSH_BYTES = 64 * 1024
+
+COM_RESET_CONNECTION = 0x1F
+
+# The %s placeholders of a parameterized statement, and %% for a literal %
+PLACEHOLDER_PATTERN = re.compile(r"%[s%]")
+
+# Error codes sent by the front end itself
+ER_CON_COUNT_ERROR = 1040
+ER_ACCESS_DENIED_ERROR = 1045
+ER_UNKNOWN_COM_ERROR = 1047
+ER_UNKNOWN_ERROR = 1105
+ER_UNKNOWN_STMT_HANDLER = 1243
+ER_NOT_SUPPORTED_AUTH_MODE = 1251
+# Client error raised when a backend connection drops in the middle of a statement
+CR_SERVER_LOST = 2013
+
+# Functions reading state of the connection that ran the previous statements
+SESSION_FUNCTIONS = {
+    "LAST_INSERT_ID", "FOUND_ROWS", "ROW_COUNT", "GET_LOCK", "RELEASE_LOCK", "RELEASE_ALL_LOCKS",
+    "IS_FREE_LOCK", "IS_USED_LOCK",
+}
+
+Relayed = namedtuple("Relayed", ["error", "status", "rows"])
+Prepared = namedtuple("Prepared", ["error", "backend_id", "params", "columns"])
+Column = namedtuple("Column", ["name", "type", "flags", "charset"])
+StatementResult = namedtuple("StatementResult", ["columns", "rows", "affected_rows", "insert_id"])
+Statement = namedtuple("Statement", ["id", "params"])
+
+# Counters of the statement caches of every backend connection
+statement_stats_lock = threading.Lock()
+statement_stats = {"prepares": 0, "hits": 0, "evictions": 0, "reprepares": 0}
+
+
+class BackendError(Exception):
+    """
+    A backend answered a statement run on behalf of a session with an ERR packet.
+    """
+
+    def __init__(self, packet):
+        super().__init__(error_message(packet))
+        self.packet = packet
+        self.code = struct.unpack_from("<H", packet, 1)[0]
+
+
+class ClientGone(Exception):
+    """
+    The client closed its connection while a result was relayed to it.
+    """
+
+
+def frame(payload, seq=0):
+    """
+    Splits a payload into wire packets (3-byte length, sequence id, at most 16MB of payload).
+
+    Returns:
+        tuple: (the packets, the next sequence id)
+    """
+    packets = []
+    offset = 0
+    while True:
+        chunk = payload[offset:offset + MAX_PAYLOAD]
+        packets.append(len(chunk).to_bytes(3, "little") + bytes([seq & 0xFF]) + chunk)
+        seq += 1
+        offset += MAX_PAYLOAD
+        if len(chunk) < MAX_PAYLOAD:
+            return b"".join(packets), seq
+
+
+def read_packet(read):
+    """
+    Reads one packet, joining the parts of a payload of 16MB or more.
+
+    Args:
+        read (callable): Returns the next n bytes of the stream (fewer at its end).
+
+    Returns:
+        tuple: (payload, raw packets as received, sequence id of the last part)
+
+    Raises:
+        ConnectionError: If the stream ends in the middle of the packet.
+    """
+    payload = []
+    raw = []
+    while True:
+        header = read(4)
+        if len(header) < 4:
+            raise ConnectionError("Connection closed")
+        length = int.from_bytes(header[:3], "little")
+        chunk = read(length)
+        if len(chunk) < length:
+            raise ConnectionError("Connection closed in the middle of a packet")
+        payload.append(chunk)
+        raw.append(header)
+        raw.append(chunk)
+        if length < MAX_PAYLOAD:
+            return b"".join(payload), b"".join(raw), header[3]
+
+
+def lenenc(value):
+    if value < 0xFB:
+        return bytes([value])
+    if value < 1 << 16:
+        return b"\xfc" + value.to_bytes(2, "little")
+    if value < 1 << 24:
+        return b"\xfd" + value.to_bytes(3, "little")
+    return b"\xfe" + value.to_bytes(8, "little")
+
+
+def read_lenenc(data, offset):
+    """
+    Returns (length-encoded integer at offset, offset after it).
+    """
+    first = data[offset]
+    if first < 0xFB:
+        return first, offset + 1
+    size = {0xFC: 2, 0xFD: 3, 0xFE: 8}.get(first, 0)
+    return int.from_bytes(data[offset + 1:offset + 1 + size], "little"), offset + 1 + size
+
+
+def ok_packet(status, affected_rows=0, insert_id=0):
+    return b"\x00" + lenenc(affected_rows) + lenenc(insert_id) + struct.pack("<HH", status, 0)
+
+
+def err_packet(code, message, sqlstate="HY000"):
+    return b"\xff" + struct.pack("<H", code) + b"#" + sqlstate.encode() + message.encode("utf-8", "replace")
+
+
+def error_message(payload):
+    if payload[3:4] == b"#":
+        return payload[9:].decode("utf-8", "replace")
+    return payload[3:].decode("utf-8", "replace")
+
+
+def is_eof(payload):
+    return payload[:1] == b"\xfe" and len(payload) < 9
+
+
+def ok_status(payload):
+    _, offset = read_lenenc(payload, 1)
+    _, offset = read_lenenc(payload, offset)
+    return struct.unpack_from("<H", payload, offset)[0]
+
+
+def eof_status(payload):
+    return struct.unpack_from("<H", payload, 3)[0]
+
+
+def native_password_token(password, salt):
+    """
+    Returns the mysql_native_password answer to a salt: SHA1(password) XOR
+    SHA1(salt + SHA1(SHA1(password))), empty for an empty password.
+    """
+    if not password:
+        return b""
+    stage1 = hashlib.sha1(password.encode("utf-8")).digest()
+    stage2 = hashlib.sha1(stage1).digest()
+    mix = hashlib.sha1(salt + stage2).digest()
+    return bytes(a ^ b for a, b in zip(stage1, mix))
+
+
+def _null_terminated(data, offset):
+    end = data.find(b"\0", offset)
+    if end < 0:
+        end = len(data)
+    return data[offset:end], end + 1
+
+
+class _Sink:
+    """
+    Buffers the packets relayed to the client and sends them in large writes.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.next_seq = 1
+
+    def write(self, raw, seq):
+        self.buffer += raw
+        self.next_seq = seq + 1
+        if len(self.buffer) >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            try:
+                self.sock.sendall(self.buffer)
+            except OSError as e:
+                raise ClientGone(str(e))
+            self.buffer.clear()
+
+
+class _Discard:
+    """
+    Sink of the responses to statements the proxy runs for itself (replayed session commands).
+    """
+
+    def write(self, raw, seq):
+        pass
+
+
+DISCARD = _Discard()
+
+
+def relay_rows(link, sink):
+    """
+    Relays rows up to the closing EOF (or ERR).
+
+    Returns:
+        Relayed: The error message if the rows ended with an ERR, the server status, the row count.
+    """
+    rows = 0
+    while True:
+        payload, raw, seq = link.read()
+        sink.write(raw, seq)
+        if is_eof(payload):
+            return Relayed(None, eof_status(payload), rows)
+        if payload[:1] == b"\xff":
+            return Relayed(error_message(payload), link.status, rows)
+        rows += 1
+
+
+def relay_result(link, sink):
+    """
+    Relays the response to a COM_QUERY or COM_STMT_EXECUTE: an OK, an ERR, or result sets
+    (column count, column definitions, EOF, rows, EOF), several of them for a CALL.
+    Rows are passed through without being decoded.
+    """
+    rows = 0
+    while True:
+        payload, raw, seq = link.read()
+        sink.write(raw, seq)
+        if payload[:1] == b"\x00":
+            status = ok_status(payload)
+        elif payload[:1] == b"\xff":
+            return Relayed(error_message(payload), link.status, rows)
+        else:
+            columns, _ = read_lenenc(payload, 0)
+            for _ in range(columns):
+                _, raw, seq = link.read()
+                sink.write(raw, seq)
+            payload, raw, seq = link.read()
+            sink.write(raw, seq)
+            status = eof_status(payload)
+            # With a cursor, the rows come with COM_STMT_FETCH
+            if not status & SERVER_STATUS.SERVER_STATUS_CURSOR_EXISTS:
+                relayed = relay_rows(link, sink)
+                rows += relayed.rows
+                if relayed.error is not None:
+                    return Relayed(relayed.error, link.status, rows)
+                status = relayed.status
+        link.status = status
+        if not status & SERVER_STATUS.SERVER_MORE_RESULTS_EXISTS:
+            return Relayed(None, status, rows)
+
+
+def relay_packet(link, sink):
+    """
+    Relays a response made of a single packet (OK, ERR, or the text of COM_STATISTICS).
+    """
+    payload, raw, seq = link.read()
+    sink.write(raw, seq)
+    if payload[:1] == b"\xff":
+        return Relayed(error_message(payload), link.status, 0)
+    if payload[:1] == b"\x00" and len(payload) >= 7:
+        link.status = ok_status(payload)
+    return Relayed(None, link.status, 0)
+
+
+def relay_prepare(link, sink, client_id):
+    """
+    Relays the response to a COM_STMT_PREPARE, replacing the backend's statement id with
+    the one the session gave the client.
+
+    Returns:
+        Prepared: The error message (or None), the backend's statement id and the numbers
+                  of parameters and result columns.
+    """
+    payload, raw, seq = link.read()
+    if payload[:1] == b"\xff":
+        sink.write(raw, seq)
+        return Prepared(error_message(payload), None, 0, 0)
+    backend_id, columns, params = struct.unpack_from("<IHH", payload, 1)
+    sink.write(frame(payload[:1] + struct.pack("<I", client_id) + payload[5:], seq)[0], seq)
+    for count in (params, columns):
+        # Definitions, then an EOF
+        for _ in range(count + 1 if count else 0):
+            _, raw, seq = link.read()
+            sink.write(raw, seq)
+    return Prepared(None, backend_id, params, columns)
+
+
+def count_statement_stat(name):
+    with statement_stats_lock:
+        statement_stats[name] += 1
+
+
+def prepared_stats():
+    """
+    Returns the counters of the prepared statement caches.
+    """
+    with statement_stats_lock:
+        return dict(statement_stats)
+
+
+def server_placeholders(template):
+    """
+    Rewrites the %s placeholders of a parameterized statement as the ? placeholders of
+    COM_STMT_PREPARE. %% stands for a literal %, as with client-side binding.
+    """
+    return PLACEHOLDER_PATTERN.sub(lambda match: "%" if match.group() == "%%" else "?", template)
+
+
+def _column(payload):
+    """
+    Decodes a column definition: its name, type, flags and character set.
+    """
+    # Catalog, schema, table, original table, name and original name, then the fixed fields
+    offset = 0
+    name = ""
+    for field in range(6):
+        length, offset = read_lenenc(payload, offset)
+        if field == 4:
+            name = payload[offset:offset + length].decode("utf-8", "replace")
+        offset += length
+    charset, _, column_type, flags = struct.unpack_from("<HIBH", payload, offset + 1)
+    return Column(name, column_type, flags, charset)
+
+
+def _text_row(payload, columns):
+    """
+    Decodes a row of a text protocol result set: length-encoded strings, 0xFB for NULL.
+    Integer columns are returned as int, the others as str.
+    """
+    values = []
+    offset = 0
+    for column in columns:
+        if payload[offset] == 0xFB:
+            values.append(None)
+            offset += 1
+            continue
+        length, offset = read_lenenc(payload, offset)
+        value = payload[offset:offset + length].decode("utf-8", "replace")
+        values.append(int(value) if column.type in INTEGER_TYPES else value)
+        offset += length
+    return tuple(values)
+
+
+def _binary_param(value):
+    """
+    Encodes a statement parameter for COM_STMT_EXECUTE.
+
+    Returns:
+        tuple: (its type and unsigned flag, its value; empty for NULL)
+    """
+    if value is None:
+        return struct.pack("<BB", FIELD_TYPE.NULL, 0), b""
+    if isinstance(value, bool):
+        return struct.pack("<BB", FIELD_TYPE.TINY, 0), struct.pack("<b", value)
+    if isinstance(value, int) and -1 << 63 <= value < 1 << 64:
+        if value < 1 << 63:
+            return struct.pack("<BB", FIELD_TYPE.LONGLONG, 0), struct.pack("<q", value)
+        return struct.pack("<BB", FIELD_TYPE.LONGLONG, 0x80), struct.pack("<Q", value)
+    if isinstance(value, float):
+        return struct.pack("<BB", FIELD_TYPE.DOUBLE, 0), struct.pack("<d", value)
+    if isinstance(value, int):
+        # Beyond BIGINT, sent as a decimal number
+        data = str(value).encode()
+        return struct.pack("<BB", FIELD_TYPE.NEWDECIMAL, 0), lenenc(len(data)) + data
+    if isinstance(value, (bytes, bytearray)):
+        return struct.pack("<BB", FIELD_TYPE.BLOB, 0), lenenc(len(value)) + bytes(value)
+    data = str(value).encode("utf-8")
+    return struct.pack("<BB", FIELD_TYPE.VAR_STRING, 0), lenenc(len(data)) + data
+
+
+def _binary_date(payload, offset, column_type):
+    length = payload[offset]
+    parts = payload[offset + 1:offset + 1 + length]
+    offset += 1 + length
+    if length == 0:
+        # Zero dates cannot be converted, so they come back as text like the text protocol's
+        return ("0000-00-00" if column_type in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE)
+                else "0000-00-00 00:00:00"), offset
+    year, month, day = struct.unpack_from("<HBB", parts)
+    hour, minute, second = struct.unpack_from("<BBB", parts, 4) if length >= 7 else (0, 0, 0)
+    microsecond = struct.unpack_from("<I", parts, 7)[0] if length >= 11 else 0
+    try:
+        if column_type in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+            return datetime.date(year, month, day), offset
+        return datetime.datetime(year, month, day, hour, minute, second, microsecond), offset
+    except ValueError:
+        # Dates MySQL allows but Python does not (a zero month or day)
+        text = f"{year:04d}-{month:02d}-{day:02d}"
+        if column_type not in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+            text += f" {hour:02d}:{minute:02d}:{second:02d}"
+        return text, offset
+
+
+def _binary_time(payload, offset):
+    length = payload[offset]
+    parts = payload[offset + 1:offset + 1 + length]
+    offset += 1 + length
+    if length == 0:
+        return datetime.timedelta(0), offset
+    negative, days, hours, minutes, seconds = struct.unpack_from("<BIBBB", parts)
+    microseconds = struct.unpack_from("<I", parts, 8)[0] if length >= 12 else 0
+    value = datetime.timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds,
+                               microseconds=microseconds)
+    return -value if negative else value, offset
+
+
+def _binary_value(payload, offset, column):
+    """
+    Decodes a non-NULL value of a binary protocol row into the Python type the text
+    protocol's converters give it.
+
+    Returns:
+        tuple: (the value, offset after it)
+    """
+    fmt = BINARY_FORMATS.get(column.type)
+    if fmt is not None:
+        if column.flags & FLAG.UNSIGNED and fmt not in ("f", "d"):
+            fmt = fmt.upper()
+        value = struct.unpack_from("<" + fmt, payload, offset)[0]
+        if fmt == "f":
+            # As the text protocol prints FLOAT columns, not the widened single precision value
+            value = float(f"{value:.6g}")
+        return value, offset + struct.calcsize("<" + fmt)
+    if column.type in DATE_TYPES:
+        return _binary_date(payload, offset, column.type)
+    if column.type == FIELD_TYPE.TIME:
+        return _binary_time(payload, offset)
+    length, offset = read_lenenc(payload, offset)
+    data = payload[offset:offset + length]
+    offset += length
+    if column.type in DECIMAL_TYPES:
+        return decimal.Decimal(data.decode()), offset
+    if column.charset == BINARY_CHARSET:
+        return bytes(data), offset
+    return data.decode("utf-8", "replace"), offset
+
+
+def _binary_row(payload, columns):
+    """
+    Decodes a row of a binary protocol result set: a header byte, a NULL bitmap whose
+    first two bits are unused, then the values of the non-NULL columns.
+    """
+    values = []
+    offset = 1 + (len(columns) + 9) // 8
+    for i, column in enumerate(columns):
+        if payload[1 + (i + 2) // 8] >> ((i + 2) % 8) & 1:
+            values.append(None)
+            continue
+        value, offset = _binary_value(payload, offset, column)
+        values.append(value)
+    return tuple(values)
+
+
+class BackendCursor:
+    """
+    Minimal DB-API cursor of a BackendConnection, for the statements the proxy runs itself
+    on it (the consistency token wait, parameterized queries). The parameters of a statement
+    go through the connection's statement cache, or are escaped into it if it has none.
+    Errors are raised as the pymysql exceptions the proxy handles for its other connections.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rows = ()
+        self.rownumber = 0
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def execute(self, query, args=None):
+        connection = self.connection
+        try:
+            if args is not None and connection.statement_cache_size:
+                result = connection.execute(query, list(args))
+            else:
+                if args is not None:
+                    query = query % tuple(escape_item(arg, BACKEND_CHARSET) for arg in args)
+                result = connection.query(query)
+        except BackendError as e:
+            raise_mysql_exception(e.packet)
+        except OSError as e:
+            raise OperationalError(CR_SERVER_LOST, f"Lost connection to backend {connection.host}: {str(e)}") from e
+        self.description = (tuple((column.name, column.type, None, None, None, None, True)
+                                  for column in result.columns)
+                            if result.columns is not None else None)
+        self.rows = tuple(result.rows)
+        self.rownumber = 0
+        self.rowcount = len(self.rows) if result.columns is not None else result.affected_rows
+        self.lastrowid = result.insert_id
+        return self.rowcount
+
+    def fetchone(self):
+        if self.rownumber >= len(self.rows):
+            return None
+        self.rownumber += 1
+        return self.rows[self.rownumber - 1]
+
+    def fetchall(self):
+        rows = self.rows[self.rownumber:]
+        self.rownumber = len(self.rows)
+        return rows
+
+
+class BackendConnection:
+    """
+    A connection to a backend on which the front end relays the packets of its clients.
+    It speaks the protocol itself, on a socket it owns: the handshake authenticates with
+    mysql_native_password, the plugin of the accounts run_code creates. It offers the
+    methods ConnectionPool uses on its connections (ping, rollback, close).
+
+    The proxy also runs parameterized queries on these connections. With a statement cache,
+    they become server-side prepared statements (COM_STMT_PREPARE/COM_STMT_EXECUTE) kept in
+    a per-connection LRU keyed by template, so a hot statement is parsed once per connection.
+    """
+
+    def __init__(self, host, user, password, database, port=3306, connect_timeout=5, statement_cache_size=0):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.port = port
+        self.connect_timeout = connect_timeout
+        # Prepared statements kept per connection; 0 binds parameters client-side instead
+        self.statement_cache_size = statement_cache_size
+        self.statements = OrderedDict()  # template -> Statement, least recently used first
+        self.sock = None
+        self.connect()
+
+    def connect(self):
+        """
+        Opens the socket and authenticates.
+
+        Raises:
+            BackendError: If the backend turned the connection down.
+            OSError: If the backend cannot be reached.
+        """
+        # A new session has none of the statements prepared on the previous one
+        self.statements.clear()
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.rfile = self.sock.makefile("rb")
+            self._handshake()
+            self.sock.settimeout(None)
+        except Exception:
+            self.sock.close()
+            raise
+
+    def _handshake(self):
+        greeting, _, seq = read_packet(self.rfile.read)
+        if greeting[:1] == b"\xff":
+            raise BackendError(greeting)
+        version, offset = _null_terminated(greeting, 1)
+        self.server_version = version.decode("utf-8", "replace")
+        self._thread_id = struct.unpack_from("<I", greeting, offset)[0]
+        salt = greeting[offset + 4:offset + 12]
+        capabilities_low, _, _, capabilities_high, salt_length = struct.unpack_from("<HBHHB", greeting, offset + 13)
+        capabilities = capabilities_low | capabilities_high << 16
+        offset += 13 + 8 + 10
+        # The rest of the 20-byte salt, then a NUL
+        salt += greeting[offset:offset + max(12, salt_length - 9)]
+        plugin, _ = _null_terminated(greeting, offset + max(13, salt_length - 8))
+
+        # The capabilities offered to clients, so the relayed packets are in the format they expect
+        flags = SERVER_CAPABILITIES & ~CLIENT.CONNECT_ATTRS & capabilities
+        if not self.database:
+            flags &= ~CLIENT.CONNECT_WITH_DB
+        token = native_password_token(self.password, salt[:20])
+        response = (struct.pack("<IIB", flags, MAX_PAYLOAD, UTF8MB4_GENERAL_CI) + b"\0" * 23
+                    + self.user.encode("utf-8") + b"\0" + lenenc(len(token)) + token)
+        if flags & CLIENT.CONNECT_WITH_DB:
+            response += self.database.encode("utf-8") + b"\0"
+        response += AUTH_PLUGIN + b"\0"
+        self.sock.sendall(frame(response, seq + 1)[0])
+
+        answer, _, seq = read_packet(self.rfile.read)
+        if answer[:1] == b"\xfe" and len(answer) > 1:
+            # Auth switch request: plugin name, then its salt
+            plugin, offset = _null_terminated(answer, 1)
+            if plugin != AUTH_PLUGIN:
+                raise ConnectionError(f"Backend {self.host} asks for the unsupported {plugin.decode()} authentication")
+            token = native_password_token(self.password, answer[offset:offset + 20])
+            self.sock.sendall(frame(token, seq + 1)[0])
+            answer, _, seq = read_packet(self.rfile.read)
+        if answer[:1] == b"\xff":
+            raise BackendError(answer)
+        if answer[:1] != b"\x00":
+            raise ConnectionError(f"Unexpected authentication answer from backend {self.host}")
+        self.status = ok_status(answer)
+
+    def send(self, payload):
+        self.sock.sendall(frame(payload)[0])
+
+    def read(self):
+        return read_packet(self.rfile.read)
+
+    def command(self, payload):
+        """
+        Runs a command answered with a single OK packet.
+
+        Raises:
+            BackendError: If the backend answered with an error.
+        """
+        self.send(payload)
+        answer, _, _ = self.read()
+        if answer[:1] == b"\xff":
+            raise BackendError(answer)
+        return answer
+
+    def thread_id(self):
+        """
+        Returns the MySQL connection id of the session, like pymysql's connections.
+        """
+        return self._thread_id
+
+    def _result(self, command, decode_row):
+        """
+        Sends a statement and reads its response. Of a CALL's several result sets, the
+        first one is kept.
+
+        Returns:
+            StatementResult: The columns (None if the statement returned no result set), the rows,
+                             the affected rows and the insert id.
+
+        Raises:
+            BackendError: If the backend answered with an error.
+        """
+        self.send(command)
+        answer, _, _ = self.read()
+        result = None
+        while True:
+            if answer[:1] == b"\xff":
+                raise BackendError(answer)
+            if answer[:1] == b"\x00":
+                affected_rows, offset = read_lenenc(answer, 1)
+                insert_id, offset = read_lenenc(answer, offset)
+                status = struct.unpack_from("<H", answer, offset)[0]
+                result = result or StatementResult(None, [], affected_rows, insert_id)
+            else:
+                count, _ = read_lenenc(answer, 0)
+                columns = [_column(self.read()[0]) for _ in range(count)]
+                self.read()
+                rows = []
+                while True:
+                    payload, _, _ = self.read()
+                    if is_eof(payload):
+                        status = eof_status(payload)
+                        break
+                    if payload[:1] == b"\xff":
+                        raise BackendError(payload)
+                    rows.append(decode_row(payload, columns))
+                result = result or StatementResult(columns, rows, len(rows), 0)
+            if not status & SERVER_STATUS.SERVER_MORE_RESULTS_EXISTS:
+                return result
+            answer, _, _ = self.read()
+
+    def query(self, query):
+        """
+        Runs a statement with COM_QUERY.
+
+        Returns:
+            StatementResult: Its columns, rows, affected rows and insert id.
+        """
+        return self._result(bytes([COMMAND.COM_QUERY]) + query.encode("utf-8"), _text_row)
+
+    def prepare(self, template):
+        """
+        Returns the server-side statement of a parameterized statement, preparing it on a
+        cache miss. Once the cache is full, the least recently used statement is closed.
+
+        Returns:
+            Statement: Its id and number of parameters.
+
+        Raises:
+            BackendError: If the backend could not prepare it.
+        """
+        statement = self.statements.get(template)
+        if statement is not None:
+            self.statements.move_to_end(template)
+            count_statement_stat("hits")
+            return statement
+
+        answer = self.command(bytes([COMMAND.COM_STMT_PREPARE]) + server_placeholders(template).encode("utf-8"))
+        statement_id, columns, params = struct.unpack_from("<IHH", answer, 1)
+        for count in (params, columns):
+            # Definitions, then an EOF
+            for _ in range(count + 1 if count else 0):
+                self.read()
+        count_statement_stat("prepares")
+        statement = self.statements[template] = Statement(statement_id, params)
+
+        while len(self.statements) > self.statement_cache_size:
+            _, evicted = self.statements.popitem(last=False)
+            # COM_STMT_CLOSE has no response
+            self.send(struct.pack("<BI", COMMAND.COM_STMT_CLOSE, evicted.id))
+            count_statement_stat("evictions")
+        return statement
+
+    def execute(self, template, params):
+        """
+        Runs a parameterized statement (one %s placeholder per parameter) as a cached
+        server-side prepared statement. The parameters travel in their binary encoding and
+        are bound by the backend; the rows come back in the binary protocol.
+
+        Returns:
+            StatementResult: Its columns, rows, affected rows and insert id.
+
+        Raises:
+            BackendError: If the backend answered with an error.
+            ValueError: If the number of parameters does not match the placeholders.
+        """
+        statement = self.prepare(template)
+        if statement.params != len(params):
+            raise ValueError(f"Expected {statement.params} parameters, got {len(params)}")
+        bound = b""
+        if params:
+            null_bitmap = bytearray((len(params) + 7) // 8)
+            types = []
+            values = []
+            for i, value in enumerate(params):
+                if value is None:
+                    null_bitmap[i // 8] |= 1 << (i % 8)
+                param_type, data = _binary_param(value)
+                types.append(param_type)
+                values.append(data)
+            # The NULL bitmap, the new-params-bound flag, the types, then the values
+            bound = bytes(null_bitmap) + b"\x01" + b"".join(types) + b"".join(values)
+
+        try:
+            # No cursor, one iteration
+            return self._result(struct.pack("<BIBI", COMMAND.COM_STMT_EXECUTE, statement.id, 0, 1) + bound,
+                                _binary_row)
+        except BackendError as e:
+            if e.code != ER_UNKNOWN_STMT_HANDLER:
+                raise
+        # The backend dropped the statement behind our back; prepare it again
+        self.statements.pop(template, None)
+        count_statement_stat("reprepares")
+        statement = self.prepare(template)
+        return self._result(struct.pack("<BIBI", COMMAND.COM_STMT_EXECUTE, statement.id, 0, 1) + bound,
+                            _binary_row)
+
+    def cursor(self):
+        return BackendCursor(self)
+
+    def commit(self):
+        self.command(bytes([COMMAND.COM_QUERY]) + b"COMMIT")
+
+    def reset(self):
+        """
+        Clears the session state a client left (COM_RESET_CONNECTION), then restores the
+        character set and database of the handshake.
+        """
+        self.command(bytes([COM_RESET_CONNECTION]))
+        # The reset deallocated the session's prepared statements
+        self.statements.clear()
+        self.command(bytes([COMMAND.COM_QUERY]) + f"SET NAMES {BACKEND_CHARSET}".encode())
+        if self.database:
+            self.command(bytes([COMMAND.COM_INIT_DB]) + self.database.encode("utf-8"))
+
+    def ping(self, reconnect=True):
+        try:
+            self.command(bytes([COMMAND.COM_PING]))
+        except (OSError, ConnectionError, BackendError):
+            if not reconnect:
+                raise
+            self.close()
+            self.connect()
+
+    def rollback(self):
+        self.command(bytes([COMMAND.COM_QUERY]) + b"ROLLBACK")
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            self.send(bytes([COMMAND.COM_QUIT]))
+        except OSError:
+            pass
+        finally:
+            self.sock.close()
+            self.sock = None
+
+
+class BackendPool(ConnectionPool):
+    """
+    ConnectionPool of BackendConnections, for the client sessions of the front end.
+    """
+
+    def __init__(self, *args, statement_cache_size=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Prepared statements kept per connection (see BackendConnection)
+        self.statement_cache_size = statement_cache_size
+
+    def _connect(self):
+        connection = BackendConnection(self.host, self.user, self.password, self.database, self.port,
+                                       self.connect_timeout, self.statement_cache_size)
+        with self._cond:
+            self._created += 1
+        return connection
+
+
+class BackendLink:
+    """
+    A backend connection held by a client session, on which its commands are relayed.
+    """
+
+    def __init__(self, ip, pool, connection):
+        self.ip = ip
+        self.pool = pool
+        self.connection = connection
+        self.status = SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+        # Session state to reset before the connection goes back to the pool
+        self.dirty = False
+        self.broken = False
+
+    def send(self, payload):
+        self.connection.send(payload)
+
+    def read(self):
+        return self.connection.read()
+
+    def run(self, payload):
+        """
+        Runs a command for the session itself, discarding its result.
+
+        Raises:
+            BackendError: If the backend answered with an error.
+        """
+        self.dirty = True
+        self.send(payload)
+        payload, _, _ = self.read()
+        if payload[:1] == b"\xff":
+            raise BackendError(payload)
+        self.status = ok_status(payload)
+
+    def release(self):
+        """
+        Returns the connection to its pool, first resetting any session state (variables,
+        prepared statements, temporary tables, character set, database) the client left on it.
+        """
+        discard = self.broken
+        if self.dirty and not discard:
+            try:
+                self.connection.reset()
+            except Exception as e:
+                logging.warning(f"Failed to reset connection to {self.ip}: {str(e)}")
+                discard = True
+        self.pool.release(self.connection, discard=discard)
+
+
+class PreparedStatement:
+    """
+    A statement the client prepared. It is prepared again on every backend it is executed on,
+    so reads keep being balanced across workers.
+    """
+
+    def __init__(self, text, read, params):
+        self.text = text
+        self.query = text.decode("utf-8", "replace")
+        self.read = read
+        self.params = params
+        self.backend_ids = {}  # backend IP -> its statement id
+        self.types = None  # parameter types of the last execution that sent them
+        self.bound = set()  # backends that received these types
+        self.last_ip = None  # backend of the last execution, holding its cursor
+        self.long_data_ip = None  # backend holding COM_STMT_SEND_LONG_DATA for the next execution
+
+
+class ClientSession:
+    """
+    One client connection to the front end.
+
+    The session holds a connection to each backend it used. Writes, transactions, locks and
+    reads of session state (user variables, LAST_INSERT_ID(), temporary tables) go to the
+    manager; other reads are routed to a worker per statement. Session commands (SET, USE)
+    run on every held connection and are replayed on the ones opened later.
+    """
+
+    def __init__(self, frontend, sock, connection_id):
+        self.frontend = frontend
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        self.sink = _Sink(sock)
+        self.connection_id = connection_id
+        self.links = {}  # backend IP -> BackendLink
+        self.replay = []  # payloads of the session commands so far
+        self.statements = {}  # client statement id -> PreparedStatement
+        self.statement_ids = itertools.count(1)
+        self.temporary_tables = set()
+        self.locked_ip = None  # backend holding LOCK TABLES
+        self.last_ip = None  # backend of the last statement, whose warnings SHOW WARNINGS lists
+        self.consistency_token = None  # covers the session's last write
+        self.token_ip = None  # backend of a write the consistency token does not cover yet
+        self.charset = None  # character set of the client when it differs from the pools'
+
+    def serve(self):
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(self.frontend.idle_timeout)
+        try:
+            if not self.handshake():
+                return
+            while True:
+                packet, _, _ = read_packet(self.rfile.read)
+                if not packet or packet[0] == COMMAND.COM_QUIT:
+                    return
+                self.dispatch(packet)
+        except (ConnectionError, ClientGone, OSError) as e:
+            logging.debug(f"MySQL client {self.connection_id} disconnected: {str(e)}")
+        finally:
+            self.release_links()
+
+    def send(self, payload, seq=1):
+        try:
+            self.sock.sendall(frame(payload, seq)[0])
+        except OSError as e:
+            raise ClientGone(str(e))
+
+    def send_error(self, code, message, sqlstate="HY000"):
+        self.send(err_packet(code, message, sqlstate), self.sink.next_seq)
+
+    def handshake(self):
+        """
+        Authenticates the client with mysql_native_password against the front end's users.
+
+        Returns:
+            bool: False if the client was turned away.
+        """
+        salt = bytes(33 + byte % 94 for byte in os.urandom(20))
+        status = SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+        self.send(b"\x0a" + self.frontend.server_version.encode() + b"\0"
+                  + struct.pack("<I", self.connection_id) + salt[:8] + b"\0"
+                  + struct.pack("<HBHH", SERVER_CAPABILITIES & 0xFFFF, UTF8MB4_GENERAL_CI, status,
+                                SERVER_CAPABILITIES >> 16)
+                  + bytes([len(salt) + 1]) + b"\0" * 10 + salt[8:] + b"\0" + AUTH_PLUGIN + b"\0", 0)
+
+        response, _, seq = read_packet(self.rfile.read)
+        if len(response) < 32:
+            # An SSLRequest: TLS is not offered
+            self.send(err_packet(ER_NOT_SUPPORTED_AUTH_MODE, "TLS is not supported by the proxy", "08004"), seq + 1)
+            return False
+        capabilities, _, charset_id = struct.unpack_from("<IIB", response)
+        if not capabilities & CLIENT.PROTOCOL_41:
+            self.send(err_packet(ER_NOT_SUPPORTED_AUTH_MODE, "Client does not support protocol 4.1", "08004"), seq + 1)
+            return False
+        user, offset = _null_terminated(response, 32)
+        if capabilities & CLIENT.PLUGIN_AUTH_LENENC_CLIENT_DATA:
+            length, offset = read_lenenc(response, offset)
+            token, offset = response[offset:offset + length], offset + length
+        elif capabilities & CLIENT.SECURE_CONNECTION:
+            length = response[offset]
+            token, offset = response[offset + 1:offset + 1 + length], offset + 1 + length
+        else:
+            token, offset = _null_terminated(response, offset)
+        database = None
+        if capabilities & CLIENT.CONNECT_WITH_DB and offset < len(response):
+            database, offset = _null_terminated(response, offset)
+        plugin = AUTH_PLUGIN
+        if capabilities & CLIENT.PLUGIN_AUTH and offset < len(response):
+            plugin, offset = _null_terminated(response, offset)
+        seq += 1
+        if plugin != AUTH_PLUGIN:
+            # e.g. caching_sha2_password, the default of MySQL 8 clients
+            self.send(b"\xfe" + AUTH_PLUGIN + b"\0" + salt + b"\0", seq)
+            token, _, seq = read_packet(self.rfile.read)
+            seq += 1
+
+        user = user.decode("utf-8", "replace")
+        password = self.frontend.users.get(user)
+        if password is None or not hmac.compare_digest(token, native_password_token(password, salt)):
+            self.frontend.count("auth_failures")
+            self.send(err_packet(ER_ACCESS_DENIED_ERROR, f"Access denied for user '{user}'", "28000"), seq)
+            return False
+
+        try:
+            charset = charset_by_id(charset_id)
+        except KeyError:
+            charset = None
+        if charset is not None and charset.name != BACKEND_CHARSET:
+            self.charset = charset
+        if database:
+            self.replay.append(bytes([COMMAND.COM_INIT_DB]) + database)
+            # Checks the database exists
+            self.sink.next_seq = seq
+            if self.run(self.primary_ip(), bytes([COMMAND.COM_PING]), None, relay_packet, quiet=True) is None:
+                return False
+        self.send(ok_packet(status), seq)
+        return True
+
+    def dispatch(self, packet):
+        command = packet[0]
+        self.sink.next_seq = 1
+        if command == COMMAND.COM_QUERY:
+            self.query(packet)
+        elif command == COMMAND.COM_PING:
+            self.send(ok_packet(self.status()))
+        elif command == COMMAND.COM_INIT_DB:
+            self.session_command(packet)
+        elif command == COMMAND.COM_STMT_PREPARE:
+            self.prepare(packet)
+        elif command == COMMAND.COM_STMT_EXECUTE:
+            self.execute(packet)
+        elif command == COMMAND.COM_STMT_SEND_LONG_DATA:
+            self.send_long_data(packet)
+        elif command == COMMAND.COM_STMT_CLOSE:
+            self.close_statement(packet)
+        elif command in (COMMAND.COM_STMT_RESET, COMMAND.COM_STMT_FETCH):
+            self.statement_command(packet)
+        elif command == COM_RESET_CONNECTION:
+            self.reset()
+            self.send(ok_packet(self.status()))
+        elif command in (COMMAND.COM_STATISTICS, COMMAND.COM_FIELD_LIST):
+            relay = relay_packet if command == COMMAND.COM_STATISTICS else relay_rows
+            self.run(self.pinned_ip() or self.primary_ip(), packet, None, relay)
+        else:
+            self.send_error(ER_UNKNOWN_COM_ERROR, f"Command {command:#04x} is not supported by the proxy", "08S01")
+
+    def status(self):
+        """
+        Returns the server status to report in the OK packets of the front end itself.
+        """
+        link = self.links.get(self.primary_ip())
+        return link.status if link is not None else SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT
+
+    def primary_ip(self):
+        return self.frontend.route("", False)[2]
+
+    def pinned_ip(self):
+        """
+        Returns the backend every statement must go to: the one with an open transaction
+        or holding table locks, or None.
+        """
+        for ip, link in self.links.items():
+            if link.status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                return ip
+        return self.locked_ip
+
+    def autocommit(self):
+        return bool(self.status() & SERVER_STATUS.SERVER_STATUS_AUTOCOMMIT)
+
+    def needs_session(self, query, classification):
+        """
+        Returns True if a read depends on state of the connection that ran the earlier
+        statements, so it cannot go to a replica.
+        """
+        if classification.tables & self.temporary_tables:
+            return True
+        for token in tokenize(query):
+            if token.kind == VARIABLE and token.value.startswith("@") and not token.value.startswith("@@"):
+                return True
+            if token.kind == WORD and token.value in SESSION_FUNCTIONS:
+                return True
+        return False
+
+    def is_session_command(self, query, classification):
+        """
+        Returns True for statements changing only the session (SET, USE), which run on every
+        backend of the session.
+        """
+        if classification.kind == "use":
+            return True
+        if classification.kind != "set":
+            return False
+        for token in tokenize(query):
+            if token.kind == WORD and token.value in ("GLOBAL", "PERSIST", "PERSIST_ONLY", "PASSWORD"):
+                return False
+            if token.kind == VARIABLE and token.value.lower().startswith(("@@global.", "@@persist")):
+                return False
+        return True
+
+    def target(self, query, read):
+        """
+        Routes a statement: reads to a worker (one that applied the session's last write),
+        everything else to the manager of its shard group; all to the pinned backend while
+        a transaction or table lock is open.
+
+        Returns:
+            str: The backend IP, or None after an error was sent to the client.
+        """
+        pinned = self.pinned_ip()
+        read = read and pinned is None and self.autocommit()
+        if read and self.token_ip is not None:
+            # The position is only read once a read may go to a replica, not after every write
+            token = self.frontend.issue_token(self.token_ip)
+            self.token_ip = None
+            if token is not None:
+                self.consistency_token = token
+        try:
+            ip, wait_token, primary_ip = self.frontend.route(query, read, self.consistency_token)
+        except Exception as e:
+            self.send_error(ER_UNKNOWN_ERROR, str(e))
+            return None
+        if pinned is not None:
+            if primary_ip != pinned:
+                self.send_error(ER_UNKNOWN_ERROR, "Transactions spanning several shard groups are not supported")
+                return None
+            return pinned
+        if wait_token is not None:
+            try:
+                if not self.frontend.wait_for(self.link(ip).connection, wait_token):
+                    ip = primary_ip
+            except Exception as e:
+                logging.warning(f"Consistency wait on {ip} failed: {str(e)}")
+                self.drop(ip)
+                ip = primary_ip
+        return ip
+
+    def link(self, ip):
+        """
+        Returns the session's connection to a backend, opening it (with the session
+        commands so far) on first use.
+        """
+        link = self.links.get(ip)
+        if link is not None:
+            return link
+        pool = self.frontend.pool(ip)
+        link = BackendLink(ip, pool, pool.acquire())
+        try:
+            if self.charset is not None:
+                link.run(bytes([COMMAND.COM_QUERY])
+                         + f"SET NAMES {self.charset.name} COLLATE {self.charset.collation}".encode())
+            for command in self.replay:
+                link.run(command)
+        except BackendError:
+            link.release()
+            raise
+        except Exception:
+            link.broken = True
+            link.release()
+            raise
+        self.links[ip] = link
+        return link
+
+    def drop(self, ip):
+        """
+        Closes the session's connection to a backend after it failed.
+        """
+        link = self.links.pop(ip, None)
+        if link is None:
+            return
+        link.broken = True
+        link.release()
+        for statement in self.statements.values():
+            statement.backend_ids.pop(ip, None)
+            statement.bound.discard(ip)
+
+    def run(self, ip, payload, query, relay, *args, quiet=False):
+        """
+        Sends a command to a backend and relays the response to the client.
+
+        Args:
+            query (str): The statement, tracked in the proxy's statistics (None for commands
+                         that do not run one).
+            relay (callable): Reads the response, see relay_result().
+            quiet (bool): Do not relay the response (errors still are).
+
+        Returns:
+            tuple: (the link, the relay's result), or None after an error was sent to the client.
+
+        Raises:
+            ConnectionAbortedError: If the backend holding an open transaction or locks was lost.
+        """
+        sink = DISCARD if quiet else self.sink
+        try:
+            with self.frontend.track(ip, query) as outcome:
+                link = self.link(ip)
+                link.send(payload)
+                relayed = relay(link, sink, *args)
+                outcome["rows"] = getattr(relayed, "rows", 0)
+                outcome["error"] = relayed.error
+            self.sink.flush()
+            return link, relayed
+        except BackendError as e:
+            self.send(e.packet, self.sink.next_seq)
+        except Overloaded as e:
+            self.send_error(ER_UNKNOWN_ERROR, str(e))
+        except ClientGone:
+            link = self.links.get(ip)
+            if link is not None:
+                # The rest of the response was not read
+                link.broken = True
+            raise
+        except Exception as e:
+            link = self.links.get(ip)
+            lost_state = link is not None and (
+                link.status & SERVER_STATUS.SERVER_STATUS_IN_TRANS or ip == self.locked_ip)
+            self.drop(ip)
+            self.sink.buffer.clear()
+            self.send_error(ER_UNKNOWN_ERROR, f"Lost connection to backend {ip}: {str(e)}")
+            if lost_state:
+                raise ConnectionAbortedError(f"Transaction on {ip} lost")
+        return None
+
+    def after_statement(self, ip, classification, query, read, relayed):
+        """
+        Keeps track of the session state a statement changed: temporary tables, table locks,
+        and the backend of a committed write its next reads must see.
+        """
+        if relayed.error is not None:
+            return
+        kind = classification.kind
+        temporary = Token(WORD, "TEMPORARY") in tokenize(query)[:2]
+        if kind == "create" and temporary:
+            self.temporary_tables |= classification.tables
+        elif kind == "drop" and temporary:
+            self.temporary_tables -= classification.tables
+        elif kind == "lock":
+            self.locked_ip = ip
+        elif kind == "unlock":
+            self.locked_ip = None
+        if not read and not relayed.status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            self.token_ip = ip
+
+    def query(self, packet):
+        query = packet[1:].decode("utf-8", "replace")
+        classification = classify(query)
+        if self.is_session_command(query, classification):
+            self.session_command(packet)
+            return
+        read = classification.is_read and not self.needs_session(query, classification)
+        if classification.kind == "show" and tokenize(query)[1:2] in ([Token(WORD, "WARNINGS")], [Token(WORD, "ERRORS")]):
+            # Diagnostics of the previous statement, wherever it ran
+            ip = self.last_ip if self.last_ip in self.links else self.primary_ip()
+        else:
+            ip = self.target(query, read)
+        if ip is None:
+            return
+        self.frontend.count("reads" if classification.is_read else "writes")
+        result = self.run(ip, packet, query, relay_result)
+        if result is None:
+            return
+        link, relayed = result
+        self.last_ip = ip
+        if not read:
+            # Writes, locks, temporary tables and user variables may leave session state
+            link.dirty = True
+        self.after_statement(ip, classification, query, classification.is_read, relayed)
+
+    def session_command(self, packet):
+        """
+        Runs a session command on the manager, relaying its answer, then on every other
+        backend of the session, and keeps it for the ones opened later.
+        """
+        self.frontend.count("session_commands")
+        ip = self.pinned_ip() or self.primary_ip()
+        result = self.run(ip, packet, None, relay_result)
+        if result is None or result[1].error is not None:
+            return
+        result[0].dirty = True
+        self.replay.append(packet)
+        for other_ip, link in list(self.links.items()):
+            if other_ip == ip:
+                continue
+            try:
+                link.run(packet)
+            except Exception as e:
+                logging.warning(f"Session command failed on {other_ip}: {str(e)}")
+                self.drop(other_ip)
+
+    def statement(self, packet):
+        client_id = struct.unpack_from("<I", packet, 1)[0]
+        statement = self.statements.get(client_id)
+        if statement is None and packet[0] not in (COMMAND.COM_STMT_CLOSE, COMMAND.COM_STMT_SEND_LONG_DATA):
+            # CLOSE and SEND_LONG_DATA have no response, not even an error
+            self.send_error(ER_UNKNOWN_STMT_HANDLER, f"Unknown prepared statement handler ({client_id})")
+        return statement
+
+    def prepare(self, packet):
+        query = packet[1:].decode("utf-8", "replace")
+        classification = classify(query)
+        read = classification.is_read and not self.needs_session(query, classification)
+        ip = self.target(query, read)
+        if ip is None:
+            return
+        client_id = next(self.statement_ids)
+        result = self.run(ip, packet, None, relay_prepare, client_id)
+        if result is None or result[1].error is not None:
+            return
+        link, prepared = result
+        link.dirty = True
+        statement = PreparedStatement(packet[1:], read, prepared.params)
+        statement.backend_ids[ip] = prepared.backend_id
+        self.statements[client_id] = statement
+
+    def prepare_on(self, ip, statement):
+        """
+        Prepares a statement of the session on one more backend.
+
+        Returns:
+            bool: False if it could not be prepared there.
+        """
+        try:
+            link = self.link(ip)
+            link.dirty = True
+            link.send(bytes([COMMAND.COM_STMT_PREPARE]) + statement.text)
+            prepared = relay_prepare(link, DISCARD, 0)
+        except Exception as e:
+            logging.warning(f"Failed to prepare statement on {ip}: {str(e)}")
+            self.drop(ip)
+            return False
+        if prepared.error is not None:
+            return False
+        statement.backend_ids[ip] = prepared.backend_id
+        return True
+
+    def bind(self, packet, statement, ip):
+        """
+        Rewrites a statement command for a backend: its statement id, and the parameter types
+        the client sent in an earlier execution if this backend has not received them yet.
+        """
+        payload = bytearray(packet)
+        payload[1:5] = struct.pack("<I", statement.backend_ids[ip])
+        if packet[0] == COMMAND.COM_STMT_EXECUTE and statement.params:
+            # Command, statement id, flags, iteration count, NULL bitmap, then the new-params-bound flag
+            flag_at = 10 + (statement.params + 7) // 8
+            if len(payload) > flag_at:
+                if payload[flag_at] == 1:
+                    statement.types = bytes(payload[flag_at + 1:flag_at + 1 + 2 * statement.params])
+                    statement.bound = {ip}
+                elif ip not in statement.bound and statement.types is not None:
+                    payload[flag_at:flag_at + 1] = b"\x01" + statement.types
+                    statement.bound.add(ip)
+        return bytes(payload)
+
+    def execute(self, packet):
+        statement = self.statement(packet)
+        if statement is None:
+            return
+        if statement.long_data_ip is not None:
+            ip, statement.long_data_ip = statement.long_data_ip, None
+        else:
+            ip = self.target(statement.query, statement.read)
+            if ip is None:
+                return
+        if ip not in statement.backend_ids and not self.prepare_on(ip, statement):
+            if not statement.backend_ids and not self.prepare_on(self.primary_ip(), statement):
+                self.send_error(ER_UNKNOWN_ERROR, "Failed to prepare the statement on a backend")
+                return
+            # Where it is still prepared
+            ip = next(iter(statement.backend_ids))
+        self.frontend.count("reads" if statement.read else "writes")
+        result = self.run(ip, self.bind(packet, statement, ip), statement.query, relay_result)
+        statement.last_ip = self.last_ip = ip
+        if result is not None:
+            self.after_statement(ip, classify(statement.query), statement.query, statement.read, result[1])
+
+    def send_long_data(self, packet):
+        statement = self.statement(packet)
+        if statement is None or not statement.backend_ids:
+            return
+        ip = statement.long_data_ip or statement.last_ip
+        if ip not in statement.backend_ids:
+            ip = next(iter(statement.backend_ids))
+        statement.long_data_ip = ip
+        try:
+            self.links[ip].send(self.bind(packet, statement, ip))
+        except Exception as e:
+            logging.warning(f"Failed to send long data to {ip}: {str(e)}")
+            self.drop(ip)
+
+    def close_statement(self, packet):
+        statement = self.statement(packet)
+        if statement is None:
+            return
+        del self.statements[struct.unpack_from("<I", packet, 1)[0]]
+        for ip in list(statement.backend_ids):
+            try:
+                self.links[ip].send(self.bind(packet, statement, ip))
+            except Exception as e:
+                logging.warning(f"Failed to close statement on {ip}: {str(e)}")
+                self.drop(ip)
+
+    def statement_command(self, packet):
+        """
+        Relays COM_STMT_RESET or COM_STMT_FETCH to the backend of the statement's last execution.
+        """
+        statement = self.statement(packet)
+        if statement is None:
+            return
+        ip = statement.last_ip if statement.last_ip in statement.backend_ids else None
+        if packet[0] == COMMAND.COM_STMT_RESET:
+            statement.long_data_ip = None
+            if ip is None:
+                # Nothing was sent to a backend since it was prepared
+                self.send(ok_packet(self.status()))
+                return
+            self.run(ip, self.bind(packet, statement, ip), None, relay_packet)
+        elif ip is None:
+            self.send_error(ER_UNKNOWN_ERROR, "The statement has no open cursor")
+        else:
+            self.run(ip, self.bind(packet, statement, ip), None, relay_rows)
+
+    def reset(self):
+        """
+        Forgets the session state (COM_RESET_CONNECTION) and returns the connections.
+        """
+        self.release_links()
+        self.replay = []
+        self.statements = {}
+        self.temporary_tables = set()
+        self.locked_ip = None
+        self.last_ip = None
+        self.consistency_token = None
+        self.token_ip = None
+
+    def release_links(self):
+        links, self.links = self.links, {}
+        for link in links.values():
+            try:
+                link.release()
+            except Exception as e:
+                logging.warning(f"Failed to release connection to {link.ip}: {str(e)}")
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_bind(self):
+        # Every gunicorn worker listens on the port; the kernel spreads the connections across them
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.frontend.serve(self.request)
+
+
+class MySQLFrontend:
+    """
+    Listens for MySQL clients and drivers on a TCP port and relays their statements to the
+    backends with the proxy's read/write split, without the HTTP and JSON round trip.
+    Statements are classified from the COM_QUERY and COM_STMT_PREPARE text; result packets
+    are passed through as they come from the backend, rows are never decoded.
+    """
+
+    def __init__(self, pool, route, track, users, issue_token=None, wait_for=None,
+                 host="0.0.0.0", port=3306, max_clients=512, idle_timeout=28800):
+        """
+        Args:
+            pool (callable): pool(ip) returns the BackendPool the sessions take their
+                             backend connections from.
+            route (callable): route(query, read, consistency_token=None) returns
+                              (target IP, token to wait for there or None, manager of the statement's shard group).
+            track (callable): track(ip, query) is a context manager around each relayed command,
+                              yielding a dict to fill with its "rows" and "error".
+            users (dict): User name -> password of the clients allowed in.
+            issue_token (callable): issue_token(ip) returns the consistency token covering a write
+                                    just committed on a backend, or None.
+            wait_for (callable): wait_for(connection, token) returns True once a replica applied a token.
+            max_clients (int): Connections served at once; more are refused.
+            idle_timeout (float): Seconds a client may stay silent before it is disconnected.
+        """
+        self.pool = pool
+        self.route = route
+        self.track = track
+        self.users = users
+        self.issue_token = issue_token or (lambda ip: None)
+        self.wait_for = wait_for or (lambda connection, token: True)
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.server_version = DEFAULT_SERVER_VERSION
+        self._server = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        # Stats
+        self.clients = 0
+        self.counters = {"connections": 0, "refused": 0, "auth_failures": 0, "reads": 0, "writes": 0,
+                         "session_commands": 0}
+
+    def start(self):
+        """
+        Starts listening in a background thread.
+        """
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.frontend = self
+        threading.Thread(target=self._serve, daemon=True).start()
+        logging.info(f"MySQL front end listening on {self.host}:{self.port}")
+
+    def _serve(self):
+        # Clients are greeted with the version of the backends
+        try:
+            with PooledConnection(self.pool(self.route("", False)[0])) as connection:
+                self.server_version = connection.server_version
+        except Exception as e:
+            logging.warning(f"Failed to read the backend version for the MySQL front end: {str(e)}")
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def serve(self, sock):
+        with self._lock:
+            refused = self.clients >= self.max_clients
+            if refused:
+                self.counters["refused"] += 1
+            else:
+                self.clients += 1
+                self.counters["connections"] += 1
+            # Unique across the worker processes, like a MySQL connection id
+            connection_id = (os.getpid() << 16 | next(self._ids) & 0xFFFF) & 0xFFFFFFFF
+        if refused:
+            try:
+                sock.sendall(frame(err_packet(ER_CON_COUNT_ERROR, "Too many connections", "08004"))[0])
+            except OSError:
+                pass
+            return
+        try:
+            ClientSession(self, sock, connection_id).serve()
+        except Exception as e:
+            logging.error(f"MySQL client {connection_id} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self.clients -= 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, clients=self.clients, port=self.port)
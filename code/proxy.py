@@ -1,11 +1,32 @@
-from flask import Flask, request, jsonify
-import pymysql
+from flask import Flask, request, jsonify, Response
 import random
 import json
+import os
 import threading
-from collections import defaultdict
 import logging
-import subprocess
+import time
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from connection_pool import ConnectionPool, PooledConnection
+from latency_prober import LatencyProber
+from replication_monitor import ReplicationMonitor
+from result_cache import ResultCache
+from routing import cache_bypassed, cache_key, flag, least_busy, parse_params, power_of_two, valid_params
+from sql_classifier import classify, is_read_query, READ_KINDS
+from result_stream import stream_rows, STREAM_FORMATS
+from write_coalescer import WriteCoalescer
+from consistency import ConsistencyTracker, is_valid_token
+from circuit_breaker import BreakerRegistry, is_backend_failure
+from result_format import RowSet, render, dumps, negotiate_format, ROWS_FORMAT
+from metrics import MetricsRegistry, instrument_app, mark_request_failed
+from admission import AdmissionController, Overloaded
+from weighted_balancer import WeightedBalancer
+from deadlines import BUDGET_HEADER, DeadlineExceeded, QueryWatchdog, parse_budget, set_max_execution_time
+from sharding import ShardGroup, ShardRouter, ShardingError, merge_rowsets
+from shared_state import backend_load, table_versions, topology_record
+from query_digest import QueryDigest, ORDERINGS
+from hedging import HedgeAttempt, HedgingPolicy, QueryCancelled
+from mysql_frontend import BackendPool, MySQLFrontend, prepared_stats
 
 app = Flask(__name__)
 
@@ -13,94 +34,1430 @@ app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
 # Load configuration from JSON file
-with open("config.json", "r") as config_file:
+CONFIG_PATH = "config.json"
+with open(CONFIG_PATH, "r") as config_file:
     config = json.load(config_file)
 
 manager_ip = config["manager_ip"]
 worker_ips = config["worker_ips"]
 
+# Hash sharding over several replication groups (optional "sharding" section in config.json).
+# manager_ip / worker_ips above form group 0; the other groups are listed here and cannot be hot reloaded.
+sharding_config = config.get("sharding", {})
+extra_shard_groups = [ShardGroup(group["manager_ip"], group["worker_ips"]) for group in sharding_config.get("groups", [])]
+SHARD_WORKERS = [ip for group in extra_shard_groups for ip in group.worker_ips]
+SHARD_BACKENDS = [group.manager_ip for group in extra_shard_groups] + SHARD_WORKERS
+shard_router = ShardRouter(
+    group_count=1 + len(extra_shard_groups),
+    keys=sharding_config.get("keys", {})  # sharded table -> shard key column, e.g. {"payment": "customer_id"}
+) if extra_shard_groups else None
+
 # MySQL credentials
 db_user = "replica_user"
 db_password = "1234"
 db_name = "sakila"
 
-# Track active requests per worker (includes manager for writes and direct reads)
-worker_request_count = defaultdict(int)
-for ip in worker_ips:
-    worker_request_count[ip] = 0
-worker_request_count[manager_ip] = 0  # Include manager_ip explicitly
+# Queries in flight and smoothed query latency (ms) of every backend. Shared by all the
+# worker processes when served by gunicorn (see gunicorn.conf.py), so routing sees the whole load.
+backend_state = backend_load()
+
+routing_config = config.get("routing", {})
+LATENCY_EWMA_ALPHA = routing_config.get("latency_ewma_alpha", 0.2)
+
+# Connection pool settings (optional "pool" section in config.json)
+pool_config = config.get("pool", {})
+POOL_MIN_SIZE = pool_config.get("min_size", 2)
+POOL_MAX_SIZE = pool_config.get("max_size", 20)
+POOL_IDLE_TIMEOUT = pool_config.get("idle_timeout", 300)  # seconds
+POOL_CHECKOUT_TIMEOUT = pool_config.get("checkout_timeout", 5)  # seconds
+POOL_REAP_INTERVAL = pool_config.get("reap_interval", 30)  # seconds
+POOL_CONNECT_TIMEOUT = pool_config.get("connect_timeout", 2)  # seconds before a backend counts as unreachable
+
+# One connection pool per backend (manager and every worker)
+pools = {}
+
+
+def create_pool(ip):
+    """
+    Creates the connection pool of a backend and opens its first connections.
+    """
+    pool = ConnectionPool(
+        host=ip,
+        user=db_user,
+        password=db_password,
+        database=db_name,
+        port=3306,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        idle_timeout=POOL_IDLE_TIMEOUT,
+        checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+        connect_timeout=POOL_CONNECT_TIMEOUT
+    )
+    pool.warm_up()
+    return pool
+
+
+def init_pools():
+    """
+    Opens a pool for the manager and each worker so the first requests do not pay the handshake.
+    """
+    for ip in [manager_ip] + worker_ips + SHARD_BACKENDS:
+        if ip not in pools:
+            pools[ip] = create_pool(ip)
+
+
+def reap_idle_connections():
+    """
+    Background loop closing connections that sat idle for too long.
+    """
+    while True:
+        time.sleep(POOL_REAP_INTERVAL)
+        for pool in list(pools.values()) + list(frontend_pools.values()) + list(prepared_pools.values()):
+            pool.reap()
+
+
+init_pools()
+threading.Thread(target=reap_idle_connections, daemon=True).start()
+
+# Circuit breakers of every backend (optional "health" section in config.json)
+health_config = config.get("health", {})
+HEALTH_CHECK_INTERVAL = health_config.get("check_interval", 1.0)  # seconds between probes of open breakers
+breakers = BreakerRegistry(
+    backends=[manager_ip] + worker_ips + SHARD_BACKENDS,
+    failure_threshold=health_config.get("failure_threshold", 3),  # consecutive failures that open a breaker
+    open_timeout=health_config.get("open_timeout", 5.0)  # seconds before an open breaker is probed
+)
+
+
+def probe_backend(ip):
+    """
+    Runs SELECT 1 on a backend whose breaker is half-open, closing or reopening it.
+    """
+    try:
+        with PooledConnection(pools[ip]) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+    except Exception as e:
+        logging.warning(f"Health probe to {ip} failed: {str(e)}")
+        breakers.record_failure(ip)
+        return
+    logging.info(f"Backend {ip} recovered")
+    breakers.record_success(ip)
+
+
+def health_check_loop():
+    """
+    Background loop probing backends with an open breaker for recovery.
+    """
+    while True:
+        time.sleep(HEALTH_CHECK_INTERVAL)
+        for ip in breakers.due_for_probe():
+            probe_backend(ip)
+
+
+threading.Thread(target=health_check_loop, daemon=True).start()
+
+# Background latency probing of the workers (optional "prober" section in config.json)
+prober_config = config.get("prober", {})
+prober = LatencyProber(
+    backends=worker_ips + SHARD_WORKERS,
+    pools=pools,
+    interval=prober_config.get("interval", 1.0),  # seconds between probe rounds
+    mode=prober_config.get("mode", "query"),  # "tcp", "query" or "both"
+    alpha=prober_config.get("alpha", 0.3),  # EWMA smoothing factor
+    window=prober_config.get("window", 50),  # samples kept for percentiles
+    stale_after=prober_config.get("stale_after", 5.0),  # seconds before a measurement is ignored
+    max_failures=prober_config.get("max_failures", 3)
+)
+prober.start()
+
+# Weighted routing of reads (optional "weighted" section in config.json)
+weighted_config = config.get("weighted", {})
+weighted_balancer = WeightedBalancer(
+    backends=worker_ips + SHARD_WORKERS,
+    weights=weighted_config.get("weights", {}),  # worker IP -> static weight, e.g. proportional to its vCPUs
+    default_weight=weighted_config.get("default_weight", 1),
+    adaptive=weighted_config.get("adaptive", False),  # adjust the weights from observed latency and throughput
+    adapt_interval=weighted_config.get("adapt_interval", 5.0),  # seconds between adjustments
+    min_factor=weighted_config.get("min_factor", 0.25),  # bounds of the adjustment, relative to the static weight
+    max_factor=weighted_config.get("max_factor", 4.0)
+)
+
+# Background replication lag tracking of the workers (optional "replication" section in config.json)
+replication_config = config.get("replication", {})
+MAX_REPLICA_LAG = replication_config.get("max_lag", 2)  # seconds behind the manager a replica may be
+replication_monitor = ReplicationMonitor(
+    manager=manager_ip,
+    replicas=worker_ips + SHARD_WORKERS,
+    pools=pools,
+    interval=replication_config.get("interval", 1.0),  # seconds between polls
+    stale_after=replication_config.get("stale_after", 5.0)  # seconds before a status is ignored
+)
+replication_monitor.start()
+
+# Streaming of large results (optional "stream" section in config.json)
+stream_config = config.get("stream", {})
+STREAM_CHUNK_ROWS = stream_config.get("chunk_rows", 500)  # rows per emitted chunk
+STREAM_MAX_ROWS = stream_config.get("max_rows", 1000000)  # hard cutoff per response
+STREAM_MAX_BYTES = stream_config.get("max_bytes", 256 * 1024 * 1024)  # hard cutoff per response
+
+# Batch execution (optional "batch" section in config.json)
+batch_config = config.get("batch", {})
+BATCH_MAX_STATEMENTS = batch_config.get("max_statements", 100)
+# Backend groups of a batch run in parallel on this executor
+batch_executor = ThreadPoolExecutor(max_workers=batch_config.get("max_parallel_groups", 16))
+
+# Opt-in group commit of single-row INSERTs (optional "write_batching" section in config.json)
+write_batching_config = config.get("write_batching", {})
+WRITE_BATCHING_ENABLED = write_batching_config.get("enabled", False)
+
+
+def record_write_batch(ip, writes, latency_ms, error):
+    """
+    Records a group-committed batch like execute_query() records a statement: every INSERT
+    in the digest, and the batch in the backend's latency, error count and circuit breaker.
+    """
+    for query, result in writes:
+        failed = isinstance(result, dict) and "error" in result
+        record_query_digest(query, ip, latency_ms, error=failed)
+        if failed:
+            backend_query_errors.inc(ip)
+    if error is None:
+        record_query_latency(ip, latency_ms)
+        breakers.record_success(ip)
+    elif is_backend_failure(error):
+        breakers.record_failure(ip)
+
+
+write_coalescer = WriteCoalescer(
+    pools=pools,
+    window_ms=write_batching_config.get("window_ms", 5),  # longest a write waits for others to join
+    max_batch=write_batching_config.get("max_batch", 100),  # batch runs as soon as it is this large
+    mode=write_batching_config.get("mode", "transaction"),  # "transaction" or "multirow"
+    observe=record_write_batch
+)
+
+# Read-your-writes consistency tokens (optional "consistency" section in config.json)
+consistency_config = config.get("consistency", {})
+CONSISTENCY_ENABLED = consistency_config.get("enabled", False)  # also per request with ?read_your_writes=true
+consistency_tracker = ConsistencyTracker(
+    manager_pool=pools[manager_ip],
+    mode=consistency_config.get("mode", "auto"),  # "auto", "gtid" or "binlog"
+    wait_timeout=consistency_config.get("wait_timeout", 0.05)  # seconds a replica may take to catch up
+)
+
+# Read result cache (optional "cache" section in config.json)
+cache_config = config.get("cache", {})
+CACHE_ENABLED = cache_config.get("enabled", True)
+result_cache = ResultCache(
+    max_bytes=cache_config.get("max_bytes", 64 * 1024 * 1024),  # memory cap of all cached results
+    ttl=cache_config.get("ttl", 30.0),  # seconds an entry stays valid
+    max_entry_bytes=cache_config.get("max_entry_bytes", 1024 * 1024),  # larger results are not cached
+    # Writes invalidate the results every worker process cached from their tables
+    table_versions=table_versions()
+)
+
+
+# Per-backend concurrency limits and load shedding (optional "admission" section in config.json)
+admission_config = config.get("admission", {})
+ADMISSION_ENABLED = admission_config.get("enabled", True)
+admission = AdmissionController(
+    max_concurrent=admission_config.get("max_concurrent", POOL_MAX_SIZE),  # queries running per backend
+    max_queue=admission_config.get("max_queue", 64),  # queries waiting per backend beyond that
+    queue_timeout=admission_config.get("queue_timeout", 1.0),  # seconds a query may wait for a slot
+    limits=admission_config.get("limits", {}),  # max_concurrent overrides per backend IP
+    # The slots are shared by every worker process
+    shared=backend_state
+)
+
+# Query deadlines (optional "deadlines" section in config.json). The budget comes from the
+# BUDGET_HEADER set by the gatekeeper and trusted host; default_timeout applies to requests without one.
+deadline_config = config.get("deadlines", {})
+DEADLINE_DEFAULT_TIMEOUT = deadline_config.get("default_timeout", 0)  # seconds, 0 for no deadline
+watchdog = QueryWatchdog(pools)
+
+# Hedged reads (optional "hedging" section in config.json)
+hedging_config = config.get("hedging", {})
+HEDGING_ENABLED = hedging_config.get("enabled", False)  # also per request with ?hedge=true
+hedging = HedgingPolicy(
+    percentile=hedging_config.get("percentile", 95),  # a read is hedged after this latency percentile of its backend
+    min_delay=hedging_config.get("min_delay", 0.002),  # seconds, bounds of the hedge delay
+    max_delay=hedging_config.get("max_delay", 1.0),
+    window=hedging_config.get("window", 200),  # latest query latencies kept per backend
+    min_samples=hedging_config.get("min_samples", 20),  # no hedging before a backend has this many
+    budget_percent=hedging_config.get("budget_percent", 10),  # extra reads allowed, in percent of the reads
+    budget_burst=hedging_config.get("budget_burst", 10)  # hedges that can be sent back to back
+)
+# Both sides of hedged reads, and the cancellation of the losers, run on this executor
+hedge_executor = ThreadPoolExecutor(max_workers=hedging_config.get("max_threads", 64))
+
+# Per-fingerprint query statistics (optional "digest" section in config.json)
+digest_config = config.get("digest", {})
+DIGEST_ENABLED = digest_config.get("enabled", True)
+DIGEST_DUMP_PATH = digest_config.get("dump_path", "query_digest.{pid}.json")  # {pid} keeps gunicorn workers apart
+DIGEST_DUMP_INTERVAL = digest_config.get("dump_interval", 0)  # seconds between automatic dumps, 0 for none
+query_digest = QueryDigest(max_entries=digest_config.get("max_entries", 1000))  # fingerprints kept
+
+
+def digest_dump_path():
+    return DIGEST_DUMP_PATH.format(pid=os.getpid())
+
+
+def dump_digest_loop():
+    """
+    Background loop writing the query digest to its dump file.
+    """
+    while True:
+        time.sleep(DIGEST_DUMP_INTERVAL)
+        try:
+            query_digest.dump(digest_dump_path())
+        except Exception as e:
+            logging.error(f"Failed to dump the query digest: {str(e)}")
+
+
+if DIGEST_ENABLED and DIGEST_DUMP_INTERVAL > 0:
+    threading.Thread(target=dump_digest_loop, daemon=True).start()
+
+# MySQL protocol front end (optional "mysql_frontend" section in config.json)
+mysql_frontend_config = config.get("mysql_frontend", {})
+MYSQL_FRONTEND_ENABLED = mysql_frontend_config.get("enabled", False)
+MYSQL_FRONTEND_STRATEGY = mysql_frontend_config.get("strategy", "lag_aware")  # routing strategy of the reads
+MYSQL_FRONTEND_READ_YOUR_WRITES = mysql_frontend_config.get("read_your_writes", True)  # a session's reads see its writes
+# Client sessions hold their backend connections, so they get pools of their own
+MYSQL_FRONTEND_MAX_BACKEND_CONNECTIONS = mysql_frontend_config.get("max_backend_connections", 100)  # per backend
+frontend_pools = {}
+frontend_pools_lock = threading.Lock()
+
+
+def frontend_pool(ip):
+    """
+    Returns the pool the MySQL front end's sessions take their connections to a backend from.
+    """
+    with frontend_pools_lock:
+        pool = frontend_pools.get(ip)
+        if pool is None:
+            pool = frontend_pools[ip] = BackendPool(
+                host=ip,
+                user=db_user,
+                password=db_password,
+                database=db_name,
+                port=3306,
+                min_size=0,
+                max_size=MYSQL_FRONTEND_MAX_BACKEND_CONNECTIONS,
+                idle_timeout=POOL_IDLE_TIMEOUT,
+                checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                connect_timeout=POOL_CONNECT_TIMEOUT
+            )
+    return pool
+
+
+# Server-side prepared statements for parameterized queries (optional "prepared_statements" section)
+prepared_config = config.get("prepared_statements", {})
+PREPARED_ENABLED = prepared_config.get("enabled", True)
+PREPARED_CACHE_SIZE = prepared_config.get("cache_size", 64)  # statements kept prepared per connection
+# Run on connections speaking the binary protocol (mysql_frontend.BackendConnection), pooled apart
+prepared_pools = {}
+prepared_pools_lock = threading.Lock()
+
+
+def prepared_pool(ip):
+    """
+    Returns the pool of a backend whose connections run parameterized queries as cached
+    server-side prepared statements.
+    """
+    with prepared_pools_lock:
+        pool = prepared_pools.get(ip)
+        if pool is None:
+            pool = prepared_pools[ip] = BackendPool(
+                host=ip,
+                user=db_user,
+                password=db_password,
+                database=db_name,
+                port=3306,
+                min_size=0,
+                max_size=POOL_MAX_SIZE,
+                idle_timeout=POOL_IDLE_TIMEOUT,
+                checkout_timeout=POOL_CHECKOUT_TIMEOUT,
+                connect_timeout=POOL_CONNECT_TIMEOUT,
+                statement_cache_size=PREPARED_CACHE_SIZE
+            )
+    return pool
+
+# Prometheus metrics served on GET /metrics
+STRATEGIES = ["direct", "random", "customized", "lag_aware", "least_outstanding", "power_of_two", "weighted"]
+metrics_registry = MetricsRegistry()
+instrument_app(app, metrics_registry, "proxy",
+               lambda: request.path[1:] if request.path[1:] in STRATEGIES else "")
+backend_query_latency = metrics_registry.histogram(
+    "proxy_backend_query_duration_seconds", "Query execution time per backend.", ("backend",))
+backend_query_errors = metrics_registry.counter(
+    "proxy_backend_query_errors_total", "Failed queries per backend.", ("backend",))
+metrics_registry.callback("proxy_backend_in_flight", "Queries in flight per backend.",
+                          lambda: {ip: backend_state.in_flight(ip) for ip in all_backends()}, "backend",
+                          multiprocess_mode="max")
+metrics_registry.callback("proxy_backend_latency_ewma_seconds", "Smoothed query latency per backend.",
+                          lambda: {ip: latency / 1000 for ip, latency in backend_latencies().items()}, "backend",
+                          multiprocess_mode="max")
+metrics_registry.callback("proxy_backend_circuit_open", "1 while the backend's circuit breaker is not closed.",
+                          lambda: {ip: int(state["state"] != "closed") for ip, state in breakers.snapshot().items()},
+                          "backend", multiprocess_mode="max")
+metrics_registry.callback("proxy_backend_weight", "Effective routing weight of the weighted strategy per worker.",
+                          lambda: {ip: weights["effective_weight"] for ip, weights in weighted_balancer.snapshot().items()},
+                          "backend", multiprocess_mode="max")
+metrics_registry.callback("proxy_replica_lag_seconds", "Replication lag per worker.",
+                          lambda: {ip: replication_monitor.lag(ip) for ip in worker_ips + SHARD_WORKERS}, "backend",
+                          multiprocess_mode="max")
+for key, kind in (("in_use", "gauge"), ("idle", "gauge"), ("created", "counter"),
+                  ("evicted", "counter"), ("waits", "counter")):
+    name = f"proxy_pool_{key}_total" if kind == "counter" else f"proxy_pool_{key}"
+    metrics_registry.callback(name, f"Connection pool {key.replace('_', ' ')} per backend.",
+                              lambda key=key: {ip: pool.stats()[key] for ip, pool in list(pools.items())}, "backend", kind)
+for key, kind in (("entries", "gauge"), ("bytes", "gauge"), ("hits", "counter"), ("misses", "counter"),
+                  ("evictions", "counter"), ("expirations", "counter"), ("invalidations", "counter")):
+    name = f"proxy_cache_{key}_total" if kind == "counter" else f"proxy_cache_{key}"
+    metrics_registry.callback(name, f"Result cache {key}.",
+                              lambda key=key: result_cache.stats()[key], kind=kind)
+metrics_registry.callback("proxy_admission_active", "Queries holding an admission slot per backend.",
+                          lambda: {ip: stats["active"] for ip, stats in admission.stats().items()}, "backend")
+metrics_registry.callback("proxy_admission_queue_depth", "Queries waiting for an admission slot per backend.",
+                          lambda: {ip: stats["queue_depth"] for ip, stats in admission.stats().items()}, "backend")
+metrics_registry.callback("proxy_admission_queue_seconds_total", "Time spent waiting for admission per backend.",
+                          lambda: {ip: stats["queue_time_total_s"] for ip, stats in admission.stats().items()},
+                          "backend", "counter")
+for reason in ("queue_full", "predicted_timeout", "queue_timeout"):
+    metrics_registry.callback(f"proxy_admission_rejected_{reason}_total", f"Queries shed per backend ({reason}).",
+                              lambda reason=reason: {ip: stats["rejected"][reason]
+                                                     for ip, stats in admission.stats().items()},
+                              "backend", "counter")
+for key in ("reads", "hedges", "hedge_wins", "budget_exhausted"):
+    metrics_registry.callback(f"proxy_hedging_{key}_total", f"Read hedging {key.replace('_', ' ')}.",
+                              lambda key=key: hedging.stats()[key], kind="counter")
+metrics_registry.callback("proxy_hedge_delay_seconds", "Time a read waits before it is hedged, per backend.",
+                          lambda: {ip: delay / 1000 for ip, delay in hedging.stats()["delays_ms"].items()
+                                   if delay is not None}, "backend", multiprocess_mode="max")
+metrics_registry.callback("proxy_query_cancels_total", "Losing hedged reads cancelled with KILL QUERY.",
+                          lambda: watchdog.stats()["cancels"], kind="counter")
+metrics_registry.callback("proxy_mysql_clients", "Clients connected to the MySQL front end.",
+                          lambda: mysql_frontend.stats()["clients"])
+for key in ("connections", "refused", "auth_failures", "reads", "writes", "session_commands"):
+    metrics_registry.callback(f"proxy_mysql_{key}_total", f"MySQL front end {key.replace('_', ' ')}.",
+                              lambda key=key: mysql_frontend.stats()[key], kind="counter")
+metrics_registry.callback("proxy_digest_fingerprints", "Query fingerprints tracked by the digest.",
+                          lambda: query_digest.stats()["fingerprints"])
+metrics_registry.callback("proxy_digest_evictions_total", "Fingerprints evicted from the digest.",
+                          lambda: query_digest.stats()["evictions"], kind="counter")
+metrics_registry.callback("proxy_deadline_kills_total", "Queries cancelled with KILL QUERY at their deadline.",
+                          lambda: watchdog.stats()["kills"], kind="counter")
+for key in ("batches", "coalesced_writes"):
+    metrics_registry.callback(f"proxy_write_{key}_total", f"Write batching {key.replace('_', ' ')}.",
+                              lambda key=key: write_coalescer.stats()[key], kind="counter")
+for key in ("prepares", "hits", "evictions", "reprepares"):
+    metrics_registry.callback(f"proxy_prepared_{key}_total", f"Prepared statement cache {key}.",
+                              lambda key=key: prepared_stats()[key], kind="counter")
+
 
-# Lock for thread safety
-lock = threading.Lock()
+# Hot reload of the backends (optional "topology" section in config.json)
+topology_config = config.get("topology", {})
+TOPOLOGY_WATCH_INTERVAL = topology_config.get("watch_interval", 2.0)  # seconds between checks of config.json
+TOPOLOGY_DRAIN_GRACE = topology_config.get("drain_grace", 1.0)  # seconds a removed backend keeps its pool at least
+TOPOLOGY_DRAIN_TIMEOUT = topology_config.get("drain_timeout", 30.0)  # seconds to wait for its queries to finish
+TOPOLOGY_SYNC_INTERVAL = topology_config.get("sync_interval", 0.2)  # seconds between checks of the other workers' changes
+# Last topology set with POST /topology by any worker process
+shared_topology = topology_record()
+# Serializes topology changes; request handling never takes it
+topology_lock = threading.Lock()
 
 
-def measure_ping(ip):
+def backend_ready(pool):
     """
-    Measures the ping response time to a specific IP address on MacOS.
-    Returns the average ping time in milliseconds or a high value if unreachable.
+    Returns True if a freshly created pool can run a query.
     """
     try:
-        # Use ping to measure response time (adjusted for MacOS)
-        result = subprocess.run(["ping", "-c", "1", ip], capture_output=True, text=True, timeout=2)
-        if result.returncode == 0:
-            # Extract the time from the ping output
-            for line in result.stdout.split('\n'):
-                if "time=" in line:
-                    return float(line.split("time=")[1].split(" ")[0])  # Extract time in ms
-        return float('inf')  # Return high value if ping fails
+        with PooledConnection(pool) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+        return True
     except Exception as e:
-        logging.error(f"Ping to {ip} failed: {str(e)}")
-        return float('inf')  # Return high value if exception occurs
+        logging.error(f"Backend {pool.host} is not ready: {str(e)}")
+        return False
+
+
+def apply_topology(new_manager, new_workers):
+    """
+    Swaps the backend set without a restart. New backends get a warm pool, pass a
+    SELECT 1 and join the breakers, prober and replication monitor before they are
+    routable; removed backends are drained in the background.
+
+    Args:
+        new_manager (str): The manager that takes the writes.
+        new_workers (list): The replicas that serve the reads.
+
+    Returns:
+        dict: The added and removed backends.
 
+    Raises:
+        ValueError: If a new backend cannot be reached; nothing is changed then.
+    """
+    global manager_ip, worker_ips
+    new_workers = [ip for ip in dict.fromkeys(new_workers) if ip != new_manager]
+    shared = [ip for ip in [new_manager] + new_workers if ip in SHARD_BACKENDS]
+    if shared:
+        raise ValueError(f"Backends {shared} belong to another shard group")
+    with topology_lock:
+        current = [manager_ip] + worker_ips
+        backends = [new_manager] + new_workers
+        added = [ip for ip in backends if ip not in current]
+        removed = [ip for ip in current if ip not in backends]
+
+        warmed = {}
+        for ip in added:
+            # A backend added back while it drains keeps its pool
+            pool = pools[ip] if ip in pools else create_pool(ip)
+            if not backend_ready(pool):
+                for new_ip, new_pool in list(warmed.items()) + [(ip, pool)]:
+                    if new_ip not in pools:
+                        new_pool.close()
+                raise ValueError(f"Backend {ip} is not reachable")
+            warmed[ip] = pool
+        pools.update(warmed)
+
+        # The other shard groups keep their backends
+        breakers.set_backends(backends + SHARD_BACKENDS)
+        prober.set_backends(new_workers + SHARD_WORKERS)
+        weighted_balancer.set_backends(new_workers + SHARD_WORKERS)
+        replication_monitor.set_topology(new_manager, new_workers + SHARD_WORKERS)
+        consistency_tracker.manager_pool = pools[new_manager]
+        # From here on, routing only sees the new backends
+        manager_ip, worker_ips = new_manager, new_workers
+
+    for ip in removed:
+        threading.Thread(target=drain_backend, args=(ip,), daemon=True).start()
+    logging.info(f"Topology updated: manager {new_manager}, workers {new_workers} "
+                 f"(added {added}, removed {removed})")
+    return {"added": added, "removed": removed}
 
-def execute_query(target_ip, query):
+
+def drain_backend(ip):
+    """
+    Waits for the queries still running on a removed backend, then closes its pool.
+    """
+    time.sleep(TOPOLOGY_DRAIN_GRACE)
+    deadline = time.monotonic() + TOPOLOGY_DRAIN_TIMEOUT
+    while time.monotonic() < deadline:
+        in_flight = backend_state.in_flight(ip)
+        pool = pools.get(ip)
+        if in_flight <= 0 and (pool is None or pool.stats()["in_use"] == 0):
+            break
+        time.sleep(0.1)
+    else:
+        logging.warning(f"Backend {ip} still busy after {TOPOLOGY_DRAIN_TIMEOUT}s, closing its pool anyway")
+
+    with topology_lock:
+        if ip == manager_ip or ip in worker_ips:
+            # Added back while draining
+            return
+        pool = pools.pop(ip, None)
+        backend_state.forget_latency(ip)
+    if pool is not None:
+        pool.close()
+    watchdog.forget(ip)
+    for backend_pools, lock in ((frontend_pools, frontend_pools_lock), (prepared_pools, prepared_pools_lock)):
+        with lock:
+            pool = backend_pools.pop(ip, None)
+        if pool is not None:
+            pool.close()
+    logging.info(f"Backend {ip} drained")
+
+
+def watch_config():
+    """
+    Background loop applying the manager_ip and worker_ips of config.json when the file changes.
+    Other settings still need a restart.
+    """
+    last_modified = os.path.getmtime(CONFIG_PATH)
+    while True:
+        time.sleep(TOPOLOGY_WATCH_INTERVAL)
+        try:
+            modified = os.path.getmtime(CONFIG_PATH)
+            if modified == last_modified:
+                continue
+            last_modified = modified
+            with open(CONFIG_PATH, "r") as config_file:
+                new_config = json.load(config_file)
+            if new_config["manager_ip"] != manager_ip or new_config["worker_ips"] != worker_ips:
+                apply_topology(new_config["manager_ip"], new_config["worker_ips"])
+        except Exception as e:
+            logging.error(f"Failed to reload topology from {CONFIG_PATH}: {str(e)}")
+
+
+threading.Thread(target=watch_config, daemon=True).start()
+
+
+def follow_topology(synced_generation):
+    """
+    Applies the topology last set with POST /topology in any worker process, if it was
+    published after synced_generation and after config.json last changed (a newer file wins).
+
+    Returns:
+        int: The generation of the published topology.
+
+    Raises:
+        ValueError: If one of its backends cannot be reached from this process.
+    """
+    generation, published = shared_topology.read()
+    if generation == synced_generation or published is None:
+        return generation
+    if published["published_at"] < os.path.getmtime(CONFIG_PATH):
+        return generation
+    if published["manager_ip"] != manager_ip or published["worker_ips"] != worker_ips:
+        apply_topology(published["manager_ip"], published["worker_ips"])
+    return generation
+
+
+def sync_topology(synced_generation):
+    """
+    Background loop following the topology changes made in the other worker processes.
+    One that cannot be applied yet is retried every watch_interval.
+    """
+    while True:
+        try:
+            synced_generation = follow_topology(synced_generation)
+            time.sleep(TOPOLOGY_SYNC_INTERVAL)
+        except Exception as e:
+            logging.error(f"Failed to apply the topology of another worker: {str(e)}")
+            time.sleep(TOPOLOGY_WATCH_INTERVAL)
+
+
+# A worker started after a POST /topology adopts it before serving
+try:
+    topology_generation = follow_topology(0)
+except Exception as e:
+    logging.error(f"Failed to apply the topology of another worker: {str(e)}")
+    topology_generation = 0
+threading.Thread(target=sync_topology, args=(topology_generation,), daemon=True).start()
+
+
+def run_statement(connection, cursor, query, params=None, target_ip=None, deadline=None, attempt=None):
+    """
+    Runs one statement on a cursor. On a connection of a prepared_pool, a parameterized
+    statement runs as a cached server-side prepared statement; elsewhere its parameters are
+    escaped and bound by pymysql.
+    With a deadline, SELECTs are capped with MAX_EXECUTION_TIME and the watchdog sends
+    KILL QUERY if the statement is still running when it expires.
+    A hedge attempt (see hedging.py) can be cancelled with KILL QUERY while it runs.
+    """
+    watch = None
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Deadline exceeded before the query started")
+        set_max_execution_time(connection, cursor, remaining)
+    else:
+        set_max_execution_time(connection, cursor, 0)
+    if deadline is not None or attempt is not None:
+        watch = watchdog.watch(target_ip, connection.thread_id(), deadline)
+        if attempt is not None and not attempt.start(watch):
+            watchdog.unwatch(watch)
+            raise QueryCancelled("Hedged read cancelled before it started")
+    try:
+        cursor.execute(query, tuple(params) if params is not None else None)
+    finally:
+        if watch is not None and watchdog.unwatch(watch):
+            if attempt is not None and attempt.cancelled:
+                raise QueryCancelled("Hedged read cancelled")
+            raise DeadlineExceeded("Query killed at its deadline")
+
+
+def execute_query(target_ip, query, params=None, consistency_token=None, failover_strategy=None, deadline=None,
+                  attempt=None, issue_token=False):
     """
     Executes a MySQL query on the specified target IP.
+    A query with params is a template with one %s placeholder per parameter.
+    With a consistency token, the backend first waits briefly to apply it; None is
+    returned if it did not catch up in time.
+    With a failover strategy (the routing strategy of a read), a read that fails because its
+    backend is down is retried once on another healthy backend that strategy allows.
+    With a deadline (time.monotonic() value), the query is cancelled on the backend when it expires.
+    With a hedge attempt, the query can be cancelled by the other side of a hedged read.
+    With issue_token, a successful write returns the consistency token covering it, read on
+    its own connection.
+    Parameterized queries run as server-side prepared statements (see prepared_pool).
     """
     try:
-        connection = pymysql.connect(
-            host=target_ip,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            port=3306  # MySQL port
-        )
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            if query.strip().lower().startswith("select"):
-                result = cursor.fetchall()
-            else:
-                connection.commit()
-                result = {"status": "success"}
-        connection.close()
+        start = time.perf_counter()
+        pool = prepared_pool(target_ip) if params is not None and PREPARED_ENABLED else pools[target_ip]
+        with PooledConnection(pool) as connection:
+            with connection.cursor() as cursor:
+                if consistency_token and not consistency_tracker.wait_for(cursor, consistency_token):
+                    return None
+                run_statement(connection, cursor, query, params, target_ip, deadline, attempt)
+                classification = classify(query)
+                if classification.kind in READ_KINDS:
+                    result = RowSet([column[0] for column in cursor.description or ()], cursor.fetchall())
+                else:
+                    result = {"status": "success"}
+                # Writes and locking reads (SELECT ... FOR UPDATE) run in a transaction to commit
+                if not classification.is_read:
+                    connection.commit()
+                    if issue_token and isinstance(result, dict):
+                        result["consistency_token"] = consistency_tracker.read_token(cursor)
+        latency_ms = (time.perf_counter() - start) * 1000
+        record_query_latency(target_ip, latency_ms)
+        record_query_digest(query, target_ip, latency_ms, len(result.rows) if isinstance(result, RowSet) else 0)
+        breakers.record_success(target_ip)
         return result
+    except QueryCancelled as e:
+        # The other side of a hedged read answered first
+        return {"error": str(e)}
     except Exception as e:
         logging.error(f"Error executing query on {target_ip}: {str(e)}")
+        backend_query_errors.inc(target_ip)
+        record_query_digest(query, target_ip, (time.perf_counter() - start) * 1000, error=True)
+        if not is_backend_failure(e):
+            return {"error": str(e)}
+        breakers.record_failure(target_ip)
+        if failover_strategy:
+            fallback_ip = failover_target(target_ip, failover_strategy)
+            if fallback_ip is not None:
+                logging.info(f"Failing over query from {target_ip} to {fallback_ip}")
+                increment_worker_requests(fallback_ip)
+                try:
+                    return execute_query(fallback_ip, query, params, deadline=deadline)
+                finally:
+                    decrement_worker_requests(fallback_ip)
         return {"error": str(e)}
 
 
-def get_least_busy_worker():
+def record_query_latency(ip, latency_ms):
+    """
+    Folds a measured query latency into the backend's EWMA.
+    """
+    backend_query_latency.observe(latency_ms / 1000, ip)
+    weighted_balancer.record(ip, latency_ms)
+    backend_state.record_latency(ip, latency_ms, LATENCY_EWMA_ALPHA)
+    hedging.record(ip, latency_ms)
+
+
+def record_query_digest(query, ip, latency_ms, rows=0, error=False):
+    """
+    Adds an execution to the per-fingerprint statistics if the digest is enabled.
+    """
+    if DIGEST_ENABLED:
+        query_digest.record(query, latency_ms, rows, ip, error)
+
+
+def all_backends():
+    """
+    Returns every backend of the current topology, shard groups included.
+    """
+    return [manager_ip] + worker_ips + SHARD_BACKENDS
+
+
+def backend_latencies():
+    """
+    Returns the smoothed query latency in milliseconds of the backends that served a query.
+    """
+    latencies = {ip: backend_state.latency(ip) for ip in all_backends()}
+    return {ip: latency for ip, latency in latencies.items() if latency is not None}
+
+
+def get_least_busy_worker(candidates=None):
     """
     Selects the worker with the lowest request count.
+
+    Args:
+        candidates (list): Backends to choose from (defaults to every backend).
+    """
+    if candidates is None:
+        candidates = all_backends()
+    return least_busy(candidates, backend_state.in_flight)
+
+
+def get_power_of_two_worker(candidates):
+    """
+    Power-of-two-choices over the workers' load across every worker process (see routing.power_of_two).
+    """
+    return power_of_two(candidates, backend_state.in_flight, backend_state.latency)
+
+
+def shard_group(index=0):
+    """
+    Returns the manager and workers of a shard group (group 0 without sharding).
     """
-    with lock:
-        return min(worker_request_count, key=worker_request_count.get)
+    if index == 0:
+        return ShardGroup(manager_ip, worker_ips)
+    return extra_shard_groups[index - 1]
+
+
+def backend_group(ip):
+    """
+    Returns the shard group a backend belongs to.
+    """
+    for group in extra_shard_groups:
+        if ip == group.manager_ip or ip in group.worker_ips:
+            return group
+    return shard_group(0)
+
+
+def failover_target(failed_ip, strategy):
+    """
+    Picks where to retry a read whose backend just failed: another healthy worker of
+    the same shard group (a fresh one under lag_aware, none under direct), else its manager.
+    """
+    group = backend_group(failed_ip)
+    if strategy != "direct":
+        healthy_workers = [ip for ip in breakers.available(group.worker_ips) if ip != failed_ip]
+        if strategy == "lag_aware":
+            fresh_workers = replication_monitor.fresh_replicas(MAX_REPLICA_LAG)
+            healthy_workers = [ip for ip in healthy_workers if ip in fresh_workers]
+        if healthy_workers:
+            return random.choice(healthy_workers)
+    if failed_ip != group.manager_ip:
+        return group.manager_ip
+    return None
+
+
+def select_read_target(strategy, group=None):
+    """
+    Picks the backend that serves a read under the given routing strategy, among the
+    backends of a shard group (group 0 by default).
+    Workers whose circuit breaker is open are skipped; with none left, reads go to the manager.
+    """
+    group_manager, group_workers = group or shard_group(0)
+    if strategy == "direct":
+        # Direct: reads go to the manager too
+        return group_manager
+    healthy_workers = breakers.available(group_workers)
+    if not healthy_workers:
+        return group_manager
+    if strategy == "random":
+        return random.choice(healthy_workers)
+    if strategy == "customized":
+        # Fastest worker from the last probe round, random worker if every measurement is stale
+        fastest = prober.fastest()
+        if fastest in healthy_workers:
+            return fastest
+        # The fastest worker may belong to another shard group
+        latencies = {ip: prober.latency(ip) for ip in healthy_workers}
+        measured = [ip for ip, latency in latencies.items() if latency is not None]
+        return min(measured, key=latencies.get) if measured else random.choice(healthy_workers)
+    if strategy == "lag_aware":
+        fresh_workers = [ip for ip in replication_monitor.fresh_replicas(MAX_REPLICA_LAG) if ip in healthy_workers]
+        return random.choice(fresh_workers) if fresh_workers else group_manager
+    if strategy == "least_outstanding":
+        return get_least_busy_worker(healthy_workers)
+    if strategy == "power_of_two":
+        return get_power_of_two_worker(healthy_workers)
+    if strategy == "weighted":
+        # None if every healthy worker has weight 0
+        return weighted_balancer.pick(healthy_workers) or random.choice(healthy_workers)
+    return group_manager
+
+
+def choose_target(strategy, query, group=None):
+    """
+    Routes a query: reads follow the strategy, writes always go to the manager
+    (of the shard group, group 0 by default).
+    """
+    if is_read_query(query):
+        return select_read_target(strategy, group)
+    return (group or shard_group(0)).manager_ip
+
+
+def admit(ip, deadline=None):
+    """
+    Waits for a free slot on a backend if admission control is enabled, no longer than
+    the request's deadline allows.
+
+    Returns:
+        float: Token for release_admission(), or None if admission control is disabled.
+
+    Raises:
+        Overloaded: If the backend is over capacity and the query is shed.
+    """
+    if not ADMISSION_ENABLED:
+        return None
+    return admission.acquire(ip, deadline - time.monotonic() if deadline is not None else None)
+
+
+def release_admission(ip, admitted_at):
+    if admitted_at is not None:
+        admission.release(ip, admitted_at)
+
+
+def request_deadline():
+    """
+    Returns the deadline of the current request as a time.monotonic() value, or None.
+    """
+    budget = parse_budget(request.headers.get(BUDGET_HEADER))
+    if budget is None:
+        budget = DEADLINE_DEFAULT_TIMEOUT or None
+    return time.monotonic() + budget if budget is not None else None
+
+
+def deadline_passed(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def deadline_response():
+    """
+    Answers a query whose time budget ran out with 504.
+    """
+    mark_request_failed()
+    return jsonify({"error": "Deadline exceeded"}), 504
+
+
+def overloaded_response(error):
+    """
+    Answers a shed query with 503 and a Retry-After hint.
+    """
+    logging.warning(str(error))
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
 
 
 def increment_worker_requests(ip):
     """
     Increments the request count for a worker.
     """
-    with lock:
-        worker_request_count[ip] += 1
+    backend_state.add(ip, 1)
 
 
 def decrement_worker_requests(ip):
     """
     Decrements the request count for a worker.
     """
-    with lock:
-        worker_request_count[ip] -= 1
+    backend_state.add(ip, -1)
+
+
+def hedging_requested():
+    """
+    Returns True if reads of the current request may be hedged: enabled in config.json,
+    or asked for with ?hedge=true.
+    """
+    return flag(request.args.get("hedge"), HEDGING_ENABLED)
+
+
+def tokens_requested():
+    """
+    Returns True if writes of the current request return a consistency token: enabled in
+    config.json, or asked for with ?read_your_writes=true.
+    """
+    return flag(request.args.get("read_your_writes"), CONSISTENCY_ENABLED)
+
+
+def write_batching_requested():
+    """
+    Returns True if INSERTs of the current request may be group-committed: enabled in
+    config.json, or asked for with ?coalesce=true.
+    """
+    return flag(request.args.get("coalesce"), WRITE_BATCHING_ENABLED)
+
+
+def bounded_int_arg(name, default, upper_bound):
+    """
+    Reads a positive integer query-string argument, capped at upper_bound.
+    """
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        value = default
+    return max(1, min(value, upper_bound))
+
+
+def stream_query(target_ip, query, stream_format, params=None):
+    """
+    Streams the result of a read as chunked NDJSON or JSON-array fragments.
+    The chunk size and row/byte cutoffs can be lowered per request with
+    ?chunk_rows=, ?max_rows= and ?max_bytes=.
+    """
+    chunk_rows = bounded_int_arg("chunk_rows", STREAM_CHUNK_ROWS, STREAM_MAX_ROWS)
+    max_rows = bounded_int_arg("max_rows", STREAM_MAX_ROWS, STREAM_MAX_ROWS)
+    max_bytes = bounded_int_arg("max_bytes", STREAM_MAX_BYTES, STREAM_MAX_BYTES)
+
+    logging.info(f"Streaming query from {target_ip}: {query}")
+
+    try:
+        admitted_at = admit(target_ip)
+    except Overloaded as e:
+        return overloaded_response(e)
+    increment_worker_requests(target_ip)
+    try:
+        rows = stream_rows(pools[target_ip], query, stream_format, chunk_rows, max_rows, max_bytes, params)
+    except Exception as e:
+        decrement_worker_requests(target_ip)
+        release_admission(target_ip, admitted_at)
+        logging.error(f"Error executing query on {target_ip}: {str(e)}")
+        return jsonify({"error": str(e)})
+
+    def generate():
+        # The query stays in flight until the last chunk is sent
+        try:
+            yield from rows
+        finally:
+            decrement_worker_requests(target_ip)
+            release_admission(target_ip, admitted_at)
+
+    return Response(generate(), mimetype=STREAM_FORMATS[stream_format])
+
+
+def consistent_read_target(target_ip, consistency_token):
+    """
+    Picks the replica for a read that must see the writes covered by a consistency token.
+
+    Returns:
+        tuple: (target IP, token to wait for on that target, or None if it is known to be caught up)
+    """
+    caught_up = [ip for ip in backend_group(target_ip).worker_ips
+                 if consistency_tracker.known_caught_up(replication_monitor.replica_status(ip), consistency_token)]
+    if target_ip in caught_up:
+        return target_ip, None
+    if caught_up:
+        return random.choice(caught_up), None
+    # No replica known to be caught up: the chosen one waits briefly, then we fall back to the manager
+    return target_ip, consistency_token
+
+
+def invalidate_written_tables(tables):
+    """
+    Drops every cached read of the written tables (everything if we cannot tell which).
+    """
+    if tables:
+        result_cache.invalidate_tables(tables)
+    else:
+        result_cache.clear()
+
+
+def replica_write_window(ip):
+    """
+    Returns how long after a write a read served by a replica may still miss it: its
+    replication lag rounded up to the next second (the granularity MySQL reports it in),
+    or the cache TTL while the lag is unknown.
+    """
+    lag = replication_monitor.lag(ip)
+    return lag + 1 if lag is not None else result_cache.ttl
+
+
+def result_response(result):
+    """
+    Serializes a query result in the format the client asked for in its Accept header.
+    """
+    if isinstance(result, dict) and "error" in result:
+        mark_request_failed()
+    body, content_type = render(result, negotiate_format(request.accept_mimetypes))
+    return Response(body, content_type=content_type)
+
+
+def forward_query(target_ip, query, strategy="direct"):
+    """
+    Runs the query on the chosen backend while tracking it as in flight, and builds the response.
+    In sharding mode, a statement owned by another shard group, or spanning several, is
+    handed to forward_sharded_query with the routing strategy.
+    Reads are served from the result cache when possible; writes invalidate the tables they touch.
+    The response format of reads is negotiated through the Accept header (see result_format).
+    A parameterized query sends its parameters as a JSON list in ?params=.
+    Writes sent with ?read_your_writes=true return a consistency token; a read sent with it
+    in ?consistency_token= skips the result cache and only runs on a replica that applied it,
+    or on the manager.
+    """
+    try:
+        params = parse_params(request.args.get("params"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    consistency_token = request.args.get("consistency_token")
+    if consistency_token and not is_valid_token(consistency_token):
+        return jsonify({"error": "Invalid consistency token"}), 400
+
+    if shard_router is not None:
+        try:
+            plan = shard_router.plan(query, params)
+        except ShardingError as e:
+            return jsonify({"error": str(e)}), 400
+        # Reads of unsharded tables and statements owned by group 0 take the usual path
+        if plan is not None and plan.groups != [0]:
+            return forward_sharded_query(strategy, query, params, plan)
+
+    classification = classify(query)
+    is_read = classification.is_read
+    tables = classification.tables
+    # A read with a consistency token must see the client's write, which a cached result may predate
+    use_cache = (CACHE_ENABLED and is_read and not consistency_token
+                 and not cache_bypassed(request.args, request.headers) and ResultCache.is_cacheable(query))
+
+    wait_token = None
+    if consistency_token and is_read and target_ip in backend_group(target_ip).worker_ips:
+        target_ip, wait_token = consistent_read_target(target_ip, consistency_token)
+
+    # Large reads can be streamed with ?stream=ndjson or ?stream=json
+    stream_format = request.args.get("stream")
+    if stream_format and is_read:
+        if stream_format not in STREAM_FORMATS:
+            return jsonify({"error": "Invalid stream format"}), 400
+        if wait_token is not None:
+            # No replica is known to have applied the token, and a stream cannot wait then
+            # fall back once its rows started: read from the manager of the group
+            target_ip = backend_group(target_ip).manager_ip
+        return stream_query(target_ip, query, stream_format, params)
+
+    if use_cache:
+        key = cache_key(query, params)
+        cached = result_cache.get(key)
+        if cached is not None:
+            logging.info(f"Serving query from cache: {query}")
+            return result_response(cached)
+        versions = result_cache.versions(tables)
+
+    logging.info(f"Routing query to {target_ip}: {query}")
+
+    deadline = request_deadline()
+    if deadline_passed(deadline):
+        return deadline_response()
+    try:
+        admitted_at = admit(target_ip, deadline)
+    except Overloaded as e:
+        return overloaded_response(e)
+    increment_worker_requests(target_ip)
+    try:
+        result = None
+        if classification.kind == "insert" and params is None and write_batching_requested():
+            # None if the INSERT cannot be merged with others
+            result = write_coalescer.submit(target_ip, query)
+        if result is None and is_read and wait_token is None and hedging_requested():
+            result = execute_hedged(target_ip, query, params, deadline, strategy)
+        elif result is None:
+            result = execute_query(target_ip, query, params, wait_token,
+                                   failover_strategy=strategy if is_read else None, deadline=deadline,
+                                   issue_token=not is_read and tokens_requested())
+    finally:
+        decrement_worker_requests(target_ip)
+        release_admission(target_ip, admitted_at)
+
+    if result is None:
+        # The replica did not catch up with the client's last write in time
+        logging.info(f"Replica {target_ip} behind consistency token, falling back to manager")
+        target_ip = manager_ip
+        try:
+            admitted_at = admit(target_ip, deadline)
+        except Overloaded as e:
+            return overloaded_response(e)
+        increment_worker_requests(target_ip)
+        try:
+            result = execute_query(target_ip, query, params, deadline=deadline)
+        finally:
+            decrement_worker_requests(target_ip)
+            release_admission(target_ip, admitted_at)
+
+    if isinstance(result, dict) and "error" in result and deadline_passed(deadline):
+        if not is_read:
+            # The write may have committed before it was cancelled
+            invalidate_written_tables(tables)
+        return deadline_response()
+
+    if not is_read:
+        invalidate_written_tables(tables)
+        if (tokens_requested() and isinstance(result, dict) and "error" not in result
+                and "consistency_token" not in result):
+            # A group-committed write ran on the coalescer's connection: read the manager's position
+            result["consistency_token"] = consistency_tracker.current_token(pools[target_ip])
+    elif use_cache and not (isinstance(result, dict) and "error" in result):
+        group = backend_group(target_ip)
+        # A failover or a hedge may have been answered by another worker of the group
+        write_window = max(map(replica_write_window, group.worker_ips)) if target_ip in group.worker_ips else None
+        result_cache.put(key, tables, result, versions, write_window)
+    return result_response(result)
+
+
+def execute_hedged(target_ip, query, params, deadline, strategy):
+    """
+    Runs a read and, if it has not answered after the hedge delay of its backend, sends it
+    to a second healthy worker of the same group too (a fresh one under lag_aware). The
+    first successful answer wins and the other execution is cancelled with KILL QUERY.
+    Hedges are capped by the hedging budget and only go to a worker with a free admission
+    slot; reads routed to a manager are not hedged.
+
+    Returns:
+        The query result, as execute_query().
+    """
+    hedging.note_read()
+    group = backend_group(target_ip)
+    delay = hedging.delay(target_ip)
+    if delay is None or target_ip not in group.worker_ips:
+        # No hedge can be sent: run the read on this thread
+        return execute_query(target_ip, query, params, failover_strategy=strategy, deadline=deadline)
+    primary = HedgeAttempt()
+    primary_future = hedge_executor.submit(execute_query, target_ip, query, params, failover_strategy=strategy,
+                                           deadline=deadline, attempt=primary)
+    if deadline is not None:
+        delay = min(delay, max(0.0, deadline - time.monotonic()))
+    try:
+        return primary_future.result(timeout=delay)
+    except FutureTimeout:
+        pass
+
+    candidates = [ip for ip in breakers.available(group.worker_ips) if ip != target_ip]
+    if strategy == "lag_aware":
+        fresh_workers = replication_monitor.fresh_replicas(MAX_REPLICA_LAG)
+        candidates = [ip for ip in candidates if ip in fresh_workers]
+    if not candidates or not hedging.try_hedge():
+        return primary_future.result()
+    hedge_ip = get_least_busy_worker(candidates)
+    try:
+        # No waiting: a hedge is only worth sending to a backend with spare capacity
+        admitted_at = admit(hedge_ip, time.monotonic())
+    except Overloaded:
+        hedging.refund()
+        return primary_future.result()
+    logging.info(f"Hedging read from {target_ip} to {hedge_ip} after {delay * 1000:.1f}ms")
+
+    secondary = HedgeAttempt()
+
+    def run_hedge():
+        increment_worker_requests(hedge_ip)
+        try:
+            return execute_query(hedge_ip, query, params, deadline=deadline, attempt=secondary)
+        finally:
+            decrement_worker_requests(hedge_ip)
+            release_admission(hedge_ip, admitted_at)
+
+    hedge_future = hedge_executor.submit(run_hedge)
+    attempts = {primary_future: primary, hedge_future: secondary}
+    pending = set(attempts)
+    result = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        # The primary's answer is preferred when both finished together
+        for future in sorted(done, key=lambda future: future is not primary_future):
+            result = future.result()
+            if not (isinstance(result, dict) and "error" in result):
+                for loser in pending:
+                    hedge_executor.submit(attempts[loser].cancel, watchdog)
+                if future is hedge_future:
+                    hedging.record_win()
+                return result
+    # Both failed
+    return primary_future.result()
+
+
+def execute_shard_query(target_ip, query, params, failover_strategy, deadline):
+    """
+    Runs the part of a sharded statement that falls to one backend, with admission control.
+
+    Raises:
+        Overloaded: If the backend is over capacity.
+    """
+    admitted_at = admit(target_ip, deadline)
+    increment_worker_requests(target_ip)
+    try:
+        return execute_query(target_ip, query, params, failover_strategy=failover_strategy, deadline=deadline)
+    finally:
+        decrement_worker_requests(target_ip)
+        release_admission(target_ip, admitted_at)
+
+
+def forward_sharded_query(strategy, query, params, plan):
+    """
+    Runs a statement on the shard groups of its plan in parallel and builds the response.
+    The rows of a read spanning several groups are merged (see sharding.merge_rowsets);
+    a write succeeds if it succeeded on every group it ran on. Reads sent with a consistency
+    token run on the group managers. These statements bypass the result cache.
+
+    Args:
+        strategy (str): Routing strategy of the reads within each group.
+        query (str): The statement.
+        params (list): Its parameters, or None.
+        plan (ShardPlan): The groups it runs on.
+    """
+    classification = classify(query)
+    is_read = classification.is_read
+    tables = classification.tables
+    if is_read and not request.args.get("consistency_token"):
+        targets = [select_read_target(strategy, shard_group(index)) for index in plan.groups]
+    else:
+        targets = [shard_group(index).manager_ip for index in plan.groups]
+
+    stream_format = request.args.get("stream")
+    if stream_format and is_read:
+        if stream_format not in STREAM_FORMATS:
+            return jsonify({"error": "Invalid stream format"}), 400
+        if len(targets) > 1:
+            return jsonify({"error": "Reads spanning several shards cannot be streamed"}), 400
+        return stream_query(targets[0], query, stream_format, params)
+
+    logging.info(f"Routing query to shard groups {plan.groups} ({targets}): {query}")
+
+    deadline = request_deadline()
+    if deadline_passed(deadline):
+        return deadline_response()
+    futures = [batch_executor.submit(execute_shard_query, target_ip, query, params,
+                                     strategy if is_read else None, deadline)
+               for target_ip in targets]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Overloaded as e:
+            if is_read:
+                # Every future still runs to completion on the executor
+                return overloaded_response(e)
+            logging.warning(str(e))
+            results.append({"error": str(e)})
+
+    errors = {index: result["error"] for index, result in zip(plan.groups, results)
+              if isinstance(result, dict) and "error" in result}
+    if not is_read:
+        # Some groups may have applied the write even if others failed
+        invalidate_written_tables(tables)
+    if errors and deadline_passed(deadline):
+        return deadline_response()
+    if errors:
+        failed = ", ".join(f"group {index}: {error}" for index, error in errors.items())
+        return result_response({"error": f"Failed on shard {failed}"})
+    if not is_read:
+        return result_response({"status": "success"})
+    try:
+        columns, rows = merge_rowsets(results, plan)
+    except ShardingError as e:
+        return result_response({"error": str(e)})
+    return result_response(RowSet(columns, rows))
+
+
+def execute_batch_group(target_ip, statements, transaction, deadline=None):
+    """
+    Runs the statements routed to one backend, in order, over a single connection.
+
+    Args:
+        target_ip (str): The backend.
+        statements (list): (position in the batch, query, params or None) triples.
+        transaction (bool): Run the writes in one transaction committed at the end;
+                            any failure rolls back the whole group.
+        deadline (float): time.monotonic() value after which statements are cancelled (None for no limit).
+
+    Returns:
+        list: (position in the batch, result) pairs.
+    """
+    try:
+        admitted_at = admit(target_ip, deadline)
+    except Overloaded as e:
+        logging.warning(str(e))
+        return [(position, {"error": str(e)}) for position, _, _ in statements]
+    results = []
+    increment_worker_requests(target_ip)
+    try:
+        with PooledConnection(pools[target_ip]) as connection:
+            with connection.cursor() as cursor:
+                for position, query, params in statements:
+                    classification = classify(query)
+                    start = time.perf_counter()
+                    try:
+                        run_statement(connection, cursor, query, params, target_ip, deadline)
+                        if classification.kind in READ_KINDS:
+                            result = cursor.fetchall()
+                        else:
+                            result = {"status": "success"}
+                        if not classification.is_read and not transaction:
+                            connection.commit()
+                        record_query_digest(query, target_ip, (time.perf_counter() - start) * 1000,
+                                            len(result) if isinstance(result, (list, tuple)) else 0)
+                    except Exception as e:
+                        logging.error(f"Error executing batch query on {target_ip}: {str(e)}")
+                        backend_query_errors.inc(target_ip)
+                        record_query_digest(query, target_ip, (time.perf_counter() - start) * 1000, error=True)
+                        if transaction:
+                            connection.rollback()
+                            rolled_back = {"error": f"Transaction rolled back: {str(e)}"}
+                            return ([(done, rolled_back) for done, _ in results]
+                                    + [(position, {"error": str(e)})]
+                                    + [(pending, rolled_back) for pending, _, _ in statements[len(results) + 1:]])
+                        result = {"error": str(e)}
+                    results.append((position, result))
+                if transaction:
+                    connection.commit()
+        return results
+    except Exception as e:
+        logging.error(f"Error executing batch on {target_ip}: {str(e)}")
+        backend_query_errors.inc(target_ip)
+        if is_backend_failure(e):
+            breakers.record_failure(target_ip)
+        done = {position for position, _ in results}
+        if transaction:
+            # Nothing was committed
+            return [(position, {"error": str(e)}) for position, _, _ in statements]
+        return results + [(position, {"error": str(e)}) for position, _, _ in statements if position not in done]
+    finally:
+        decrement_worker_requests(target_ip)
+        release_admission(target_ip, admitted_at)
+
+
+@app.route("/batch", methods=["POST"])
+def batch_hit():
+    """
+    Batch routing: runs a list of statements in one request. Each statement is routed
+    with its own strategy, statements going to the same backend share one connection,
+    and the backend groups run in parallel. Results come back in request order.
+
+    Request format:
+    {
+        "statements": [{"query": "SQL query string", "params": [...] (optional), "strategy": "random"}, ...],
+        "transaction": true or false (optional, run each backend's statements in one transaction),
+        "read_your_writes": true or false (optional, return a consistency token covering the writes)
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    statements = data.get("statements")
+    if not statements or not isinstance(statements, list):
+        return jsonify({"error": "Statements are missing"}), 400
+    if len(statements) > BATCH_MAX_STATEMENTS:
+        return jsonify({"error": f"At most {BATCH_MAX_STATEMENTS} statements per batch"}), 400
+    transaction = bool(data.get("transaction", False))
+
+    # Group the statements by backend, keeping their order within each group
+    groups = {}
+    for position, statement in enumerate(statements):
+        query = statement.get("query") if isinstance(statement, dict) else None
+        if not query:
+            return jsonify({"error": f"Statement {position} has no query"}), 400
+        params = statement.get("params")
+        if params is not None and not valid_params(params):
+            return jsonify({"error": f"Statement {position} has invalid params"}), 400
+        group = None
+        if shard_router is not None:
+            try:
+                plan = shard_router.plan(query, params)
+            except ShardingError as e:
+                return jsonify({"error": f"Statement {position}: {str(e)}"}), 400
+            if plan is not None and len(plan.groups) > 1:
+                return jsonify({"error": f"Statement {position} spans several shards and cannot be batched"}), 400
+            if plan is not None:
+                group = shard_group(plan.groups[0])
+        target_ip = choose_target(statement.get("strategy", "direct"), query, group)
+        groups.setdefault(target_ip, []).append((position, query, params))
+
+    logging.info(f"Routing batch of {len(statements)} statements to {list(groups)}")
+
+    deadline = request_deadline()
+    futures = [batch_executor.submit(execute_batch_group, target_ip, group, transaction, deadline)
+               for target_ip, group in groups.items()]
+    results = [None] * len(statements)
+    for future in futures:
+        for position, result in future.result():
+            results[position] = result
+
+    # Drop cached reads of every table the batch wrote
+    for statement, result in zip(statements, results):
+        classification = classify(statement["query"])
+        if not classification.is_read and not (isinstance(result, dict) and "error" in result):
+            invalidate_written_tables(classification.tables)
+
+    response = {"results": results}
+    read_your_writes = data.get("read_your_writes", CONSISTENCY_ENABLED)
+    if read_your_writes and any(not classify(statement["query"]).is_read for statement in statements):
+        response["consistency_token"] = consistency_tracker.current_token()
+    return Response(dumps(response), content_type=ROWS_FORMAT)
 
 
 @app.route("/direct", methods=["POST", "GET", "PUT", "DELETE"])
@@ -113,16 +1470,9 @@ def direct_hit():
         return jsonify({"error": "Query parameter is missing"}), 400
 
     # For direct access, both reads and writes go to the manager
-    target_ip = manager_ip
-
-    logging.info(f"Routing query to {target_ip}: {query}")
+    target_ip = choose_target("direct", query)
 
-    increment_worker_requests(target_ip)
-    try:
-        result = execute_query(target_ip, query)
-    finally:
-        decrement_worker_requests(target_ip)
-    return jsonify(result)
+    return forward_query(target_ip, query, "direct")
 
 
 @app.route("/random", methods=["POST", "GET", "PUT", "DELETE"])
@@ -134,48 +1484,349 @@ def random_hit():
     if not query:
         return jsonify({"error": "Query parameter is missing"}), 400
 
-    if query.strip().lower().startswith("select"):
-        target_ip = random.choice(worker_ips)  # Random worker for reads
-    else:
-        target_ip = manager_ip  # Manager for writes
-
-    logging.info(f"Routing query to {target_ip}: {query}")
+    target_ip = choose_target("random", query)
 
-    increment_worker_requests(target_ip)
-    try:
-        result = execute_query(target_ip, query)
-    finally:
-        decrement_worker_requests(target_ip)
-    return jsonify(result)
+    return forward_query(target_ip, query, "random")
 
 
 @app.route("/customized", methods=["POST", "GET", "PUT", "DELETE"])
 def customized_hit():
     """
-    Customized routing: Reads go to the server with the shortest ping time.
+    Customized routing: Reads go to the worker with the lowest smoothed latency,
+    as measured in the background by the prober. Writes always go to the manager.
+    """
+    query = request.args.get("query")
+    if not query:
+        return jsonify({"error": "Query parameter is missing"}), 400
+
+    target_ip = choose_target("customized", query)
+
+    return forward_query(target_ip, query, "customized")
+
+
+@app.route("/lag_aware", methods=["POST", "GET", "PUT", "DELETE"])
+def lag_aware_hit():
+    """
+    Lag-aware routing: Reads go to a random worker whose replication lag is within
+    the configured bound, or to the manager when every worker is stale.
     Writes always go to the manager.
     """
     query = request.args.get("query")
     if not query:
         return jsonify({"error": "Query parameter is missing"}), 400
 
-    if query.strip().lower().startswith("select"):
-        # Measure ping for all workers and select the one with the shortest response time
-        ping_times = {ip: measure_ping(ip) for ip in worker_ips}
-        target_ip = min(ping_times, key=ping_times.get)  # Choose the worker with the shortest ping
-        logging.info(f"Ping times: {ping_times}")
-    else:
-        target_ip = manager_ip  # Manager for writes
+    target_ip = choose_target("lag_aware", query)
 
-    logging.info(f"Routing query to {target_ip}: {query}")
+    return forward_query(target_ip, query, "lag_aware")
 
-    increment_worker_requests(target_ip)
+
+@app.route("/least_outstanding", methods=["POST", "GET", "PUT", "DELETE"])
+def least_outstanding_hit():
+    """
+    Least-outstanding-requests routing: Reads go to the worker with the fewest
+    in-flight queries. Writes always go to the manager.
+    """
+    query = request.args.get("query")
+    if not query:
+        return jsonify({"error": "Query parameter is missing"}), 400
+
+    target_ip = choose_target("least_outstanding", query)
+
+    return forward_query(target_ip, query, "least_outstanding")
+
+
+@app.route("/power_of_two", methods=["POST", "GET", "PUT", "DELETE"])
+def power_of_two_hit():
+    """
+    Power-of-two-choices routing: Reads go to the better of two random workers,
+    weighted by in-flight queries and EWMA query latency. Writes always go to the manager.
+    """
+    query = request.args.get("query")
+    if not query:
+        return jsonify({"error": "Query parameter is missing"}), 400
+
+    target_ip = choose_target("power_of_two", query)
+
+    return forward_query(target_ip, query, "power_of_two")
+
+
+@app.route("/weighted", methods=["POST", "GET", "PUT", "DELETE"])
+def weighted_hit():
+    """
+    Weighted routing: Reads are spread over the workers by smooth weighted round-robin,
+    in proportion to their configured (optionally latency-adjusted) weights. Writes always go to the manager.
+    """
+    query = request.args.get("query")
+    if not query:
+        return jsonify({"error": "Query parameter is missing"}), 400
+
+    target_ip = choose_target("weighted", query)
+
+    return forward_query(target_ip, query, "weighted")
+
+
+@app.route("/hedging", methods=["GET"])
+def hedging_stats():
+    """
+    Returns the hedged read counters and the current hedge delay of every backend.
+    """
+    return jsonify(hedging.stats())
+
+
+@app.route("/weights", methods=["GET"])
+def weight_stats():
+    """
+    Returns the static and effective weight of every worker.
+    """
+    return jsonify(weighted_balancer.snapshot())
+
+
+@app.route("/load", methods=["GET"])
+def load_stats():
+    """
+    Returns the in-flight queries and EWMA query latency of every backend, across all
+    the proxy's worker processes.
+    """
+    return jsonify({
+        ip: {"in_flight": backend_state.in_flight(ip),
+             "latency_ewma_ms": backend_state.latency(ip)}
+        for ip in all_backends()
+    })
+
+
+@app.route("/topology", methods=["GET", "POST"])
+def topology():
+    """
+    Returns the current backends, or replaces them (POST) in every worker process.
+
+    Request format (POST):
+    {
+        "manager_ip": "manager address",
+        "worker_ips": ["replica address", ...]
+    }
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        new_manager = data.get("manager_ip", manager_ip)
+        new_workers = data.get("worker_ips")
+        if not isinstance(new_manager, str) or not new_manager:
+            return jsonify({"error": "Invalid manager_ip"}), 400
+        if not isinstance(new_workers, list) or not all(isinstance(ip, str) and ip for ip in new_workers):
+            return jsonify({"error": "Invalid worker_ips"}), 400
+        try:
+            changes = apply_topology(new_manager, new_workers)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 409
+        # The other worker processes follow it (see sync_topology)
+        shared_topology.publish({"manager_ip": manager_ip, "worker_ips": worker_ips, "published_at": time.time()})
+        return jsonify({"manager_ip": manager_ip, "worker_ips": worker_ips, **changes})
+    return jsonify({"manager_ip": manager_ip, "worker_ips": worker_ips})
+
+
+@app.route("/admission", methods=["GET"])
+def admission_stats():
+    """
+    Returns the admission control counters and queue depth of every backend.
+    """
+    return jsonify(admission.stats())
+
+
+@app.route("/health", methods=["GET"])
+def health_stats():
+    """
+    Returns the circuit breaker state of every backend.
+    """
+    return jsonify(breakers.snapshot())
+
+
+@app.route("/replication", methods=["GET"])
+def replication_stats():
+    """
+    Returns the replication status tracked for every worker.
+    """
+    return jsonify(replication_monitor.snapshot())
+
+
+@app.route("/digest", methods=["GET", "DELETE"])
+def digest():
+    """
+    GET returns the query fingerprints that cost the most, ?order_by= one of total_time
+    (default), count, avg, p95, p99, max, rows or errors, and ?limit= (default 20).
+    DELETE clears the statistics.
+    """
+    if request.method == "DELETE":
+        query_digest.reset()
+        return jsonify({"status": "success"})
+    order_by = request.args.get("order_by", "total_time")
+    if order_by not in ORDERINGS:
+        return jsonify({"error": f"order_by must be one of {', '.join(ORDERINGS)}"}), 400
+    limit = bounded_int_arg("limit", 20, query_digest.max_entries)
+    return jsonify(query_digest.snapshot(limit, order_by))
+
+
+@app.route("/digest/dump", methods=["POST"])
+def dump_digest():
+    """
+    Writes every query fingerprint to the configured dump file.
+    """
+    path = digest_dump_path()
+    try:
+        fingerprints = query_digest.dump(path)
+    except OSError as e:
+        return jsonify({"error": f"Failed to dump the query digest: {str(e)}"}), 500
+    return jsonify({"path": os.path.abspath(path), "fingerprints": fingerprints})
+
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """
+    Returns the result cache counters.
+    """
+    return jsonify(result_cache.stats())
+
+
+@app.route("/write_batching", methods=["GET"])
+def write_batching_stats():
+    """
+    Returns the write batching counters.
+    """
+    return jsonify(write_coalescer.stats())
+
+
+@app.route("/prepared_stats", methods=["GET"])
+def prepared_statement_stats():
+    """
+    Returns the prepared statement cache counters and the pools running the statements.
+    """
+    stats = prepared_stats()
+    stats["pools"] = {ip: pool.stats() for ip, pool in list(prepared_pools.items())}
+    return jsonify(stats)
+
+
+@app.route("/pool_stats", methods=["GET"])
+def pool_stats():
+    """
+    Returns the connection pool counters of every backend.
+    """
+    return jsonify({ip: pool.stats() for ip, pool in list(pools.items())})
+
+
+@app.route("/mysql_frontend", methods=["GET"])
+def mysql_frontend_stats():
+    """
+    Returns the MySQL front end counters and the pools of its sessions.
+    """
+    stats = mysql_frontend.stats()
+    stats["pools"] = {ip: pool.stats() for ip, pool in list(frontend_pools.items())}
+    return jsonify(stats)
+
+
+@app.route("/latency", methods=["GET"])
+def latency_stats():
+    """
+    Returns the latency table maintained by the background prober.
+    """
+    return jsonify(prober.snapshot())
+
+
+def frontend_route(query, read, consistency_token=None):
+    """
+    Routes a statement received by the MySQL front end, like choose_target() for HTTP requests.
+
+    Args:
+        query (str): The statement ("" for session-level commands).
+        read (bool): True if it may run on a replica.
+        consistency_token (str): Token of the session's last write, or None.
+
+    Returns:
+        tuple: (target IP, token to wait for on it or None, manager of the statement's shard group)
+
+    Raises:
+        ShardingError: If the statement spans several shard groups.
+    """
+    group = shard_group(0)
+    if shard_router is not None and query:
+        plan = shard_router.plan(query, None)
+        if plan is not None and len(plan.groups) > 1:
+            raise ShardingError("Statements spanning several shard groups are not supported by the MySQL front end")
+        if plan is not None:
+            group = shard_group(plan.groups[0])
+    if not read:
+        return group.manager_ip, None, group.manager_ip
+    target_ip = select_read_target(MYSQL_FRONTEND_STRATEGY, group)
+    wait_token = None
+    if consistency_token and target_ip in group.worker_ips:
+        target_ip, wait_token = consistent_read_target(target_ip, consistency_token)
+    return target_ip, wait_token, group.manager_ip
+
+
+@contextmanager
+def frontend_query(ip, query):
+    """
+    Tracks a command relayed by the MySQL front end like execute_query() does: admission,
+    in-flight count, and for statements the latency, digest and circuit breaker.
+
+    Yields:
+        dict: To fill with the "rows" the statement returned and its "error" message, if any.
+
+    Raises:
+        Overloaded: If the backend is over capacity.
+    """
+    admitted_at = admit(ip)
+    increment_worker_requests(ip)
+    outcome = {"rows": 0, "error": None}
+    start = time.perf_counter()
     try:
-        result = execute_query(target_ip, query)
+        yield outcome
+    except Exception as e:
+        logging.error(f"Error relaying query to {ip}: {str(e)}")
+        backend_query_errors.inc(ip)
+        if query is not None:
+            record_query_digest(query, ip, (time.perf_counter() - start) * 1000, error=True)
+        if is_backend_failure(e):
+            breakers.record_failure(ip)
+        raise
     finally:
-        decrement_worker_requests(target_ip)
-    return jsonify(result)
+        decrement_worker_requests(ip)
+        release_admission(ip, admitted_at)
+    if query is None:
+        return
+    latency_ms = (time.perf_counter() - start) * 1000
+    record_query_digest(query, ip, latency_ms, outcome["rows"], outcome["error"] is not None)
+    if outcome["error"] is None:
+        record_query_latency(ip, latency_ms)
+        breakers.record_success(ip)
+    else:
+        backend_query_errors.inc(ip)
+
+
+def frontend_token(ip):
+    """
+    Returns the consistency token covering the writes a MySQL front end session committed on a backend.
+    """
+    return consistency_tracker.current_token(pools[ip]) if ip in pools else None
+
+
+def frontend_wait_for(connection, token):
+    with connection.cursor() as cursor:
+        return consistency_tracker.wait_for(cursor, token)
+
+
+mysql_frontend = MySQLFrontend(
+    pool=frontend_pool,
+    route=frontend_route,
+    track=frontend_query,
+    users=mysql_frontend_config.get("users", {db_user: db_password}),  # user name -> password of the clients
+    issue_token=frontend_token if MYSQL_FRONTEND_READ_YOUR_WRITES else None,
+    wait_for=frontend_wait_for,
+    port=mysql_frontend_config.get("port", 3306),
+    max_clients=mysql_frontend_config.get("max_clients", 512),  # connections served at once per worker process
+    idle_timeout=mysql_frontend_config.get("idle_timeout", 28800)  # seconds, like MySQL's wait_timeout
+)
+if MYSQL_FRONTEND_ENABLED:
+    mysql_frontend.start()
 
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host="0.0.0.0", port=8000, threaded=True)
@@ -0,0 +1,273 @@
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+
+from sql_classifier import classify, mask_literals, tokenize, Token, CLAUSE_KEYWORDS, WORD, IDENT, STRING, NUMBER, PUNCT, VARIABLE
+
+
+# Latency histogram bounds of every fingerprint in milliseconds: 0.05ms to ~2 minutes,
+# 20% apart, so percentiles are exact to within one bucket in constant memory
+LATENCY_BOUNDS = tuple(0.05 * 1.2 ** i for i in range(81))
+
+# Example query text kept per fingerprint
+EXAMPLE_MAX_CHARS = 1000
+
+ORDERINGS = ("total_time", "count", "avg", "p95", "p99", "max", "rows", "errors")
+
+# Words followed by a parenthesized list or subquery rather than called like functions
+SPACED_WORDS = CLAUSE_KEYWORDS | {"IN", "AND", "OR", "NOT", "EXISTS", "AS", "FROM", "ANY", "ALL", "SOME"}
+
+
+def _render(tokens):
+    text = []
+    previous = before = None
+    for token in tokens:
+        value = f"`{token.value}`" if token.kind == IDENT else token.value
+        if previous is not None:
+            glued = (token.kind == PUNCT and token.value in (",", ")", ".", ";")) or previous in (
+                Token(PUNCT, "("), Token(PUNCT, "."))
+            # Function calls: NOW(), but not INSERT INTO t (columns)
+            glued = glued or (token == Token(PUNCT, "(") and previous.kind == WORD and previous.value not in SPACED_WORDS
+                              and before not in (Token(WORD, "INTO"), Token(WORD, "TABLE")))
+            if not glued:
+                text.append(" ")
+        text.append(value)
+        previous, before = token, previous
+    return "".join(text)
+
+
+def fingerprint(query):
+    """
+    Normalizes a statement to its shape: literals and placeholders become ?, lists of them
+    (IN (...), VALUES rows) collapse to one, keywords are upper-cased and comments dropped.
+    SELECT * FROM t WHERE id = 1 and select * from t where id=2 share a fingerprint.
+
+    Results are memoized on the statement with its literals already replaced by ?, so
+    queries differing only in their values share one cache entry instead of each
+    evicting the fingerprints of the workload's other shapes.
+
+    Returns:
+        str: The fingerprint text.
+    """
+    return _fingerprint_shape(mask_literals(query))
+
+
+@lru_cache(maxsize=4096)
+def _fingerprint_shape(query):
+    tokens = []
+    for token in tokenize(query):
+        if token.kind in (STRING, NUMBER) or (token.kind == VARIABLE and not token.value.startswith("@")):
+            # A negative literal is one value
+            if tokens and tokens[-1] == Token(PUNCT, "-") and (
+                    len(tokens) < 2 or (tokens[-2].kind == PUNCT and tokens[-2].value != ")")):
+                tokens.pop()
+            token = Token(VARIABLE, "?")
+        elif token.kind == WORD and token.value in ("NULL", "TRUE", "FALSE"):
+            token = Token(VARIABLE, "?")
+        tokens.append(token)
+        # (?, ?, ?) -> (?)
+        if (token == Token(PUNCT, ")") and len(tokens) >= 4 and tokens[-2] == Token(VARIABLE, "?")
+                and tokens[-3] == Token(PUNCT, ",")):
+            end = len(tokens) - 2
+            start = end
+            while start >= 2 and tokens[start - 1] == Token(PUNCT, ",") and tokens[start - 2] == Token(VARIABLE, "?"):
+                start -= 2
+            if tokens[start - 1] == Token(PUNCT, "("):
+                del tokens[start:end]
+    text = _render(tokens)
+    # VALUES (?), (?) -> VALUES (?)
+    while True:
+        collapsed = text.replace("(?), (?)", "(?)")
+        if collapsed == text:
+            break
+        text = collapsed
+    return text.rstrip(";").rstrip()
+
+
+def digest_id(text):
+    """
+    Returns a short stable id of a fingerprint, to refer to it in dumps and logs.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class DigestEntry:
+    __slots__ = ("fingerprint", "digest", "kind", "example", "count", "errors", "total_ms", "max_ms",
+                 "rows", "backends", "buckets", "first_seen", "last_seen", "overestimate")
+
+    def __init__(self, text, query, now, overestimate=0):
+        self.fingerprint = text
+        self.digest = digest_id(text)
+        self.kind = classify(query).kind
+        # Literals may carry user data (emails, tokens), so the example keeps only the shape
+        self.example = mask_literals(query)[:EXAMPLE_MAX_CHARS]
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.backends = {}
+        self.buckets = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.first_seen = now
+        self.last_seen = now
+        # Executions an evicted fingerprint may have had before this one took its place
+        self.overestimate = overestimate
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                # Upper bound of the bucket, capped at the slowest execution seen
+                bound = LATENCY_BOUNDS[index] if index < len(LATENCY_BOUNDS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        measured = self.count
+        return {
+            "digest": self.digest,
+            "fingerprint": self.fingerprint,
+            "kind": self.kind,
+            "example": self.example,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / measured, 3) if measured else None,
+            "p95_ms": round(self.percentile(95), 3) if measured else None,
+            "p99_ms": round(self.percentile(99), 3) if measured else None,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "avg_rows": round(self.rows / measured, 3) if measured else None,
+            "backends": dict(self.backends),
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "count_error_bound": self.overestimate,
+        }
+
+
+class QueryDigest:
+    """
+    Aggregates executions per query fingerprint: count, errors, latency (total, average,
+    p95, p99, max), rows returned and the backends that ran them.
+
+    Memory is bounded by max_entries fingerprints kept with the Space-Saving algorithm: a new
+    fingerprint arriving when the table is full replaces the least executed one and inherits
+    its count as an error bound, so the most frequent shapes are always kept.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.evictions = 0
+        self.started = time.time()
+
+    def record(self, query, latency_ms, rows=0, backend=None, error=False):
+        """
+        Records one execution of a statement.
+
+        Args:
+            query (str): The statement (or prepared template) as sent.
+            latency_ms (float): Time to execute it, in milliseconds.
+            rows (int): Rows it returned.
+            backend (str): Backend that ran it.
+            error (bool): True if it failed.
+        """
+        text = fingerprint(query)
+        index = bisect.bisect_left(LATENCY_BOUNDS, latency_ms)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry is None:
+                entry = self._admit(text, query, now)
+            entry.count += 1
+            entry.total_ms += latency_ms
+            if latency_ms > entry.max_ms:
+                entry.max_ms = latency_ms
+            entry.buckets[index] += 1
+            entry.rows += rows
+            if error:
+                entry.errors += 1
+            if backend is not None:
+                entry.backends[backend] = entry.backends.get(backend, 0) + 1
+            entry.last_seen = now
+
+    def _admit(self, text, query, now):
+        # Must be called with the lock held
+        overestimate = 0
+        if len(self._entries) >= self.max_entries:
+            victim = min(self._entries.values(), key=lambda entry: entry.count + entry.overestimate)
+            del self._entries[victim.fingerprint]
+            overestimate = victim.count + victim.overestimate
+            self.evictions += 1
+        entry = self._entries[text] = DigestEntry(text, query, now, overestimate)
+        return entry
+
+    def top(self, limit=20, order_by="total_time"):
+        """
+        Returns the fingerprints with the largest order_by value (one of ORDERINGS).
+        """
+        keys = {
+            "total_time": lambda entry: entry.total_ms,
+            "count": lambda entry: entry.count,
+            "avg": lambda entry: entry.total_ms / entry.count if entry.count else 0.0,
+            "p95": lambda entry: entry.percentile(95) or 0.0,
+            "p99": lambda entry: entry.percentile(99) or 0.0,
+            "max": lambda entry: entry.max_ms,
+            "rows": lambda entry: entry.rows,
+            "errors": lambda entry: entry.errors,
+        }
+        with self._lock:
+            entries = sorted(self._entries.values(), key=keys[order_by], reverse=True)[:limit]
+            return [entry.to_dict() for entry in entries]
+
+    def snapshot(self, limit=20, order_by="total_time"):
+        """
+        Returns the top fingerprints with the digest's own counters.
+        """
+        top = self.top(limit, order_by)
+        with self._lock:
+            return {
+                "since": self.started,
+                "fingerprints": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "order_by": order_by,
+                "top": top,
+            }
+
+    def dump(self, path):
+        """
+        Writes every fingerprint to a JSON file, ordered by total time. The file is replaced
+        atomically, so a reader never sees half a dump.
+
+        Returns:
+            int: The number of fingerprints written.
+        """
+        data = self.snapshot(limit=self.max_entries)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as dump_file:
+            json.dump(data, dump_file, indent=2)
+        os.replace(temporary, path)
+        return len(data["top"])
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+            self.evictions = 0
+            self.started = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {"fingerprints": len(self._entries), "evictions": self.evictions}
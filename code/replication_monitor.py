@@ -0,0 +1,172 @@
+import threading
+import time
+import logging
+
+import pymysql
+
+from connection_pool import PooledConnection
+
+
+class ReplicationMonitor:
+    """
+    Polls SHOW SLAVE STATUS on every worker (and SHOW MASTER STATUS on the manager)
+    from a background thread, so read routing can skip replicas that fell behind.
+    """
+
+    def __init__(self, manager, replicas, pools, interval=1.0, stale_after=5.0):
+        self.manager = manager
+        self.replicas = list(replicas)
+        self.pools = pools
+        self.interval = interval
+        self.stale_after = stale_after
+
+        self._lock = threading.Lock()
+        self._status = {}
+        self._master = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _fetch_one(self, ip, query):
+        with PooledConnection(self.pools[ip]) as connection:
+            with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+                cursor.execute(query)
+                return cursor.fetchone()
+
+    def poll_master(self):
+        """
+        Reads the manager's current binary log coordinates.
+        """
+        try:
+            row = self._fetch_one(self.manager, "SHOW MASTER STATUS")
+        except Exception as e:
+            logging.warning(f"Failed to read master status from {self.manager}: {str(e)}")
+            return
+        if row:
+            with self._lock:
+                self._master = {"file": row["File"], "position": row["Position"],
+                                "checked_at": time.monotonic()}
+
+    def poll_replica(self, ip):
+        """
+        Reads the replication status of one worker.
+        """
+        try:
+            row = self._fetch_one(ip, "SHOW SLAVE STATUS")
+        except Exception as e:
+            logging.warning(f"Failed to read replication status from {ip}: {str(e)}")
+            with self._lock:
+                self._status.pop(ip, None)
+            return
+        if not row:
+            # Not configured as a replica
+            with self._lock:
+                self._status.pop(ip, None)
+            return
+        running = row.get("Slave_IO_Running") == "Yes" and row.get("Slave_SQL_Running") == "Yes"
+        with self._lock:
+            self._status[ip] = {
+                "seconds_behind": row.get("Seconds_Behind_Master"),
+                "running": running,
+                "master_log_file": row.get("Relay_Master_Log_File"),
+                "exec_position": row.get("Exec_Master_Log_Pos"),
+                "read_position": row.get("Read_Master_Log_Pos"),
+                "relay_log_file": row.get("Relay_Log_File"),
+                "relay_log_position": row.get("Relay_Log_Pos"),
+                "checked_at": time.monotonic(),
+            }
+
+    def poll_all(self):
+        self.poll_master()
+        for ip in list(self.replicas):
+            self.poll_replica(ip)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.poll_all()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        """
+        Starts the background polling thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def set_topology(self, manager, replicas):
+        """
+        Replaces the monitored manager and replicas.
+        """
+        with self._lock:
+            self.manager = manager
+            self.replicas = list(replicas)
+            for ip in list(self._status):
+                if ip not in self.replicas:
+                    del self._status[ip]
+
+    def _bytes_behind(self, status):
+        # Only comparable while the replica executes the manager's current binlog file
+        master = self._master
+        if master is None or status["master_log_file"] != master["file"]:
+            return None
+        return max(0, master["position"] - status["exec_position"])
+
+    def lag(self, ip):
+        """
+        Returns the replication lag of a worker in seconds, or None if it is unknown,
+        stale or replication is not running.
+        """
+        with self._lock:
+            status = self._status.get(ip)
+            if (status is None or not status["running"]
+                    or time.monotonic() - status["checked_at"] > self.stale_after):
+                return None
+            return status["seconds_behind"]
+
+    def replica_status(self, ip):
+        """
+        Returns a copy of the last polled status of a worker, or None if unknown.
+        """
+        with self._lock:
+            status = self._status.get(ip)
+            return dict(status) if status is not None else None
+
+    def fresh_replicas(self, max_lag):
+        """
+        Returns the workers whose lag is known and at most max_lag seconds.
+        """
+        fresh = []
+        for ip in list(self.replicas):
+            lag = self.lag(ip)
+            if lag is not None and lag <= max_lag:
+                fresh.append(ip)
+        return fresh
+
+    def snapshot(self):
+        """
+        Returns the last replication status of every worker.
+        """
+        now = time.monotonic()
+        with self._lock:
+            replicas = {
+                ip: {
+                    "seconds_behind": status["seconds_behind"],
+                    "running": status["running"],
+                    "master_log_file": status["master_log_file"],
+                    "exec_position": status["exec_position"],
+                    "read_position": status["read_position"],
+                    "relay_log_file": status["relay_log_file"],
+                    "relay_log_position": status["relay_log_position"],
+                    "bytes_behind": self._bytes_behind(status),
+                    "age_s": round(now - status["checked_at"], 3),
+                }
+                for ip, status in self._status.items()
+            }
+            master = None
+            if self._master is not None:
+                master = {"file": self._master["file"], "position": self._master["position"]}
+        return {"manager": master, "replicas": replicas}
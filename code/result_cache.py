@@ -0,0 +1,198 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from shared_state import TableVersions
+from sql_classifier import TOKEN_PATTERN
+
+
+# Reads calling these functions return a different result every time and are never cached
+NON_DETERMINISTIC_PATTERN = re.compile(
+    r"\b(?:now|rand|uuid|sysdate|curdate|curtime|current_timestamp|unix_timestamp|last_insert_id|connection_id)\s*\(",
+    re.IGNORECASE)
+
+
+def normalize_query(query):
+    """
+    Normalizes query text for use as a cache key: the whitespace between tokens becomes one
+    space and trailing semicolons are dropped. String literals, quoted identifiers and
+    comments are kept verbatim, so statements differing inside a literal never share a key.
+    """
+    tokens = [match.group() for match in TOKEN_PATTERN.finditer(query) if match.lastgroup != "ws"]
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    key = []
+    for token in tokens:
+        key.append(token)
+        # A line comment ends at the line break, not at the next token
+        key.append("\n" if token.startswith(("--", "#")) else " ")
+    return "".join(key).rstrip()
+
+
+def estimate_size(result):
+    """
+    Estimates the memory cost of a cached result in bytes from its serialized length.
+    """
+    return len(json.dumps(result, default=str))
+
+
+class ResultCache:
+    """
+    In-process LRU cache of read results with a TTL and a memory cap in bytes.
+
+    Entries remember the tables their query read, and invalidate_tables() drops every
+    entry touching a table that was just written. The write versions of the tables live in
+    a TableVersions, shared by every worker process under gunicorn (see shared_state): an
+    entry keeps the versions its read started with and is dropped on lookup once one of its
+    tables was written, by any process. The same versions keep a read that started before a
+    write from storing its (now stale) result afterwards, and the time of each table's last
+    write keeps a replica read that may not see it yet (started within the replica's lag of
+    the write) out of the cache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=30.0, max_entry_bytes=1024 * 1024, table_versions=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+
+        self._lock = threading.Lock()
+        # key -> (result, tables, size, expires_at, (generation, table versions) when the read started)
+        self._entries = OrderedDict()
+        # table -> keys of the entries that read it
+        self._by_table = {}
+        # Private to this process unless shared ones are given
+        self._tables = table_versions if table_versions is not None else TableVersions()
+        self._bytes = 0
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def is_cacheable(query):
+        return not NON_DETERMINISTIC_PATTERN.search(query)
+
+    def _remove(self, key):
+        result, tables, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def get(self, key):
+        """
+        Returns the cached result of a normalized query, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[3] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if self._tables.current(entry[1]) != entry[4]:
+                # One of its tables was written by another process
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def versions(self, tables):
+        """
+        Returns the current version of the cache and of each table, with the time the read
+        starts, to be passed back to put().
+        """
+        generation, table_versions = self._tables.current(tables)
+        return generation, table_versions, time.monotonic()
+
+    def put(self, key, tables, result, versions=None, write_window=None):
+        """
+        Stores a read result.
+
+        Args:
+            key (str): The normalized query.
+            tables (set): Tables the query reads.
+            result: The query result.
+            versions (tuple): Versions returned by versions() before the query ran.
+                              The result is dropped if any of these tables was written since.
+            write_window (float): For a read served by a replica, its replication lag in seconds:
+                                  the result is dropped if one of the tables was written less
+                                  than this long before the read started.
+        """
+        size = estimate_size(result)
+        if size > self.max_entry_bytes or size > self.max_bytes:
+            return
+        tables = frozenset(tables)
+        with self._lock:
+            current = self._tables.current(tables)
+            if versions is not None:
+                generation, table_versions, started_at = versions
+                if current != (generation, table_versions):
+                    return
+                if write_window is not None and self._tables.written_within(tables, started_at - write_window):
+                    return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, tables, size, time.monotonic() + self.ttl, current)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            # Evict least recently used entries until we fit under the memory cap
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_tables(self, tables):
+        """
+        Records a write of the given tables: the entries that read one of them are dropped
+        here at once, and in the other processes on their next lookup.
+        """
+        with self._lock:
+            self._tables.bump(tables)
+            for table in tables:
+                for key in list(self._by_table.get(table, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """
+        Drops every cached entry.
+        """
+        with self._lock:
+            self._tables.clear()
+            self._entries.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Returns the cache counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,80 @@
+import base64
+import datetime
+import decimal
+import json
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library encoder
+    orjson = None
+
+
+# Rows of a read together with the column names from cursor.description
+RowSet = namedtuple("RowSet", ["columns", "rows"])
+
+# Response formats, negotiated through the Accept header
+ROWS_FORMAT = "application/json"  # [[value, ...], ...], the original response shape
+TABLE_FORMAT = "application/vnd.proxy.table+json"  # {"columns": [...], "rows": [[value, ...], ...]}
+COLUMNAR_FORMAT = "application/vnd.proxy.columnar+json"  # {"columns": [...], "data": [[column values], ...]}
+RESULT_FORMATS = [ROWS_FORMAT, TABLE_FORMAT, COLUMNAR_FORMAT]
+
+
+def encode_value(value):
+    """
+    Encodes the MySQL values JSON has no type for.
+    DATETIME/DATE as ISO 8601, DECIMAL as a string (no float rounding), TIME as H:MM:SS,
+    and binary columns as UTF-8 text, or base64 when they are not valid UTF-8.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode("ascii")
+    if isinstance(value, set):
+        # SET columns with a converter that returns Python sets
+        return ",".join(sorted(value))
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(data):
+    """
+    Serializes to compact JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=encode_value)
+    return json.dumps(data, default=encode_value, separators=(",", ":")).encode("utf-8")
+
+
+def negotiate_format(accept):
+    """
+    Picks the response format from the Accept header (a werkzeug MIMEAccept).
+    Clients that send no Accept header, or only */*, get the original row arrays.
+    """
+    return accept.best_match(RESULT_FORMATS, default=ROWS_FORMAT)
+
+
+def render(result, result_format=ROWS_FORMAT):
+    """
+    Serializes a query result in the requested format.
+
+    Args:
+        result: A RowSet for reads, or a dict (write status or error).
+        result_format (str): One of RESULT_FORMATS.
+
+    Returns:
+        tuple: (body bytes, content type). Dicts are plain JSON whatever the format.
+    """
+    if not isinstance(result, RowSet):
+        return dumps(result), ROWS_FORMAT
+    if result_format == TABLE_FORMAT:
+        return dumps({"columns": result.columns, "rows": result.rows}), TABLE_FORMAT
+    if result_format == COLUMNAR_FORMAT:
+        # data[i] holds the values of columns[i]; positional, so duplicate column names survive
+        data = [list(values) for values in zip(*result.rows)] if result.rows else [[] for _ in result.columns]
+        return dumps({"columns": result.columns, "data": data}), COLUMNAR_FORMAT
+    return dumps(result.rows), ROWS_FORMAT
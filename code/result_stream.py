@@ -0,0 +1,118 @@
+import json
+import logging
+
+import pymysql
+
+from deadlines import set_max_execution_time
+from result_format import dumps
+
+
+# Content types of the streaming formats
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+
+def encode_row(row):
+    # Same encoding of the values as the non-streaming responses (see result_format.encode_value)
+    return dumps(row).decode("utf-8")
+
+
+def stream_rows(pool, query, stream_format="ndjson", chunk_rows=500, max_rows=None, max_bytes=None, params=None):
+    """
+    Runs a read on an unbuffered server-side cursor and returns a generator emitting
+    the result in chunks, so memory stays bounded by one chunk whatever the size of the result.
+
+    The query runs before this returns, so connection and SQL errors raise here and can
+    still be answered with a normal error response.
+
+    The "ndjson" format yields a {"columns": [...]} line, one JSON array per row and a final
+    {"rows": n, "truncated": bool} line. The "json" format yields a single JSON array of rows,
+    like the non-streaming response.
+
+    Args:
+        pool (ConnectionPool): Pool of the backend to run the query on.
+        query (str): The read query.
+        stream_format (str): "ndjson" or "json".
+        chunk_rows (int): Rows fetched from MySQL and emitted per chunk.
+        max_rows (int): Stop after this many rows (None for no limit).
+        max_bytes (int): Stop once this many bytes were emitted (None for no limit).
+        params (list): Parameters of a %s template, bound client-side (None for a plain query).
+
+    Returns:
+        generator: Yields the pieces of the response body and returns the connection to the pool when done.
+    """
+    connection = pool.acquire()
+    try:
+        cursor = connection.cursor(pymysql.cursors.SSCursor)
+        # Streams are long by design: lift a SELECT time cap left on the connection by a deadline
+        set_max_execution_time(connection, cursor, 0)
+        cursor.execute(query, tuple(params) if params is not None else None)
+    except Exception:
+        pool.release(connection, discard=True)
+        raise
+    return _emit_rows(pool, connection, cursor, stream_format, chunk_rows, max_rows, max_bytes)
+
+
+def _emit_rows(pool, connection, cursor, stream_format, chunk_rows, max_rows, max_bytes):
+    discard = False
+    rows_sent = 0
+    bytes_sent = 0
+    truncated = False
+    try:
+        columns = [column[0] for column in cursor.description or ()]
+        if stream_format == "ndjson":
+            header = json.dumps({"columns": columns}) + "\n"
+        else:
+            header = "["
+        bytes_sent += len(header)
+        yield header
+
+        while not truncated:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            pieces = []
+            for row in rows:
+                if max_rows is not None and rows_sent >= max_rows:
+                    truncated = True
+                    break
+                encoded = encode_row(row)
+                if stream_format == "ndjson":
+                    encoded += "\n"
+                elif rows_sent:
+                    encoded = "," + encoded
+                if max_bytes is not None and bytes_sent + len(encoded) > max_bytes:
+                    truncated = True
+                    break
+                pieces.append(encoded)
+                rows_sent += 1
+                bytes_sent += len(encoded)
+            if pieces:
+                yield "".join(pieces)
+
+        if truncated:
+            # Closing an unbuffered cursor reads the rest of the result; drop the connection instead
+            discard = True
+        else:
+            cursor.close()
+
+        if stream_format == "ndjson":
+            yield json.dumps({"rows": rows_sent, "truncated": truncated}) + "\n"
+        else:
+            yield "]"
+    except GeneratorExit:
+        # Client went away mid-stream
+        discard = True
+        raise
+    except Exception as e:
+        discard = True
+        logging.error(f"Error streaming query on {pool.host}: {str(e)}")
+        if stream_format == "ndjson":
+            yield json.dumps({"error": str(e)}) + "\n"
+        else:
+            # Close the open array with the error as its last element
+            yield ("," if rows_sent else "") + json.dumps({"error": str(e)}) + "]"
+    finally:
+        pool.release(connection, discard=discard)
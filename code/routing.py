@@ -0,0 +1,101 @@
+import json
+import random
+
+from result_cache import normalize_query
+
+
+# Routing and request helpers shared by proxy.py and async_proxy.py. They take the load
+# and the request fields as arguments, so they work with either server's state and framework.
+
+
+def valid_params(params):
+    """
+    Returns True if params is a list of JSON scalars usable as statement parameters.
+    """
+    return isinstance(params, list) and all(
+        value is None or isinstance(value, (str, int, float, bool)) for value in params)
+
+
+def parse_params(text):
+    """
+    Decodes the parameters of a parameterized query, sent as a JSON list in ?params=.
+
+    Returns:
+        list: The parameters, or None if text is None.
+
+    Raises:
+        ValueError: If text is not a JSON list of scalars.
+    """
+    if text is None:
+        return None
+    try:
+        params = json.loads(text)
+    except ValueError:
+        params = None
+    if not valid_params(params):
+        raise ValueError("Invalid params")
+    return params
+
+
+def flag(value, default):
+    """
+    Reads an on/off query-string argument ("true", "1", "yes" turn it on), default if absent.
+    """
+    if value is None:
+        return default
+    return value.lower() in ("true", "1", "yes")
+
+
+def cache_bypassed(args, headers):
+    """
+    Returns True if a request asked to skip the result cache, with ?cache=false or a
+    "Cache-Control: no-cache" header.
+
+    Args:
+        args: The query-string arguments of the request.
+        headers: Its headers.
+    """
+    if args.get("cache", "true").lower() in ("false", "0", "no"):
+        return True
+    return "no-cache" in headers.get("Cache-Control", "").lower()
+
+
+def cache_key(query, params=None):
+    """
+    Returns the result cache key of a statement and its parameters.
+    """
+    key = normalize_query(query)
+    if params is not None:
+        key += " -- " + json.dumps(params)
+    return key
+
+
+def least_busy(candidates, in_flight):
+    """
+    Returns the candidate with the fewest queries in flight.
+
+    Args:
+        candidates (list): Backends to choose from.
+        in_flight (callable): in_flight(ip) returns the queries running on a backend.
+    """
+    return min(candidates, key=in_flight)
+
+
+def power_of_two(candidates, in_flight, latency):
+    """
+    Power-of-two-choices: samples two candidates at random and keeps the one with the
+    lower expected cost, (outstanding requests + 1) * EWMA query latency.
+    Backends without a latency sample yet cost nothing, so they get tried first.
+
+    Args:
+        candidates (list): Backends to choose from.
+        in_flight (callable): in_flight(ip) returns the queries running on a backend.
+        latency (callable): latency(ip) returns its smoothed query latency, or None.
+    """
+    if len(candidates) < 2:
+        return candidates[0]
+    first, second = random.sample(candidates, 2)
+
+    def cost(ip):
+        return (in_flight(ip) + 1) * (latency(ip) or 0.0)
+    return first if cost(first) <= cost(second) else second
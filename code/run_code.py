@@ -357,6 +357,32 @@ def configure_worker(ip_address, username, private_key_path, manager_ip, file, p
     ssh_exec_command(ip_address, username, private_key_path, replication_commands)
 
 
+def prune_shard(ip_address, username, private_key_path, shard_keys, group, nb_groups):
+    """
+    Deletes the rows of the sharded tables that belong to other shard groups from the manager
+    of a group; the deletes replicate to its workers. Rows are owned by group
+    MOD(CRC32(shard key), nb_groups), the same hash the proxy routes with.
+
+    Args:
+        ip_address (str): The public IP address of the group's manager.
+        username (str): The SSH username (usually 'ubuntu').
+        private_key_path (str): Path to the private key (.pem) used for SSH.
+        shard_keys (dict): Sharded table -> shard key column.
+        group (int): Index of the group.
+        nb_groups (int): Number of shard groups.
+    Returns:
+        None
+    """
+    # Rows of other groups are removed even where foreign keys point to them
+    statements = ["SET FOREIGN_KEY_CHECKS = 0;"]
+    for table, column in shard_keys.items():
+        statements.append(f"DELETE FROM {table} WHERE MOD(CRC32({column}), {nb_groups}) <> {group};")
+    commands = [
+        f"""PRIVATE_IP=$(hostname -I | awk '{{print $1}}') && mysql -u replica_user -p'1234' -h $PRIVATE_IP sakila -e "{' '.join(statements)}\""""
+    ]
+    ssh_exec_command(ip_address, username, private_key_path, commands)
+
+
 
 
 
@@ -410,7 +436,7 @@ def build_images(dockerfiles):
 
 
 
-def configure_server(ip_address, username, private_key_path, docker_image_name):
+def configure_server(ip_address, username, private_key_path, docker_image_name, ports=(8000,)):
     """
     Configures the trusted host by installing Docker and deploying the specified Docker image.
 
@@ -419,6 +445,7 @@ def configure_server(ip_address, username, private_key_path, docker_image_name):
         username (str): SSH username.
         private_key_path (str): Path to the private SSH key.
         docker_image_name (str): Name of the Docker image to deploy.
+        ports (tuple): Ports of the container published on the host.
     """
     # Installing Docker
     commands = [
@@ -447,7 +474,8 @@ def configure_server(ip_address, username, private_key_path, docker_image_name):
     ssh_exec_command(ip_address, username, private_key_path, commands)
 
     # Run the Docker container
-    commands = [f'sudo docker run -d -p 8000:8000 {docker_image_name}:latest']
+    published = " ".join(f"-p {port}:{port}" for port in ports)
+    commands = [f'sudo docker run -d {published} {docker_image_name}:latest']
     ssh_exec_command(ip_address, username, private_key_path, commands)
 
 
@@ -587,7 +615,8 @@ def configure_iptables_manager(ip_address, username, private_key_path, proxy_pri
 
 
 
-def configure_iptables_proxy(ip_address, username, private_key_path, private_worker_ips, manager_private_ip):
+def configure_iptables_proxy(ip_address, username, private_key_path, private_worker_ips, manager_private_ip,
+                             mysql_client_ips=None):
     """
     Configures iptables rules on a proxy instance.
 
@@ -597,6 +626,7 @@ def configure_iptables_proxy(ip_address, username, private_key_path, private_wor
         private_key_path (str): Path to the SSH private key.
         private_worker_ips (list): List of private IPs of worker instances.
         manager_private_ip (str): Private IP of the manager instance.
+        mysql_client_ips (list): Private IPs allowed to use the MySQL front end on port 3306.
     """
     commands = [
         # Allow SSH access
@@ -605,6 +635,10 @@ def configure_iptables_proxy(ip_address, username, private_key_path, private_wor
         # Allow application traffic on port 8000
         "sudo iptables -A INPUT -p tcp --dport 8000 -j ACCEPT",
     ]
+
+    # Allow MySQL clients on port 3306
+    for client_ip in mysql_client_ips or []:
+        commands.append(f"sudo iptables -A INPUT -p tcp --dport 3306 -s {client_ip} -j ACCEPT")
     
     # Allow outgoing traffic to Workers (Read Queries)
     for worker_ip in private_worker_ips:
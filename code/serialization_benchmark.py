@@ -0,0 +1,94 @@
+import json
+import time
+
+import pymysql
+from flask import Flask, jsonify
+
+from result_format import RowSet, render, ROWS_FORMAT, TABLE_FORMAT, COLUMNAR_FORMAT
+
+
+# Sakila tables covering narrow rows, wide rows, DECIMAL, DATETIME and text columns
+BENCHMARK_TABLES = ["actor", "address", "customer", "film", "payment", "rental"]
+
+
+def fetch_table(connection, table):
+    """
+    Reads a whole table the way the proxy does (cursor.fetchall() tuples).
+
+    Returns:
+        RowSet: The column names and rows.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM {table}")
+        return RowSet([column[0] for column in cursor.description], cursor.fetchall())
+
+
+def time_encoder(encode, repeat):
+    """
+    Runs an encoder repeat times.
+
+    Returns:
+        tuple: (best time in milliseconds, size of the encoded body in bytes)
+    """
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode()
+        best = min(best, (time.perf_counter() - start) * 1000)
+        size = len(body)
+    return best, size
+
+
+def benchmark_serialization(connection, tables=BENCHMARK_TABLES, repeat=20):
+    """
+    Compares Flask's jsonify with the result_format encoders on real sakila tables.
+
+    Args:
+        connection: A pymysql connection to a sakila database.
+        tables (list): The tables to read and encode.
+        repeat (int): Runs per encoder; the best run is reported.
+
+    Returns:
+        dict: table -> encoder -> {"ms": best time, "bytes": body size}.
+    """
+    app = Flask(__name__)
+    results = {}
+    for table in tables:
+        result = fetch_table(connection, table)
+        encoders = {
+            # The response path before result_format (HTTP dates, tuples walked by the generic encoder)
+            "jsonify": lambda: jsonify(result.rows).get_data(),
+            "json.dumps": lambda: json.dumps(result.rows, default=str).encode("utf-8"),
+            "rows": lambda: render(result, ROWS_FORMAT)[0],
+            "table": lambda: render(result, TABLE_FORMAT)[0],
+            "columnar": lambda: render(result, COLUMNAR_FORMAT)[0],
+        }
+        results[table] = {}
+        with app.app_context():
+            for name, encode in encoders.items():
+                try:
+                    ms, size = time_encoder(encode, repeat)
+                except TypeError as e:
+                    # jsonify cannot encode binary columns
+                    results[table][name] = {"error": str(e)}
+                    continue
+                results[table][name] = {"ms": round(ms, 3), "bytes": size}
+    return results
+
+
+if __name__ == "__main__":
+    with open("config.json", "r") as config_file:
+        config = json.load(config_file)
+
+    connection = pymysql.connect(host=config["manager_ip"], user="replica_user", password="1234", database="sakila")
+    try:
+        for table, encoders in benchmark_serialization(connection).items():
+            print(f"\n{table}:")
+            for name, measure in encoders.items():
+                if "error" in measure:
+                    print(f"  {name:<10} failed: {measure['error']}")
+                else:
+                    print(f"  {name:<10} {measure['ms']:>9.3f} ms {measure['bytes']:>10} bytes")
+    finally:
+        connection.close()
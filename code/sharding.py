@@ -0,0 +1,355 @@
+import zlib
+from collections import namedtuple
+
+from sql_classifier import classify, tokenize, Token, WORD, IDENT, STRING, NUMBER, PUNCT, VARIABLE
+
+
+# Functions whose results cannot be merged by concatenating the rows of each shard
+AGGREGATE_WORDS = {"COUNT", "SUM", "MIN", "MAX", "AVG", "GROUP", "DISTINCT", "HAVING", "GROUP_CONCAT",
+                   "STD", "STDDEV", "VARIANCE", "BIT_AND", "BIT_OR", "BIT_XOR", "JSON_ARRAYAGG", "JSON_OBJECTAGG"}
+
+# Words that make equality constraints unusable for pruning shards
+NON_CONJUNCTIVE_WORDS = {"OR", "XOR", "NOT", "UNION", "EXCEPT", "INTERSECT"}
+
+ShardGroup = namedtuple("ShardGroup", ["manager_ip", "worker_ips"])
+
+ShardPlan = namedtuple("ShardPlan", ["groups", "order_by", "limit"])
+ShardPlan.__doc__ = """
+Where a statement runs.
+
+    groups (list): Indexes of the shard groups to run it on (several for a scatter-gather).
+    order_by (list): (column name or 1-based position, descending) pairs to re-sort merged rows by.
+    limit (int): Row count to trim merged rows to, or None.
+"""
+
+
+class ShardingError(Exception):
+    """
+    Raised for statements that cannot be routed in sharding mode.
+    """
+
+
+def shard_key(value):
+    """
+    Canonical text of a shard key value: integers in decimal, anything else as is,
+    so 42, 42.0 and '42' hash alike.
+    """
+    if isinstance(value, bool) or (isinstance(value, float) and value.is_integer()):
+        value = int(value)
+    return str(value)
+
+
+def shard_of(value, group_count):
+    """
+    Returns the shard group owning a key value. Matches MySQL's MOD(CRC32(key), group_count),
+    so the rows of a group can be selected (or pruned) with SQL.
+    """
+    return zlib.crc32(shard_key(value).encode("utf-8")) % group_count
+
+
+def _literal(tokens, i, params, placeholder_index):
+    """
+    Reads a literal or %s placeholder at position i.
+    Returns (found, value, next position).
+    """
+    if i >= len(tokens):
+        return False, None, i
+    token = tokens[i]
+    if token.kind == NUMBER:
+        text = token.value
+        if text.startswith("0x"):
+            return True, int(text, 16), i + 1
+        return True, float(text) if any(c in text for c in ".eE") else int(text), i + 1
+    if token.kind == STRING:
+        quote = token.value[0]
+        return True, token.value[1:-1].replace(quote * 2, quote).replace("\\" + quote, quote), i + 1
+    if token == Token(PUNCT, "-") and i + 1 < len(tokens) and tokens[i + 1].kind == NUMBER:
+        found, value, end = _literal(tokens, i + 1, params, placeholder_index)
+        return found, -value, end
+    if token == Token(VARIABLE, "%s") and params is not None and i in placeholder_index:
+        position = placeholder_index[i]
+        if position < len(params):
+            return True, params[position], i + 1
+    return False, None, i
+
+
+def _column_at(tokens, i, columns):
+    """
+    Returns True if the token at position i is one of the columns (alone or as qualifier.column).
+    """
+    token = tokens[i]
+    return (token.kind in (WORD, IDENT) and token.value.lower() in columns
+            and not (i + 1 < len(tokens) and tokens[i + 1] == Token(PUNCT, ".")))
+
+
+def _ends_operand(tokens, i):
+    # A literal compared to the key must not be part of a larger expression (key = 1 + x)
+    return i >= len(tokens) or tokens[i].kind != PUNCT or tokens[i].value in (")", ",", ";")
+
+
+class ShardRouter:
+    """
+    Routes statements to hash-sharded replication groups.
+
+    Sharded tables are spread over the groups by the hash of their shard key column; every
+    other table is a reference table kept whole on every group. A statement pinned to one
+    key value (key = value, key IN (...), or the key column of an INSERT) runs on the
+    owning group; one that is not is scattered over every group and the rows are merged.
+    """
+
+    def __init__(self, group_count, keys):
+        self.group_count = group_count
+        # table -> shard key column
+        self.keys = {table.lower(): column.lower() for table, column in keys.items()}
+
+    def plan(self, query, params=None):
+        """
+        Decides where a statement runs.
+
+        Returns:
+            ShardPlan: The groups to run on, or None for a read of reference tables only
+                       (served by the first group like without sharding).
+
+        Raises:
+            ShardingError: If the statement cannot be routed correctly.
+        """
+        classification = classify(query)
+        sharded = {table: self.keys[table] for table in classification.tables if table in self.keys}
+        every_group = list(range(self.group_count))
+        if not sharded:
+            if classification.is_read or not classification.tables:
+                return None
+            # Reference tables are kept whole on every group
+            return ShardPlan(every_group, [], None)
+
+        tokens = tokenize(query)
+        placeholder_index = {}
+        for i, token in enumerate(tokens):
+            if token == Token(VARIABLE, "%s"):
+                placeholder_index[i] = len(placeholder_index)
+
+        columns = set(sharded.values())
+        if classification.kind == "update" and self._assigns(tokens, columns):
+            raise ShardingError("Changing a shard key would move rows between shards")
+
+        if classification.kind in ("insert", "replace") and any(
+                token in (Token(WORD, "VALUES"), Token(WORD, "VALUE")) for token in tokens):
+            groups = self._insert_groups(tokens, columns, params, placeholder_index)
+            if groups is None:
+                raise ShardingError("An INSERT into a sharded table must give its shard key as a literal "
+                                    f"in the column list ({', '.join(sorted(columns))})")
+            if len(groups) > 1:
+                raise ShardingError("The rows of this INSERT belong to different shards; send one statement per shard")
+            return ShardPlan(sorted(groups), [], None)
+
+        groups = self._constrained_groups(tokens, columns, params, placeholder_index)
+        if groups is None:
+            if classification.kind in ("insert", "replace"):
+                raise ShardingError("An INSERT into a sharded table must give its shard key as a literal")
+            groups = set(every_group)
+        groups = sorted(groups)
+        if len(groups) == 1 or not classification.is_read:
+            # A write that is not pinned to a key runs on every group
+            return ShardPlan(groups, [], None)
+        return self._scatter_plan(tokens, groups)
+
+    def _assigns(self, tokens, columns):
+        # UPDATE ... SET column = ...
+        in_set = False
+        for i, token in enumerate(tokens):
+            if token == Token(WORD, "SET"):
+                in_set = True
+            elif token == Token(WORD, "WHERE"):
+                in_set = False
+            elif in_set and _column_at(tokens, i, columns) and i + 1 < len(tokens) and tokens[i + 1] == Token(PUNCT, "="):
+                return True
+        return False
+
+    def _insert_groups(self, tokens, columns, params, placeholder_index):
+        """
+        Returns the groups owning the rows of INSERT ... (columns) VALUES (...), (...),
+        or None if a row has no literal shard key.
+        """
+        i = 0
+        while i < len(tokens) and tokens[i] != Token(PUNCT, "("):
+            i += 1
+        names = []
+        i += 1
+        while i < len(tokens) and tokens[i] != Token(PUNCT, ")"):
+            if tokens[i].kind in (WORD, IDENT):
+                names.append(tokens[i].value.lower())
+            i += 1
+        key_positions = [position for position, name in enumerate(names) if name in columns]
+        if not key_positions:
+            return None
+        while i < len(tokens) and tokens[i] not in (Token(WORD, "VALUES"), Token(WORD, "VALUE")):
+            i += 1
+        i += 1
+
+        groups = set()
+        while i < len(tokens) and tokens[i] == Token(PUNCT, "("):
+            # One row: split its values on the commas at depth one
+            values = [[]]
+            depth = 0
+            i += 1
+            while i < len(tokens):
+                token = tokens[i]
+                if token == Token(PUNCT, "("):
+                    depth += 1
+                elif token == Token(PUNCT, ")"):
+                    if depth == 0:
+                        break
+                    depth -= 1
+                elif token == Token(PUNCT, ",") and depth == 0:
+                    values.append([])
+                    i += 1
+                    continue
+                values[-1].append(i)
+                i += 1
+            for position in key_positions:
+                if position >= len(values) or not values[position]:
+                    return None
+                start = values[position][0]
+                found, value, end = _literal(tokens, start, params, placeholder_index)
+                if not found or end != values[position][-1] + 1:
+                    return None
+                groups.add(shard_of(value, self.group_count))
+            i += 1
+            if i < len(tokens) and tokens[i] == Token(PUNCT, ","):
+                i += 1
+        return groups
+
+    def _constrained_groups(self, tokens, columns, params, placeholder_index):
+        """
+        Returns the groups allowed by key = value / key IN (...) constraints, or None if the
+        statement is not pinned (no constraint, or ones joined with OR / NOT / UNION).
+        """
+        if any(token.kind == WORD and token.value in NON_CONJUNCTIVE_WORDS for token in tokens):
+            return None
+        if any(token.kind == PUNCT and token.value == "|" for token in tokens):
+            return None
+        pinned = None
+        for i in range(len(tokens)):
+            values = None
+            if _column_at(tokens, i, columns):
+                values = self._values_after(tokens, i, params, placeholder_index)
+            elif (i + 2 < len(tokens) and tokens[i + 1] == Token(PUNCT, "=") and _column_at(tokens, i + 2, columns)
+                    and (i == 0 or tokens[i - 1].kind != PUNCT or tokens[i - 1].value in ("(", ","))
+                    and _ends_operand(tokens, i + 3)):
+                # value = key
+                found, value, end = _literal(tokens, i, params, placeholder_index)
+                if found and end == i + 1:
+                    values = [value]
+            if values is None:
+                continue
+            # The union may include a group with no matching row, but never misses one
+            groups = {shard_of(value, self.group_count) for value in values}
+            pinned = groups if pinned is None else pinned | groups
+        return pinned
+
+    def _values_after(self, tokens, i, params, placeholder_index):
+        # key = value or key IN (value, ...) following the column at position i
+        if i + 1 >= len(tokens) or (i > 0 and tokens[i - 1].kind == PUNCT and tokens[i - 1].value not in ("(", ",", ".")):
+            return None
+        follower = tokens[i + 1]
+        if follower == Token(PUNCT, "="):
+            found, value, end = _literal(tokens, i + 2, params, placeholder_index)
+            if found and _ends_operand(tokens, end):
+                return [value]
+            return None
+        if follower == Token(WORD, "IN") and i + 2 < len(tokens) and tokens[i + 2] == Token(PUNCT, "("):
+            values = []
+            j = i + 3
+            while j < len(tokens):
+                found, value, j = _literal(tokens, j, params, placeholder_index)
+                if not found:
+                    return None
+                values.append(value)
+                if j < len(tokens) and tokens[j] == Token(PUNCT, ","):
+                    j += 1
+                    continue
+                if j < len(tokens) and tokens[j] == Token(PUNCT, ")"):
+                    return values
+                return None
+        return None
+
+    def _scatter_plan(self, tokens, groups):
+        """
+        Checks that a read spread over several groups can be merged, and reads the
+        ORDER BY / LIMIT to apply to the merged rows.
+        """
+        if any(token.kind == WORD and token.value in AGGREGATE_WORDS for token in tokens):
+            raise ShardingError("Aggregates, GROUP BY and DISTINCT over sharded tables need the shard key (key = value) "
+                                "to run on a single shard")
+        order_by = []
+        limit = None
+        depth = 0
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token == Token(PUNCT, "("):
+                depth += 1
+            elif token == Token(PUNCT, ")"):
+                depth -= 1
+            elif depth == 0 and token == Token(WORD, "ORDER") and i + 1 < len(tokens) and tokens[i + 1] == Token(WORD, "BY"):
+                order_by, i = self._read_order_by(tokens, i + 2)
+                continue
+            elif depth == 0 and token == Token(WORD, "LIMIT"):
+                rest = tokens[i + 1:]
+                if len(rest) >= 1 and rest[0].kind == NUMBER and (len(rest) == 1 or rest[1] == Token(PUNCT, ";")):
+                    limit = int(rest[0].value)
+                else:
+                    raise ShardingError("LIMIT with an offset cannot be merged across shards")
+                break
+            i += 1
+        return ShardPlan(groups, order_by, limit)
+
+    def _read_order_by(self, tokens, i):
+        order_by = []
+        while i < len(tokens):
+            token = tokens[i]
+            if token.kind == NUMBER:
+                key = int(token.value)
+            elif token.kind in (WORD, IDENT):
+                # qualifier.column sorts on column
+                while i + 2 < len(tokens) and tokens[i + 1] == Token(PUNCT, ".") and tokens[i + 2].kind in (WORD, IDENT):
+                    i += 2
+                key = tokens[i].value.lower()
+            else:
+                raise ShardingError("ORDER BY on an expression cannot be merged across shards")
+            i += 1
+            descending = False
+            if i < len(tokens) and tokens[i] in (Token(WORD, "ASC"), Token(WORD, "DESC")):
+                descending = tokens[i].value == "DESC"
+                i += 1
+            order_by.append((key, descending))
+            if i < len(tokens) and tokens[i] == Token(PUNCT, ","):
+                i += 1
+                continue
+            break
+        return order_by, i
+
+
+def merge_rowsets(rowsets, plan):
+    """
+    Merges the rows a scattered read returned from each group: concatenated, re-sorted by the
+    ORDER BY columns (NULLs first, as MySQL sorts them ascending) and trimmed to the LIMIT.
+
+    Returns:
+        tuple: (columns, rows)
+    """
+    columns = rowsets[0].columns
+    rows = [row for rowset in rowsets for row in rowset.rows]
+    lowered = [column.lower() for column in columns]
+    for key, descending in reversed(plan.order_by):
+        if isinstance(key, int):
+            position = key - 1
+        elif key in lowered:
+            position = lowered.index(key)
+        else:
+            raise ShardingError(f"ORDER BY {key} must be a selected column to merge shards")
+        # Python sorts are stable, so sorting by the last key first gives the full ordering
+        rows.sort(key=lambda row: (row[position] is not None, row[position]), reverse=descending)
+    if plan.limit is not None:
+        rows = rows[:plan.limit]
+    return columns, rows
@@ -0,0 +1,314 @@
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+
+# Longest backend address kept in the shared table (IPv6 included)
+NAME_SIZE = 48
+# Version counters the table names are hashed onto; two tables sharing one only cost
+# each other some spurious cache invalidations
+TABLE_BUCKETS = 4096
+# Largest topology record, in bytes of JSON
+TOPOLOGY_SIZE = 64 * 1024
+
+# Instances created by the gunicorn master before it forks the workers (see gunicorn.conf.py)
+_shared = None
+_tables = None
+_topology = None
+
+
+class BackendLoad:
+    """
+    In-flight query counts and smoothed query latency of every backend, in anonymous shared
+    memory. Created once before the server forks its workers, it gives every worker process
+    the load of all of them, so least-busy and power-of-two routing see the whole proxy.
+
+    Each worker process owns one row of in-flight counts that only its threads write; a
+    backend's load is the sum of its column. When a worker dies, the master zeroes its row,
+    so its unfinished queries do not count forever. Backend slots are assigned on first use
+    and kept for the life of the server.
+    """
+
+    def __init__(self, max_backends=256, max_workers=128):
+        self.max_backends = max_backends
+        self.max_workers = max_workers
+        # Guards slot and row assignment and the latency updates across processes
+        self._shared_lock = multiprocessing.Lock()
+        self._names = RawArray("c", max_backends * NAME_SIZE)
+        self._latency = RawArray("d", [math.nan] * max_backends)
+        self._owners = RawArray("q", max_workers)  # pid owning each row, 0 if free
+        self._counts = RawArray("q", max_workers * max_backends)
+        # Admission slots held per worker row and backend, laid out like the counts
+        self._admitted = RawArray("q", max_workers * max_backends)
+        self._rows_used = RawValue("q", 0)  # rows ever claimed, so sums skip the unused ones
+
+        # Process-local state, reset in a forked child
+        self._pid = None
+        self._row = None
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _local(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            # First use in this process: threads of the parent do not exist here
+            self._pid = pid
+            self._row = None
+            self._slots = {}
+            self._lock = threading.Lock()
+        return pid
+
+    def _worker_row(self):
+        pid = self._local()
+        if self._row is None:
+            with self._shared_lock:
+                for row in range(self.max_workers):
+                    if self._owners[row] in (0, pid):
+                        self._owners[row] = pid
+                        self._rows_used.value = max(self._rows_used.value, row + 1)
+                        self._row = row
+                        break
+                else:
+                    raise RuntimeError(f"More than {self.max_workers} worker processes share the backend load")
+        return self._row
+
+    def _slot(self, ip):
+        self._local()
+        slot = self._slots.get(ip)
+        if slot is not None:
+            return slot
+        name = ip.encode()[:NAME_SIZE]
+        with self._shared_lock:
+            for slot in range(self.max_backends):
+                stored = self._names[slot * NAME_SIZE:(slot + 1) * NAME_SIZE].rstrip(b"\0")
+                if stored == name or not stored:
+                    if not stored:
+                        self._names[slot * NAME_SIZE:slot * NAME_SIZE + len(name)] = name
+                    self._slots[ip] = slot
+                    return slot
+        raise RuntimeError(f"More than {self.max_backends} backends share the backend load")
+
+    def add(self, ip, delta):
+        """
+        Adds delta to the queries this process has in flight on a backend.
+        """
+        slot = self._slot(ip)
+        index = self._worker_row() * self.max_backends + slot
+        with self._lock:
+            self._counts[index] += delta
+
+    def in_flight(self, ip):
+        """
+        Returns the queries in flight on a backend across every worker process.
+        """
+        slot = self._slot(ip)
+        return sum(self._counts[row * self.max_backends + slot] for row in range(self._rows_used.value))
+
+    def record_latency(self, ip, latency_ms, alpha):
+        """
+        Folds a measured query latency into the backend's shared EWMA.
+        """
+        slot = self._slot(ip)
+        with self._shared_lock:
+            previous = self._latency[slot]
+            self._latency[slot] = latency_ms if math.isnan(previous) else alpha * latency_ms + (1 - alpha) * previous
+
+    def latency(self, ip):
+        """
+        Returns the smoothed latency of a backend in milliseconds, or None before its first query.
+        """
+        latency = self._latency[self._slot(ip)]
+        return None if math.isnan(latency) else latency
+
+    def forget_latency(self, ip):
+        self._latency[self._slot(ip)] = math.nan
+
+    def try_admit(self, ip, limit):
+        """
+        Takes one of the limit admission slots of a backend shared by every worker process.
+
+        Returns:
+            bool: False if all of them are held.
+        """
+        slot = self._slot(ip)
+        index = self._worker_row() * self.max_backends + slot
+        with self._shared_lock:
+            if self.admitted(ip) >= limit:
+                return False
+            with self._lock:
+                self._admitted[index] += 1
+        return True
+
+    def release_admission(self, ip):
+        """
+        Frees an admission slot this process took with try_admit().
+        """
+        index = self._worker_row() * self.max_backends + self._slot(ip)
+        with self._lock:
+            self._admitted[index] -= 1
+
+    def admitted(self, ip):
+        """
+        Returns the admission slots of a backend held across every worker process.
+        """
+        slot = self._slot(ip)
+        return sum(self._admitted[row * self.max_backends + slot] for row in range(self._rows_used.value))
+
+    def release_worker(self, pid):
+        """
+        Frees the row of a worker process that exited, dropping its in-flight counts and
+        admission slots.
+        """
+        with self._shared_lock:
+            for row in range(self.max_workers):
+                if self._owners[row] == pid:
+                    self._counts[row * self.max_backends:(row + 1) * self.max_backends] = [0] * self.max_backends
+                    self._admitted[row * self.max_backends:(row + 1) * self.max_backends] = [0] * self.max_backends
+                    self._owners[row] = 0
+
+
+class TableVersions:
+    """
+    Write versions of the tables, in anonymous shared memory, so a write in one worker
+    process invalidates the results the others cached from those tables (see
+    result_cache.ResultCache). Every table hashes onto one of TABLE_BUCKETS counters, kept
+    with the time.monotonic() of its last write: the clock is system-wide, so the times
+    of all the processes compare.
+    """
+
+    def __init__(self, buckets=TABLE_BUCKETS):
+        self.buckets = buckets
+        self._lock = multiprocessing.Lock()
+        self._versions = RawArray("q", buckets)
+        self._written_at = RawArray("d", [-math.inf] * buckets)
+        # Bumped by clear(), which invalidates every table
+        self._generation = RawValue("q", 0)
+        self._cleared_at = RawValue("d", -math.inf)
+
+    def _bucket(self, table):
+        return zlib.crc32(table.encode()) % self.buckets
+
+    def current(self, tables):
+        """
+        Returns the generation and the version of each table.
+        """
+        return self._generation.value, {table: self._versions[self._bucket(table)] for table in tables}
+
+    def bump(self, tables):
+        """
+        Records a write of the tables.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for table in tables:
+                bucket = self._bucket(table)
+                self._versions[bucket] += 1
+                self._written_at[bucket] = now
+
+    def clear(self):
+        """
+        Invalidates every table.
+        """
+        with self._lock:
+            self._generation.value += 1
+            self._cleared_at.value = time.monotonic()
+
+    def written_within(self, tables, since):
+        """
+        Returns True if one of the tables was written (or the cache cleared) after since.
+        """
+        if self._cleared_at.value > since:
+            return True
+        return any(self._written_at[self._bucket(table)] > since for table in tables)
+
+
+class TopologyRecord:
+    """
+    The last backend topology applied by any worker process, in anonymous shared memory:
+    a generation counter and the topology as JSON. The other workers follow it, and a
+    worker started later adopts it instead of the one in its config file.
+    """
+
+    def __init__(self, size=TOPOLOGY_SIZE):
+        self.size = size
+        self._lock = multiprocessing.Lock()
+        self._generation = RawValue("q", 0)
+        self._length = RawValue("q", 0)
+        self._data = RawArray("c", size)
+
+    def generation(self):
+        return self._generation.value
+
+    def read(self):
+        """
+        Returns the generation and the last published topology (None before the first one).
+        """
+        with self._lock:
+            generation = self._generation.value
+            data = self._data[:self._length.value]
+        return generation, json.loads(data) if data else None
+
+    def publish(self, topology):
+        """
+        Records a topology; the generation only moves if it differs from the last one.
+
+        Returns:
+            int: The generation of the record.
+        """
+        data = json.dumps(topology, sort_keys=True).encode()
+        if len(data) > self.size:
+            raise ValueError(f"Topology larger than {self.size} bytes")
+        with self._lock:
+            if self._data[:self._length.value] != data:
+                self._data[:len(data)] = data
+                self._length.value = len(data)
+                self._generation.value += 1
+            return self._generation.value
+
+
+def create_shared(max_backends=256, max_workers=128):
+    """
+    Creates the backend load, table versions and topology record shared by the processes
+    forked after this call.
+    """
+    global _shared, _tables, _topology
+    _shared = BackendLoad(max_backends, max_workers)
+    _tables = TableVersions()
+    _topology = TopologyRecord()
+    return _shared
+
+
+def backend_load():
+    """
+    Returns the backend load inherited from the server's master process, or a new
+    one private to this process (e.g. under the Flask development server).
+    """
+    return _shared if _shared is not None else create_shared()
+
+
+def table_versions():
+    """
+    Returns the shared table versions, created like backend_load().
+    """
+    if _tables is None:
+        create_shared()
+    return _tables
+
+
+def topology_record():
+    """
+    Returns the shared topology record, created like backend_load().
+    """
+    if _topology is None:
+        create_shared()
+    return _topology
+
+
+def release_worker(pid):
+    if _shared is not None:
+        _shared.release_worker(pid)
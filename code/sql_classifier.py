@@ -0,0 +1,251 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+
+# Token kinds
+WORD = "word"
+IDENT = "ident"
+STRING = "string"
+NUMBER = "number"
+PUNCT = "punct"
+VARIABLE = "variable"
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^'\\]|\\.|'')*'?|"(?:[^"\\]|\\.|"")*"?)
+  | (?P<ident>`(?:[^`]|``)*`?)
+  | (?P<number>0x[0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<variable>@@?[\w.$]+|\?|%s|%\(\w+\)s)
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<punct>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Literals masked out of a statement before its classification is looked up; quoted
+# identifiers and comments are matched so the literals inside them are left alone
+LITERAL_PATTERN = re.compile(r"""
+    (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<number>\b0x[0-9a-fA-F]+\b|\b\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\b)
+  | `(?:[^`]|``)*`|--[^\n]*|\#[^\n]*|/\*.*?\*/
+""", re.VERBOSE | re.DOTALL)
+
+# Statements that only read data
+READ_KINDS = {"select", "show", "explain", "describe", "help"}
+
+# Keywords after which a table name follows
+TABLE_KEYWORDS = {"FROM", "JOIN", "INTO", "UPDATE", "TABLE"}
+
+# Keywords that end a FROM list
+CLAUSE_KEYWORDS = {
+    "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "UNION", "ON", "USING", "SET", "VALUES",
+    "VALUE", "SELECT", "FOR", "LOCK", "INTO", "WINDOW", "PARTITION", "JOIN", "INNER", "LEFT",
+    "RIGHT", "CROSS", "STRAIGHT_JOIN", "NATURAL", "OUTER", "EXCEPT", "INTERSECT", "PROCEDURE",
+    "NOWAIT", "SKIP", "OF", "DUAL",
+}
+
+Token = namedtuple("Token", ["kind", "value"])
+
+Classification = namedtuple("Classification", ["kind", "is_read", "tables", "locking"])
+Classification.__doc__ = """
+Result of classifying a statement.
+
+    kind (str): Lower-cased leading verb ("select", "insert", "update", "show", ...).
+                A WITH statement takes the kind of its main statement.
+    is_read (bool): True if the statement can run on a replica.
+    tables (frozenset): Lower-cased names of the tables it references.
+    locking (str): Locking clause ("for update", "for share", "lock in share mode") or None.
+"""
+
+
+def tokenize(query):
+    """
+    Splits a SQL statement into tokens, dropping whitespace and comments.
+    Words are upper-cased; quoted identifiers are unquoted.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        text = match.group()
+        if kind in ("ws", "comment"):
+            # MySQL executable comments /*! ... */ hold real SQL
+            if kind == "comment" and text.startswith("/*!"):
+                body = re.sub(r"^/\*!\d*", "", text)
+                tokens.extend(tokenize(body[:-2] if body.endswith("*/") else body))
+            continue
+        if kind == WORD:
+            tokens.append(Token(WORD, text.upper()))
+        elif kind == IDENT:
+            tokens.append(Token(IDENT, text[1:-1].replace("``", "`")))
+        else:
+            tokens.append(Token(kind, text))
+    return tokens
+
+
+def _is_name(token):
+    return token.kind == IDENT or (token.kind == WORD and token.value not in CLAUSE_KEYWORDS)
+
+
+def _read_table_name(tokens, i):
+    """
+    Reads a (possibly db-qualified) table name at position i.
+    Returns (name, next position) or (None, i).
+    """
+    if i >= len(tokens) or not _is_name(tokens[i]):
+        return None, i
+    name = tokens[i].value
+    i += 1
+    if i + 1 < len(tokens) and tokens[i] == Token(PUNCT, ".") and _is_name(tokens[i + 1]):
+        name = tokens[i + 1].value
+        i += 2
+    return name.lower(), i
+
+
+def _skip_alias(tokens, i):
+    if i < len(tokens) and tokens[i] == Token(WORD, "AS"):
+        i += 1
+    if i < len(tokens) and _is_name(tokens[i]):
+        i += 1
+    return i
+
+
+def _extract_tables(tokens):
+    tables = set()
+    cte_names = set()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        # WITH name AS (...), name2 AS (...)
+        if token.kind == WORD and token.value in ("WITH", "RECURSIVE") and i + 1 < len(tokens):
+            if _is_name(tokens[i + 1]) and tokens[i + 1].value != "RECURSIVE":
+                cte_names.add(tokens[i + 1].value.lower())
+        elif (token == Token(PUNCT, ",") and i + 3 < len(tokens) and tokens[i + 2] == Token(WORD, "AS")
+                and tokens[i + 3] == Token(PUNCT, "(")):
+            if _is_name(tokens[i + 1]):
+                cte_names.add(tokens[i + 1].value.lower())
+
+        if token.kind == WORD and token.value in TABLE_KEYWORDS:
+            # FOR UPDATE and ON DUPLICATE KEY UPDATE are not followed by a table
+            if token.value == "UPDATE" and i > 0 and tokens[i - 1] in (Token(WORD, "FOR"), Token(WORD, "KEY")):
+                i += 1
+                continue
+            # SELECT ... INTO @var / OUTFILE does not name a table
+            i += 1
+            while True:
+                name, i = _read_table_name(tokens, i)
+                if name is None:
+                    break
+                tables.add(name)
+                i = _skip_alias(tokens, i)
+                # FROM a, b, c
+                if token.value in ("FROM", "TABLE", "UPDATE") and i < len(tokens) and tokens[i] == Token(PUNCT, ","):
+                    i += 1
+                    continue
+                break
+            continue
+        i += 1
+    return frozenset(tables - cte_names)
+
+
+def _main_verb(tokens):
+    """
+    Returns the verb of the statement, looking past leading parentheses and WITH clauses.
+    """
+    i = 0
+    while i < len(tokens) and tokens[i] == Token(PUNCT, "("):
+        i += 1
+    if i >= len(tokens) or tokens[i].kind != WORD:
+        return None
+    if tokens[i].value != "WITH":
+        return tokens[i].value
+    # First statement verb at parenthesis depth zero after the CTE definitions
+    depth = 0
+    for token in tokens[i + 1:]:
+        if token == Token(PUNCT, "("):
+            depth += 1
+        elif token == Token(PUNCT, ")"):
+            depth -= 1
+        elif depth == 0 and token.kind == WORD and token.value in ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "TABLE", "VALUES"):
+            return token.value
+    return None
+
+
+def _locking_clause(tokens):
+    values = [token.value if token.kind == WORD else None for token in tokens]
+    for i, value in enumerate(values):
+        if value == "FOR" and i + 1 < len(values):
+            if values[i + 1] == "UPDATE":
+                return "for update"
+            if values[i + 1] == "SHARE":
+                return "for share"
+        if value == "LOCK" and values[i + 1:i + 4] == ["IN", "SHARE", "MODE"]:
+            return "lock in share mode"
+    return None
+
+
+def _selects_into(tokens):
+    # SELECT ... INTO OUTFILE / DUMPFILE / @var has side effects
+    seen_select = False
+    for token in tokens:
+        if token.kind == WORD and token.value == "SELECT":
+            seen_select = True
+        elif seen_select and token.kind == WORD and token.value == "INTO":
+            return True
+    return False
+
+
+def _mask_literal(match):
+    return "?" if match.lastgroup else match.group()
+
+
+def mask_literals(query):
+    """
+    Replaces the string and number literals of a statement with ?, leaving identifiers,
+    comments and everything else as written.
+    """
+    return LITERAL_PATTERN.sub(_mask_literal, query)
+
+
+def classify(query):
+    """
+    Classifies a SQL statement for read/write routing.
+
+    Literals do not change how a statement is classified, so results are memoized on the
+    statement with its string and number literals replaced by ?: queries differing only in
+    their values share one cache entry.
+
+    Args:
+        query (str): The SQL statement.
+
+    Returns:
+        Classification: The statement kind, whether it is a read, the tables it references
+                        and its locking clause.
+    """
+    return _classify_shape(mask_literals(query))
+
+
+@lru_cache(maxsize=4096)
+def _classify_shape(query):
+    tokens = tokenize(query)
+    verb = _main_verb(tokens)
+    kind = verb.lower() if verb else "unknown"
+    if kind == "desc":
+        kind = "describe"
+    elif kind in ("table", "values"):
+        # TABLE t / VALUES ROW(...) are shorthand SELECTs
+        kind = "select"
+    locking = _locking_clause(tokens)
+    is_read = kind in READ_KINDS and locking is None
+    if kind == "select" and _selects_into(tokens):
+        is_read = False
+    if kind == "explain" and any(token.kind == WORD and token.value == "ANALYZE" for token in tokens[:3]):
+        # EXPLAIN ANALYZE executes the statement it explains
+        is_read = _main_verb(tokens[2:]) in ("SELECT", "WITH", "TABLE")
+    return Classification(kind, is_read, _extract_tables(tokens), locking)
+
+
+def is_read_query(query):
+    """
+    Returns True if the statement can be served by a replica.
+    """
+    return classify(query).is_read
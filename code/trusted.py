@@ -1,7 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import requests
 import json
 import logging
+import time
+from metrics import MetricsRegistry, instrument_app
+from http_client import PooledHTTPClient
+from forwarding import (BUDGET_HEADER, validate_statement, validate_batch, time_left, budget_headers,
+                        relayed_error, request_strategy)
 
 app = Flask(__name__)
 
@@ -15,6 +20,45 @@ with open("config_trust.json", "r") as config_file:
 proxy_ip = config["proxy_ip"]
 PROXY_URL = f"http://{proxy_ip}:8000"
 
+# Pooled keep-alive connections to the Proxy (optional "http_client" section in config_trust.json)
+http_client_config = config.get("http_client", {})
+proxy_client = PooledHTTPClient(
+    PROXY_URL,
+    pool_size=http_client_config.get("pool_size", 16),  # one per gunicorn thread (see gunicorn.conf.py)
+    pool_block=http_client_config.get("pool_block", False),  # wait for a pooled connection rather than open one more
+    connect_timeout=http_client_config.get("connect_timeout", 2.0),  # seconds
+    connect_retries=http_client_config.get("connect_retries", 1)
+)
+
+# End-to-end time budget of a request (see forwarding.py)
+REQUEST_TIMEOUT = config.get("request_timeout", 30.0)  # seconds, for requests without a "timeout"
+MAX_REQUEST_TIMEOUT = config.get("max_request_timeout", 300.0)  # seconds
+
+
+def request_deadline(data):
+    """
+    Returns the deadline of a request (a time.monotonic() value): what the gatekeeper left of
+    the budget, else the request's "timeout", else REQUEST_TIMEOUT.
+    """
+    try:
+        budget = int(request.headers[BUDGET_HEADER]) / 1000
+    except (KeyError, ValueError):
+        budget = min(data.get("timeout") or REQUEST_TIMEOUT, MAX_REQUEST_TIMEOUT)
+    return time.monotonic() + budget
+
+
+# Prometheus metrics served on GET /metrics
+metrics_registry = MetricsRegistry()
+instrument_app(app, metrics_registry, "trusted", request_strategy)
+metrics_registry.callback("trusted_upstream_requests_total", "Requests sent to the Proxy.",
+                          lambda: proxy_client.stats()["requests"], kind="counter")
+metrics_registry.callback("trusted_upstream_connections_opened_total", "Connections opened to the Proxy.",
+                          lambda: proxy_client.stats()["connections_opened"], kind="counter")
+metrics_registry.callback("trusted_upstream_connection_reuse_ratio",
+                          "Share of the requests to the Proxy sent on a kept-alive connection.",
+                          lambda: proxy_client.stats()["reuse_rate"], multiprocess_mode="mean")
+
+
 @app.route("/process", methods=["POST"])
 def process_request():
     """
@@ -23,8 +67,15 @@ def process_request():
     Request format:
     {
         "type": "read" or "write",
-        "query": "SQL query string",
-        "strategy": "direct", "random", or "customized"
+        "query": "SQL query string" (a template with %s placeholders if params are given),
+        "params": list of values (optional, bound to the placeholders by the proxy),
+        "strategy": one of STRATEGIES (default "direct"),
+        "cache": true or false (optional, false bypasses the proxy result cache),
+        "stream": "ndjson" or "json" (optional, streams large read results in chunks),
+        "chunk_rows", "max_rows", "max_bytes": integers (optional, streaming limits),
+        "coalesce": true or false (optional, group-commit single-row INSERTs),
+        "read_your_writes": true or false (optional, a write returns a consistency token),
+        "consistency_token": token returned by an earlier write (optional, read-your-writes)
     }
 
     Returns:
@@ -37,28 +88,118 @@ def process_request():
     if not data:
         return jsonify({"error": "No data provided"}), 400
 
-    query_type = data.get("type")
+    error = validate_statement(data)
+    if error:
+        return jsonify({"error": error}), 400
+
     query = data.get("query")
     strategy = data.get("strategy", "direct")  # Default strategy is direct
 
-    if query_type not in ["read", "write"]:
-        return jsonify({"error": "Invalid query type"}), 400
-
-    if not query:
-        return jsonify({"error": "No query provided"}), 400
-
-    if strategy not in ["direct", "random", "customized"]:
-        return jsonify({"error": "Invalid strategy"}), 400
-
     # Map strategy to Proxy endpoint
     endpoint = f"/{strategy}"
 
+    deadline = request_deadline(data)
+
     # Forward the query to the Proxy
     try:
         logging.info(f"Forwarding query to Proxy {PROXY_URL}{endpoint}: {query}")
-        response = requests.post(f"{PROXY_URL}{endpoint}", params={"query": query})
+        params = {"query": query}
+        if data.get("params") is not None:
+            params["params"] = json.dumps(data["params"])  # Bound by the proxy, never spliced into the SQL
+        if data.get("cache") is False:
+            params["cache"] = "false"  # Ask the proxy to bypass its result cache
+        if data.get("consistency_token"):
+            params["consistency_token"] = data["consistency_token"]  # Read only from caught-up replicas
+        if "coalesce" in data:
+            params["coalesce"] = "true" if data["coalesce"] else "false"  # Opt in/out of write batching
+        if "read_your_writes" in data:
+            params["read_your_writes"] = "true" if data["read_your_writes"] else "false"  # Ask for a consistency token
+        stream = data.get("stream")
+        if stream:
+            params["stream"] = stream
+            for option in ("chunk_rows", "max_rows", "max_bytes"):
+                if option in data:
+                    params[option] = data[option]
+        response = proxy_client.post(endpoint, time_left(deadline), params=params, stream=bool(stream),
+                                     headers={"Accept": request.headers.get("Accept", "application/json"),
+                                              **budget_headers(deadline)})
+        error_response = relayed_error(response)
+        if error_response is not None:
+            return error_response
+        if not response.ok:
+            # A streamed body that is not relayed would hold on to its pooled connection
+            response.close()
+        response.raise_for_status()
+        if stream:
+            # Relay the chunks as they arrive instead of decoding the whole result
+            relayed = Response(response.iter_content(chunk_size=None), status=response.status_code,
+                               content_type=response.headers.get("Content-Type"))
+            # Frees the pooled connection even if the client goes away mid-stream
+            relayed.call_on_close(response.close)
+            return relayed
+        # Relay the body as is: the client may have negotiated a format other than plain JSON
+        return Response(response.content, status=response.status_code,
+                        content_type=response.headers.get("Content-Type"))
+    except requests.exceptions.Timeout:
+        logging.error("Proxy did not answer before the deadline")
+        return jsonify({"error": "Deadline exceeded"}), 504
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to reach Proxy: {str(e)}")
+        return jsonify({"error": f"Failed to reach Proxy: {str(e)}"}), 500
+
+
+@app.route("/process_batch", methods=["POST"])
+def process_batch_request():
+    """
+    Processes a batch of statements from the Gatekeeper and forwards it to the Proxy in one request.
+
+    Request format:
+    {
+        "statements": [{"type": "read" or "write", "query": "SQL query string", "params": [...], "strategy": ...}, ...],
+        "transaction": true or false (optional, run each backend's statements in one transaction),
+        "read_your_writes": true or false (optional, return a consistency token covering the writes)
+    }
+
+    Returns:
+        - {"results": [...]} from the Proxy, in statement order.
+        - Error response if validation or forwarding fails.
+    """
+    data = request.json
+
+    # Validate input
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+
+    error = validate_batch(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    payload = {
+        "statements": [
+            {"query": statement["query"], "params": statement.get("params"),
+             "strategy": statement.get("strategy", "direct")}
+            for statement in data["statements"]
+        ],
+        "transaction": bool(data.get("transaction", False)),
+    }
+    if "read_your_writes" in data:
+        payload["read_your_writes"] = bool(data["read_your_writes"])
+
+    deadline = request_deadline(data)
+
+    # Forward the batch to the Proxy
+    try:
+        logging.info(f"Forwarding batch of {len(payload['statements'])} statements to Proxy {PROXY_URL}/batch")
+        response = proxy_client.post("/batch", time_left(deadline), json=payload,
+                                     headers=budget_headers(deadline))
+        error_response = relayed_error(response)
+        if error_response is not None:
+            return error_response
         response.raise_for_status()
         return jsonify(response.json()), response.status_code
+    except requests.exceptions.Timeout:
+        logging.error("Proxy did not answer before the deadline")
+        return jsonify({"error": "Deadline exceeded"}), 504
     except requests.exceptions.RequestException as e:
         logging.error(f"Failed to reach Proxy: {str(e)}")
         return jsonify({"error": f"Failed to reach Proxy: {str(e)}"}), 500
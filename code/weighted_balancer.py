@@ -0,0 +1,133 @@
+import threading
+import time
+
+
+class WeightedBalancer:
+    """
+    Smooth weighted round-robin over the workers (the nginx algorithm): every pick adds each
+    candidate's effective weight to its current weight, takes the largest and subtracts the
+    total from it. A worker of weight 3 next to one of weight 1 gets 3 of every 4 reads,
+    interleaved rather than in bursts.
+
+    Static weights come from config. In adaptive mode the effective weights follow the
+    observed query latency and throughput every adapt_interval: a worker answering slower than
+    the average loses weight, a faster one gains, and so does one completing a larger share of
+    the queries than its weight sent it (reads routed by other strategies, failovers) at that
+    latency, since it has capacity to spare. The weights stay within [min_factor, max_factor]
+    of the static ones.
+    """
+
+    def __init__(self, backends, weights=None, default_weight=1, adaptive=False, adapt_interval=5.0,
+                 smoothing=0.5, min_factor=0.25, max_factor=4.0, min_samples=20):
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self.adaptive = adaptive
+        self.adapt_interval = adapt_interval
+        self.smoothing = smoothing
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._current = {}
+        self._effective = {}
+        # Latency samples since the last adaptation: ip -> [count, total ms]
+        self._samples = {}
+        self._throughput = {}
+        self._adapted_at = time.monotonic()
+        self.set_backends(backends)
+
+    def static_weight(self, ip):
+        return self.weights.get(ip, self.default_weight)
+
+    def set_backends(self, backends):
+        """
+        Replaces the weighted backends; new ones start at their static weight.
+        """
+        with self._lock:
+            for ip in list(self._effective):
+                if ip not in backends:
+                    del self._effective[ip]
+                    self._current.pop(ip, None)
+                    self._samples.pop(ip, None)
+                    self._throughput.pop(ip, None)
+            for ip in backends:
+                self._effective.setdefault(ip, float(self.static_weight(ip)))
+                self._current.setdefault(ip, 0.0)
+
+    def record(self, ip, latency_ms):
+        """
+        Records the latency of a query served by a backend (only used in adaptive mode).
+        """
+        if not self.adaptive:
+            return
+        with self._lock:
+            sample = self._samples.get(ip)
+            if sample is None:
+                self._samples[ip] = [1, latency_ms]
+            else:
+                sample[0] += 1
+                sample[1] += latency_ms
+
+    def _adapt(self, now):
+        # Must be called with the lock held
+        elapsed = now - self._adapted_at
+        self._adapted_at = now
+        self._throughput = {ip: count / elapsed for ip, (count, _) in self._samples.items()}
+        # Backends with too little traffic in the interval keep their weight
+        latencies = {ip: total / count for ip, (count, total) in self._samples.items()
+                     if ip in self._effective and count >= self.min_samples and total > 0}
+        self._samples = {}
+        if len(latencies) < 2:
+            return
+        average = sum(latencies.values()) / len(latencies)
+        total_throughput = sum(self._throughput[ip] for ip in latencies)
+        total_weight = sum(self._effective[ip] for ip in latencies)
+        for ip, latency in latencies.items():
+            # Share of the queries completed against the share of the picks its weight gave it:
+            # 1 when only this balancer routes to the workers
+            load = 1.0
+            if self._effective[ip] > 0:
+                load = (self._throughput[ip] / total_throughput) / (self._effective[ip] / total_weight)
+            static = self.static_weight(ip)
+            target = static * min(self.max_factor, max(self.min_factor, average / latency * load))
+            self._effective[ip] = (1 - self.smoothing) * self._effective[ip] + self.smoothing * target
+
+    def pick(self, candidates):
+        """
+        Returns the next backend among the candidates, or None if there are none.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.adaptive and now - self._adapted_at >= self.adapt_interval:
+                self._adapt(now)
+            best = None
+            total = 0.0
+            for ip in candidates:
+                weight = self._effective.get(ip)
+                if weight is None:
+                    weight = self._effective[ip] = float(self.static_weight(ip))
+                    self._current[ip] = 0.0
+                if weight <= 0:
+                    continue
+                self._current[ip] += weight
+                total += weight
+                if best is None or self._current[ip] > self._current[best]:
+                    best = ip
+            if best is not None:
+                self._current[best] -= total
+            return best
+
+    def snapshot(self):
+        """
+        Returns the static and effective weight, and the observed throughput, of every backend.
+        """
+        with self._lock:
+            return {
+                ip: {
+                    "static_weight": self.static_weight(ip),
+                    "effective_weight": round(weight, 3),
+                    "throughput_qps": round(self._throughput.get(ip, 0.0), 3) if self.adaptive else None,
+                }
+                for ip, weight in self._effective.items()
+            }
@@ -0,0 +1,247 @@
+import re
+import threading
+import time
+import logging
+
+import pymysql
+
+from connection_pool import PooledConnection
+from sql_classifier import tokenize, Token, PUNCT
+
+
+# INSERT INTO table (columns) VALUES (...)
+SINGLE_ROW_INSERT_PATTERN = re.compile(
+    r"^\s*INSERT\s+INTO\s+`?(\w+)`?\s*\(([^()]*)\)\s*VALUES?\s*(\(.*\))\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL)
+
+# Errors after which InnoDB has rolled back the whole transaction, not only the statement:
+# deadlock, and lock wait timeout (with innodb_rollback_on_timeout, which we cannot see)
+TRANSACTION_ROLLBACK_ERRORS = {1213, 1205}
+# Times a batch whose transaction was rolled back is run again before every row fails
+TRANSACTION_RETRIES = 1
+
+
+class TransactionRolledBack(Exception):
+    """
+    The server rolled back the batch's transaction: none of its rows were written.
+    """
+
+
+def parse_single_row_insert(query):
+    """
+    Recognizes a plain single-row INSERT that can be merged with others.
+
+    Returns:
+        tuple: (table, normalized column list, values tuple text), or None if the
+               statement is anything else (multi-row, INSERT ... SELECT, ON DUPLICATE KEY, ...).
+    """
+    match = SINGLE_ROW_INSERT_PATTERN.match(query)
+    if not match:
+        return None
+    table, columns, values = match.groups()
+    # The values must be exactly one parenthesized tuple
+    depth = 0
+    tokens = tokenize(values)
+    for i, token in enumerate(tokens):
+        if token == Token(PUNCT, "("):
+            depth += 1
+        elif token == Token(PUNCT, ")"):
+            depth -= 1
+            if depth == 0 and i != len(tokens) - 1:
+                return None
+    if depth != 0:
+        return None
+    normalized_columns = ", ".join(column.strip().strip("`").lower() for column in columns.split(","))
+    return table.lower(), normalized_columns, values.strip()
+
+
+class PendingWrite:
+    """
+    One caller's INSERT waiting in a batch.
+    """
+
+    def __init__(self, query, values):
+        self.query = query
+        self.values = values
+        self.result = None
+        self.done = threading.Event()
+
+
+class WriteBatch:
+    """
+    INSERTs to the same table and columns gathered within one window.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+
+
+class WriteCoalescer:
+    """
+    Group commit for high-rate single-row INSERTs.
+
+    The first INSERT for a (backend, table, columns) key opens a batch and becomes its
+    leader: it waits at most window_ms, or until max_batch INSERTs joined, then runs the
+    whole batch and wakes the other callers with their own result. A caller therefore
+    waits at most one window plus the batch execution time.
+
+    Modes:
+        "transaction": run each INSERT on one connection and commit once. Every caller
+                       gets its exact insert id and its own error if its row fails. A
+                       deadlock or lock wait timeout loses the whole transaction: the batch
+                       is run again, then every row fails.
+        "multirow": merge the batch into one multi-row INSERT. Insert ids are derived from
+                    the first generated id, which requires innodb_autoinc_lock_mode <= 1;
+                    if the statement fails the batch is retried in "transaction" mode.
+    """
+
+    def __init__(self, pools, window_ms=5, max_batch=100, mode="transaction", observe=None):
+        """
+        Args:
+            pools (dict): Backend IP -> ConnectionPool.
+            window_ms (float): Longest an INSERT waits for others to join its batch.
+            max_batch (int): A batch runs as soon as it holds this many INSERTs.
+            mode (str): "transaction" or "multirow".
+            observe (callable): observe(target_ip, writes, latency_ms, error) is called after
+                                every batch with its (query, result) pairs, its execution time
+                                and the exception that failed it (None on success).
+        """
+        self.pools = pools
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.mode = mode
+        self.observe = observe
+
+        self._lock = threading.Lock()
+        self._open = {}
+
+        # Stats
+        self.batches = 0
+        self.coalesced_writes = 0
+        self.largest_batch = 0
+
+    def submit(self, target_ip, query):
+        """
+        Adds an INSERT to the open batch of its table and waits for the batch to run.
+
+        Returns:
+            dict: {"status": "success", "insert_id": id} or {"error": ...}, or None if the
+                  query is not a single-row INSERT and must be executed normally.
+        """
+        parsed = parse_single_row_insert(query)
+        if parsed is None:
+            return None
+        table, columns, values = parsed
+        key = (target_ip, table, columns)
+        item = PendingWrite(query, values)
+
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = WriteBatch()
+                self._open[key] = batch
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch:
+                # Close the batch so later INSERTs start a new one
+                del self._open[key]
+                batch.full.set()
+
+        if not leader:
+            item.done.wait()
+            return item.result
+
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._open.get(key) is batch:
+                del self._open[key]
+            items = list(batch.items)
+            self.batches += 1
+            self.coalesced_writes += len(items)
+            self.largest_batch = max(self.largest_batch, len(items))
+
+        error = None
+        start = time.perf_counter()
+        try:
+            self._flush(target_ip, table, columns, items)
+        except Exception as e:
+            logging.error(f"Error executing write batch on {target_ip}: {str(e)}")
+            error = e.__cause__ if isinstance(e, TransactionRolledBack) else e
+            for pending in items:
+                if pending.result is None:
+                    pending.result = {"error": str(e)}
+        finally:
+            for pending in items:
+                pending.done.set()
+        if self.observe is not None:
+            self.observe(target_ip, [(pending.query, pending.result) for pending in items],
+                         (time.perf_counter() - start) * 1000, error)
+        return item.result
+
+    def _flush(self, target_ip, table, columns, items):
+        with PooledConnection(self.pools[target_ip]) as connection:
+            with connection.cursor() as cursor:
+                if self.mode == "multirow" and len(items) > 1:
+                    try:
+                        cursor.execute(f"INSERT INTO `{table}` ({columns}) VALUES "
+                                       + ", ".join(pending.values for pending in items))
+                        connection.commit()
+                        first_id = cursor.lastrowid
+                        for offset, pending in enumerate(items):
+                            pending.result = {"status": "success", "insert_id": first_id + offset}
+                        return
+                    except Exception as e:
+                        connection.rollback()
+                        logging.warning(f"Multi-row INSERT into {table} failed, retrying row by row: {str(e)}")
+
+                for attempt in range(TRANSACTION_RETRIES + 1):
+                    try:
+                        results = self._run_rows(connection, cursor, items)
+                        break
+                    except TransactionRolledBack as e:
+                        if attempt == TRANSACTION_RETRIES:
+                            raise
+                        logging.warning(f"Write batch into {table} rolled back, running it again: {str(e)}")
+                # Only report success once the commit went through
+                for pending, result in zip(items, results):
+                    pending.result = result
+
+    @staticmethod
+    def _run_rows(connection, cursor, items):
+        """
+        Runs the INSERTs of a batch one by one in a transaction and commits it.
+
+        Returns:
+            list: The result of every row.
+
+        Raises:
+            TransactionRolledBack: If the server rolled the transaction back, losing every row.
+        """
+        results = []
+        for pending in items:
+            try:
+                cursor.execute(pending.query)
+                results.append({"status": "success", "insert_id": cursor.lastrowid})
+            except pymysql.err.MySQLError as e:
+                code = e.args[0] if e.args and isinstance(e.args[0], int) else 0
+                if code in TRANSACTION_ROLLBACK_ERRORS:
+                    connection.rollback()
+                    raise TransactionRolledBack(f"Transaction rolled back: {str(e)}") from e
+                # Any other failed statement only rolls back itself; the rest of the batch still commits
+                results.append({"error": str(e)})
+        connection.commit()
+        return results
+
+    def stats(self):
+        """
+        Returns the write batching counters.
+        """
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "coalesced_writes": self.coalesced_writes,
+                "average_batch": round(self.coalesced_writes / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "open_batches": len(self._open),
+            }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The services import each other as flat modules from code/, as they do in their images
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "code"))
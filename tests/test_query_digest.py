@@ -0,0 +1,50 @@
+import pytest
+
+from query_digest import QueryDigest, fingerprint, _fingerprint_shape
+
+
+@pytest.mark.parametrize("query, text", [
+    ("SELECT * FROM t WHERE id = 1", "SELECT * FROM T WHERE ID = ?"),
+    ("select * from t where id=2", "SELECT * FROM T WHERE ID = ?"),
+    ("SELECT a FROM t WHERE x IN (1, 2, 3)", "SELECT A FROM T WHERE X IN (?)"),
+    ("INSERT INTO t (a, b) VALUES (1, 'x'), (2, 'y')", "INSERT INTO T (A, B) VALUES (?)"),
+    ("SELECT * FROM t WHERE s = 'it''s' AND h = 0xFF -- comment\n", "SELECT * FROM T WHERE S = ? AND H = ?"),
+    ("UPDATE t SET a = NULL, b = TRUE WHERE c = %s", "UPDATE T SET A = ?, B = ? WHERE C = ?"),
+    ("SELECT `c1` FROM `t 2` WHERE d = \"q\" /* x */", "SELECT `c1` FROM `t 2` WHERE D = ?"),
+    ("SELECT NOW(), COUNT(*) FROM t2 WHERE x = ?;", "SELECT NOW(), COUNT(*) FROM T2 WHERE X = ?"),
+    ("SELECT @v, a FROM t WHERE b IN ('a','b') LIMIT 10, 20", "SELECT @v, A FROM T WHERE B IN (?) LIMIT ?, ?"),
+    ("SELECT a - 3 FROM t1 WHERE b = -2.5e3", "SELECT A - ? FROM T1 WHERE B = ?"),
+])
+def test_fingerprint(query, text):
+    assert fingerprint(query) == text
+
+
+def test_values_share_one_memoized_fingerprint():
+    _fingerprint_shape.cache_clear()
+    for value in range(100):
+        fingerprint(f"SELECT * FROM t WHERE id = {value} AND name = 'user{value}'")
+    assert _fingerprint_shape.cache_info().currsize == 1
+
+
+def test_digest_groups_by_fingerprint_and_masks_examples():
+    digest = QueryDigest(max_entries=10)
+    digest.record("SELECT * FROM users WHERE email = 'a@example.com'", 2.0, rows=1, backend="10.0.0.1")
+    digest.record("SELECT * FROM users WHERE email = 'b@example.com'", 4.0, rows=0, backend="10.0.0.2", error=True)
+    [entry] = digest.top()
+    assert entry["count"] == 2
+    assert entry["errors"] == 1
+    assert entry["rows"] == 1
+    assert entry["total_ms"] == 6.0
+    assert entry["backends"] == {"10.0.0.1": 1, "10.0.0.2": 1}
+    assert entry["example"] == "SELECT * FROM users WHERE email = ?"
+
+
+def test_digest_keeps_the_most_executed_fingerprints():
+    digest = QueryDigest(max_entries=2)
+    for _ in range(5):
+        digest.record("SELECT * FROM a", 1.0)
+    digest.record("SELECT * FROM b", 1.0)
+    digest.record("SELECT * FROM c", 1.0)
+    fingerprints = {entry["fingerprint"] for entry in digest.top()}
+    assert fingerprints == {"SELECT * FROM A", "SELECT * FROM C"}
+    assert digest.stats() == {"fingerprints": 2, "evictions": 1}
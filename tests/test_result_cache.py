@@ -0,0 +1,27 @@
+import pytest
+
+from result_cache import normalize_query
+
+
+@pytest.mark.parametrize("query, key", [
+    ("SELECT  *\n FROM t ;", "SELECT * FROM t"),
+    ("select * from t;;", "select * from t"),
+    ("SELECT * FROM t", "SELECT * FROM t"),
+    # Line comments end at the line break
+    ("SELECT 1 -- c\n FROM t", "SELECT 1 -- c\nFROM t"),
+])
+def test_whitespace_and_semicolons(query, key):
+    assert normalize_query(query) == key
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM t WHERE a = 'x  y'",
+    "SELECT `a  b` FROM t",
+])
+def test_literals_and_identifiers_are_kept(query):
+    assert normalize_query(query) == query
+
+
+def test_different_literals_never_share_a_key():
+    assert normalize_query("SELECT * FROM t WHERE a = 'x y'") != normalize_query("SELECT * FROM t WHERE a = 'x  y'")
+    assert normalize_query("SELECT * FROM t WHERE a = 1") != normalize_query("SELECT * FROM t WHERE a = 2")
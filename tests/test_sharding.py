@@ -0,0 +1,81 @@
+from collections import namedtuple
+
+import pytest
+
+from sharding import ShardRouter, ShardingError, ShardPlan, merge_rowsets, shard_of
+
+Rowset = namedtuple("Rowset", ["columns", "rows"])
+
+GROUPS = 4
+
+
+@pytest.fixture
+def router():
+    return ShardRouter(GROUPS, {"Orders": "Customer_ID"})
+
+
+def test_shard_of_hashes_numbers_and_their_text_alike():
+    assert shard_of(42, GROUPS) == shard_of("42", GROUPS) == shard_of(42.0, GROUPS)
+    assert all(0 <= shard_of(value, GROUPS) < GROUPS for value in range(100))
+
+
+@pytest.mark.parametrize("query, params", [
+    ("SELECT * FROM orders WHERE customer_id = 42", None),
+    ("SELECT * FROM orders WHERE customer_id = '42'", None),
+    ("SELECT * FROM orders WHERE customer_id = %s", [42]),
+    ("SELECT * FROM orders WHERE total > 5 AND customer_id = 42", None),
+    ("DELETE FROM orders WHERE customer_id = 42", None),
+])
+def test_statements_pinned_to_a_key_run_on_its_group(router, query, params):
+    assert router.plan(query, params) == ShardPlan([shard_of(42, GROUPS)], [], None)
+
+
+def test_in_list_runs_on_the_groups_of_its_values(router):
+    plan = router.plan("SELECT * FROM orders WHERE customer_id IN (1, 2, 3)")
+    assert plan.groups == sorted({shard_of(value, GROUPS) for value in (1, 2, 3)})
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM orders",
+    "SELECT * FROM orders WHERE customer_id = 1 OR total = 2",
+    "SELECT * FROM orders WHERE customer_id = 1 + total",
+])
+def test_unpinned_reads_are_scattered(router, query):
+    assert router.plan(query).groups == list(range(GROUPS))
+
+
+def test_scattered_reads_keep_order_by_and_limit(router):
+    plan = router.plan("SELECT * FROM orders ORDER BY total DESC LIMIT 5")
+    assert plan == ShardPlan(list(range(GROUPS)), [("total", True)], 5)
+
+
+@pytest.mark.parametrize("query, params", [
+    ("INSERT INTO orders (customer_id, total) VALUES (7, 1.5)", None),
+    ("INSERT INTO orders (total, customer_id) VALUES (1.5, %s)", [7]),
+])
+def test_inserts_run_on_the_group_of_their_key(router, query, params):
+    assert router.plan(query, params).groups == [shard_of(7, GROUPS)]
+
+
+def test_reference_tables(router):
+    # Reads are served by the first group, writes keep every copy in step
+    assert router.plan("SELECT * FROM countries") is None
+    assert router.plan("UPDATE countries SET name = 'x'").groups == list(range(GROUPS))
+    assert router.plan("UPDATE orders SET total = 0").groups == list(range(GROUPS))
+
+
+@pytest.mark.parametrize("query", [
+    "INSERT INTO orders (total) VALUES (1)",
+    "INSERT INTO orders (customer_id) VALUES (1), (2)",
+    "UPDATE orders SET customer_id = 3 WHERE customer_id = 1",
+    "SELECT COUNT(*) FROM orders",
+])
+def test_unroutable_statements(router, query):
+    with pytest.raises(ShardingError):
+        router.plan(query)
+
+
+def test_merge_rowsets_sorts_and_trims():
+    plan = ShardPlan([0, 1], [("total", True)], 3)
+    rowsets = [Rowset(["id", "total"], [(1, 5), (2, None)]), Rowset(["id", "total"], [(3, 9), (4, 1)])]
+    assert merge_rowsets(rowsets, plan) == (["id", "total"], [(3, 9), (1, 5), (4, 1)])
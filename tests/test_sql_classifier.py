@@ -0,0 +1,77 @@
+import pytest
+
+from sql_classifier import classify, is_read_query, mask_literals
+
+
+@pytest.mark.parametrize("query, kind", [
+    ("SELECT * FROM actor WHERE id = 1", "select"),
+    ("select a from t1 join t2 on t1.id = t2.id", "select"),
+    ("WITH c AS (SELECT * FROM t) SELECT * FROM c", "select"),
+    ("(SELECT a FROM t) UNION (SELECT a FROM u)", "select"),
+    ("TABLE t", "select"),
+    ("/* comment */ SELECT 1", "select"),
+    ("-- comment\nSELECT 1", "select"),
+    ("SHOW TABLES", "show"),
+    ("desc t", "describe"),
+    ("EXPLAIN SELECT * FROM t", "explain"),
+    ("EXPLAIN ANALYZE SELECT * FROM t", "explain"),
+])
+def test_reads(query, kind):
+    classification = classify(query)
+    assert classification.kind == kind
+    assert classification.is_read
+    assert is_read_query(query)
+
+
+@pytest.mark.parametrize("query, kind", [
+    ("INSERT INTO t (a) VALUES (1)", "insert"),
+    ("REPLACE INTO t VALUES (1)", "replace"),
+    ("UPDATE t SET a = 'SELECT' WHERE b = 1", "update"),
+    ("DELETE FROM t WHERE a = 1", "delete"),
+    ("SELECT a INTO @x FROM t", "select"),
+    ("EXPLAIN ANALYZE DELETE FROM t", "explain"),
+    ("SET @a = 1", "set"),
+    ("BEGIN", "begin"),
+    ("CALL p()", "call"),
+])
+def test_writes(query, kind):
+    classification = classify(query)
+    assert classification.kind == kind
+    assert not classification.is_read
+
+
+@pytest.mark.parametrize("query, locking", [
+    ("SELECT * FROM t FOR UPDATE", "for update"),
+    ("SELECT * FROM t LOCK IN SHARE MODE", "lock in share mode"),
+])
+def test_locking_reads_go_to_the_manager(query, locking):
+    classification = classify(query)
+    assert classification.locking == locking
+    assert not classification.is_read
+
+
+@pytest.mark.parametrize("query, tables", [
+    ("SELECT * FROM actor WHERE id = 1", {"actor"}),
+    ("select a from t1 join t2 on t1.id = t2.id", {"t1", "t2"}),
+    ("SELECT * FROM db.t", {"t"}),
+    ("SELECT * FROM `my table` WHERE x = 'it''s'", {"my table"}),
+    ("WITH c AS (SELECT * FROM t) SELECT * FROM c", {"t"}),
+    ("SHOW TABLES", set()),
+])
+def test_tables(query, tables):
+    assert classify(query).tables == tables
+
+
+def test_literals_do_not_change_the_classification():
+    # A statement hidden in a string literal is data, not a second statement
+    classification = classify("SELECT * FROM t WHERE a = 'x; DELETE FROM u'")
+    assert classification.is_read
+    assert classification.tables == {"t"}
+    assert classify("SELECT * FROM t WHERE id = 1") == classify("SELECT * FROM t WHERE id = 2")
+
+
+def test_mask_literals():
+    assert mask_literals("SELECT * FROM t WHERE a = 'x' AND b = 0xFF AND c = 1.5e3") == \
+        "SELECT * FROM t WHERE a = ? AND b = ? AND c = ?"
+    # Identifiers and comments are kept as written
+    assert mask_literals("SELECT `c1` FROM t2 /* 'x' */") == "SELECT `c1` FROM t2 /* 'x' */"